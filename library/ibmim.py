@@ -30,6 +30,9 @@ options:
 		description: Path to installation directory of Installation Manager
   dest:
 		description: Path to destination installation directory
+	packages:
+		type: list
+		description: Packages to install with one imcl run, instead of id. An item is a package ID or a dict with id and optionally dest and features. Only the packages that are missing are installed. Packages going to different directories are installed through a generated response file
   im_shared:
 		description: Path to Installation Manager shared resources folder
   repositories:
@@ -49,7 +52,7 @@ options:
 			-	absent
 			- latest
 		default: present
-		description: Install a package with 'present'. Uninstall a package with 'absent'. Update all packages with 'latest'.
+		description: Install a package with 'present'. Uninstall a package with 'absent'. Update all packages with 'latest', which only runs imcl for the packages that have a newer version in the repositories.
 	install_fixes:
 		choices: 
 			- none
@@ -63,6 +66,47 @@ options:
 		description: Append the PassportAdvantage repository to the repository list
 	log:
 		description: Specify a log file that records the result of Installation Manager operations.
+	data_location:
+		description: Agent data location of Installation Manager, where installRegistry.xml is read from to find the installed packages. Defaults to cic.appDataLocation in its config.ini, or else /var/ibm/InstallationManager for root and ~/var/ibm/InstallationManager for other users
+	mirror:
+		default: false
+		type: bool
+		description: Mirror the http, https and file repositories into mirror_dir before installing or updating, and point imcl at the mirror. Files already in the mirror are reused, so only what changed in a repository is fetched again
+	mirror_dir:
+		default: /var/cache/ansible/ibmim
+		description: Directory holding the mirrored repositories. Files are stored once by their sha256 digest, so the directory may be shared between repositories and, on a shared mount, between hosts
+	mirror_concurrency:
+		default: 4
+		type: int
+		description: Number of files fetched at the same time while mirroring
+	mirror_manifest:
+		description: Name of a file in each repository listing its files with their sha256 digests, as written by sha256sum. The digests are verified and the files are found through the manifest instead of the directory listings of the web server
+	validate_certs:
+		default: true
+		type: bool
+		description: Validate the certificates of https repositories while mirroring
+	repository_index:
+		default: true
+		type: bool
+		description: Find the packages in the repositories from the names of their offering files and repository.xml instead of imcl, where every repository can be read that way. Used to find updates with state latest, and to fail early with state present when a package is in none of the repositories
+	repository_index_dir:
+		default: ~/.ansible/ibmim_index
+		description: Directory holding the indexes of the repositories. Nothing is written to the repositories themselves
+	progress_file:
+		description: Write the output of imcl to this file while it installs, updates or uninstalls, so that it can be followed during long runs. Defaults to a new file in ~/.ansible/ibmim_logs for every run. Its path is returned as the progress_file fact
+	output_tail:
+		default: 50
+		type: int
+		description: Number of lines at the end of the imcl output returned as stdout
+	lock_file:
+		default: /var/ibm/InstallationManager/ansible_ibmim.lock for root, ~/.ansible/ibmim_lock/ansible_ibmim.lock for other users
+		description: File locked on the host while the module runs, so that concurrent ibmim tasks wait for each other in the order they came instead of failing on the lock of Installation Manager. Looking up packages shares the lock, installing, updating and uninstalling takes it alone
+	lock_timeout:
+		default: 3600
+		type: int
+		description: Seconds to wait for the lock before failing
+	timings_file:
+		description: Append the timings of the imcl commands run to this file on the host, one JSON document per line
 '''
 
 EXAMPLES = '''
@@ -73,6 +117,27 @@ EXAMPLES = '''
     repositories:
 			-	http://was-repos/
 
+- name: Install WebSphere ND, Java and the web server plugins in one go
+  ibmim:
+    dest: /opt/IBM/WebSphere/AppServer
+    packages:
+      - com.ibm.websphere.ND.v85
+      - id: com.ibm.websphere.IBMJAVA.v71
+      - id: com.ibm.websphere.PLG.v85
+        dest: /opt/IBM/WebServer/Plugins
+        features: core.feature,com.ibm.jre.6_64bit
+    repositories:
+			-	http://was-repos/
+
+- name: Install WebSphere ND from a local mirror of the repository
+  ibmim:
+    name: com.ibm.websphere.ND.v85
+    dest: /opt/IBM/WebSphere/AppServer
+    mirror: true
+    mirror_dir: /nfs/im-mirror
+    repositories:
+      - http://was-repos/was85/
+
 - name: Uninstall WebSphere Application Server Liberty v8.5
 	ibmim:
 		name: com.ibm.websphere.liberty.v85
@@ -91,12 +156,20 @@ import platform
 import datetime
 import shutil
 import re
+import tempfile
+from xml.sax.saxutils import quoteattr
 
-from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.timings import TimedModule
+from ansible.module_utils.ibmim_lock import HostLock, LockError, defaultLockFile
+from ansible.module_utils.ibmim_mirror import Mirror, MirrorError, isMirrorable
+from ansible.module_utils.ibmim_repository import RepositoryError, availableVersions, isAvailable, repositoryIndex
+from ansible.module_utils.ibmim_registry import RegistryError, dataLocation, findPackage, findUpdates, parseListAvailable, parseListInstalled, readInstallRegistry
 
 class InstallationManager():
 
 	module = None
+	inventory = None
+	hostlock = None
 	module_facts = dict(
 		installed = False,
 		version = None,
@@ -104,12 +177,16 @@ class InstallationManager():
 		path = None,
 		name = None,
 		stdout = None,
-		stderr = None
+		stderr = None,
+		inventory_source = None,
+		available_source = None,
+		progress_file = None,
+		lock_wait = 0
 	)
 
 	def __init__(self):
 		# Read arguments
-		self.module = AnsibleModule(
+		self.module = TimedModule(
 			argument_spec = dict(
 
 				# install/uninstall/updateAll
@@ -124,6 +201,9 @@ class InstallationManager():
 				# -installationDirectory
 				dest      									= dict(required=False),
 
+				# Several packages installed at once
+				packages										= dict(required=False, type='list'),
+
 				# -sharedResourcesDirectory
 				im_shared 									= dict(required=False),
 
@@ -143,9 +223,32 @@ class InstallationManager():
 				install_fixes 							= dict(default='none', choices=['none', 'recommended', 'all']),
 
 				# -log
-				log													= dict(required=False)
+				log													= dict(required=False),
+
+				# Agent data location holding installRegistry.xml
+				data_location								= dict(required=False),
+
+				# Local mirror of the repositories
+				mirror											= dict(default=False, type='bool'),
+				mirror_dir									= dict(default='/var/cache/ansible/ibmim'),
+				mirror_concurrency					= dict(default=4, type='int'),
+				mirror_manifest							= dict(required=False),
+				validate_certs							= dict(default=True, type='bool'),
+
+				# Index of the offerings in the repositories
+				repository_index						= dict(default=True, type='bool'),
+				repository_index_dir				= dict(default='~/.ansible/ibmim_index'),
+
+				# Output of imcl
+				progress_file								= dict(required=False),
+				output_tail									= dict(default=50, type='int'),
+
+				# Host-wide lock
+				lock_file										= dict(required=False),
+				lock_timeout								= dict(default=3600, type='int')
 
 			),
+			mutually_exclusive = [['id', 'packages']],
 			supports_check_mode = True
 		)
 
@@ -166,65 +269,101 @@ class InstallationManager():
 		if dest:
 			if not os.path.exists(dest):
 				return False
-		return self.getVersion(packageId)["installed"]
+		return self.getVersion(packageId, dest=dest)["installed"]
 
 
-	def getVersion(self, packageId):
-
-		child = subprocess.Popen(
+	def lock(self, shared):
+		"""
+		Takes the host-wide lock, waiting behind the tasks that asked for it
+		earlier. Going from shared to exclusive means queueing again, so the
+		installed packages are read again afterwards.
+		:return: True if the installed packages changed while waiting
+		"""
+		upgrade = self.hostlock.shared is True and not shared
+		try:
+			waited = self.hostlock.acquire(shared)
+		except LockError as e:
+			self.module.fail_json(msg=str(e), ansible_facts=self.module_facts)
+		self.module_facts["lock_wait"] = round(self.module_facts["lock_wait"] + waited, 3)
+		if not upgrade or self.inventory is None:
+			return False
+		before = self.inventory
+		return self.getInventory(refresh=True) != before
+
+	def getInventory(self, refresh=False):
+		"""
+		Returns the installed packages. They are read from installRegistry.xml in
+		the agent data location, and only if that fails from imcl listInstalledPackages
+		:param refresh: read them again even if they were read before
+		:return: dict keyed by package ID and installation directory
+		"""
+		if self.inventory is not None and not refresh:
+			return self.inventory
+
+		location = self.module.params['data_location'] or dataLocation(self.module.params['ibmim'])
+		try:
+			self.inventory = readInstallRegistry(os.path.join(location, "installRegistry.xml"))
+			self.module_facts["inventory_source"] = "registry"
+			return self.inventory
+		except RegistryError:
+			pass
+
+		rc, stdout_value, stderr_value = self.module.runCommand(
 			["{0}/eclipse/tools/imcl "
 			 " listInstalledPackages "
 			 " -long".format(self.module.params['ibmim'])],
+			label="listInstalledPackages",
 			shell=True,
-			stdout=subprocess.PIPE,
-			stderr=subprocess.PIPE
+			universal_newlines=True
 		)
 
-		stdout_value, stderr_value = child.communicate()
-			
 		# Store stdout and stderr
 		self.module_facts["stdout"] = stdout_value
 		self.module_facts["stderr"] = stderr_value
 
-		if child.returncode != 0:
+		if rc != 0:
 			self.module.fail_json(
-				msg="Error getting installed version of package '{0}'".format(packageId),
+				msg="Error getting installed packages",
 				stdout=stdout_value
-			)		
-
-		for line in stdout_value.split(os.linesep):
-			if packageId in line:
-				linesplit = line.split(" : ")
-				self.module_facts["installed"] = True
-				self.module_facts["path"] = linesplit[0]
-				self.module_facts["id"] = linesplit[1]
-				self.module_facts["name"] = linesplit[2]
-				self.module_facts["version"] = linesplit[3]
-				break
+			)
 
-		return self.module_facts
+		self.inventory = parseListInstalled(stdout_value)
+		self.module_facts["inventory_source"] = "imcl"
+		return self.inventory
 
-	def install(self, module_params):
-
-		# Check mode on
-		if self.module.check_mode:
-			self.module.exit_json(msg="Package '{0}' is to be installed".format(module_params['id']))
 
-		# Check wether package is already installed
-		if self.isProvisioned(module_params['dest'], module_params['id']):
-			self.module.exit_json(changed=False, msg="Package '{0}' is already installed".format(module_params['id']), ansible_facts=self.module_facts)
+	def getVersion(self, packageId, refresh=False, dest=None):
+		"""
+		Looks up a package by its exact ID and stores what is known about it in module_facts
+		:param packageId: package ID, optionally followed by _version
+		:param refresh: read the inventory again, e.g. after installing
+		:param dest: installation directory the package has to be in, any if None
+		:return: dict
+		"""
+		package = findPackage(self.getInventory(refresh), packageId, dest)
+		if package:
+			self.module_facts["installed"] = True
+			self.module_facts["path"] = package["path"]
+			self.module_facts["id"] = "{0}_{1}".format(package["id"], package["version"])
+			self.module_facts["name"] = package["name"]
+			self.module_facts["version"] = package["version"]
 
-		# Check if one of repositories and connectPassportAdvantage is provided
-		if not module_params['repositories'] and not module_params['connect_passport_advantage']:
-			self.module.fail_json(msg="One or more repositories are required when installing packages")
+		return self.module_facts
 
+	def installCommand(self, module_params, packages, dest):
+		"""
+		Builds the imcl install command line
+		:param packages: list of package IDs, each optionally followed by ,feature,feature
+		:param dest: installation directory shared by all packages, or None
+		:return: str
+		"""
 		cmd = ("{0}/eclipse/tools/imcl install {1} "
 						"-repositories {2} "
 						"-acceptLicense "
-						"-stopBlockingProcesses ").format(module_params['ibmim'], module_params['id'], ",".join(module_params['repositories']))
+						"-stopBlockingProcesses ").format(module_params['ibmim'], " ".join(packages), ",".join(module_params['repositories'] or []))
 
-		if module_params['dest']:
-			cmd = "{0} -installationDirectory {1} ".format(cmd, module_params['dest'])
+		if dest:
+			cmd = "{0} -installationDirectory {1} ".format(cmd, dest)
 		if module_params['im_shared']:
 			cmd = "{0} -sharedResourcesDirectory {1} ".format(cmd, module_params['im_shared'])
 		if module_params['properties']: 
@@ -237,24 +376,248 @@ class InstallationManager():
 			cmd = "{0} -connectPassportAdvantage ".format(cmd)
 		if module_params['log']:
 			cmd = "{0} -log {1} ".format(cmd, module_params['log'])
+		return cmd
+
+	def responseFile(self, module_params, packages):
+		"""
+		Generates a response file that installs packages into several directories at once
+		:param packages: list of package dicts from getPackages()
+		:return: str
+		"""
+		groups = {}
+		for package in self.getInventory().values():
+			if package['path']:
+				groups[package['path']] = package['name']
+
+		lines = ["<?xml version='1.0' encoding='UTF-8'?>", "<agent-input acceptLicense='true'>", "  <server>"]
+		for repository in module_params['repositories'] or []:
+			lines.append("    <repository location={0}/>".format(quoteattr(repository)))
+		lines.append("  </server>")
+
+		profiles = []
+		for package in packages:
+			if package['dest'] not in profiles:
+				profiles.append(package['dest'])
+		for dest in profiles:
+			lines.append("  <profile id={0} installLocation={1}>".format(quoteattr(groups.get(dest, dest)), quoteattr(dest)))
+			lines.append("    <data key='eclipseLocation' value={0}/>".format(quoteattr(dest)))
+			for prop in module_params['properties'] or []:
+				for item in prop.split(","):
+					key, value = (item.split("=", 1) + [""])[:2]
+					lines.append("    <data key={0} value={1}/>".format(quoteattr(key), quoteattr(value)))
+			lines.append("  </profile>")
+
+		lines.append("  <install>")
+		for package in packages:
+			offering = "    <offering id={0} profile={1} installFixes={2}".format(
+				quoteattr(package['id']),
+				quoteattr(groups.get(package['dest'], package['dest'])),
+				quoteattr(module_params['install_fixes'])
+			)
+			if package.get('version'):
+				offering += " version={0}".format(quoteattr(package['version']))
+			if package['features']:
+				offering += " features={0}".format(quoteattr(",".join(package['features'])))
+			lines.append(offering + "/>")
+		lines.append("  </install>")
 
-		child = subprocess.Popen(
-			[cmd], 
-			shell=True, 
-			stdout=subprocess.PIPE, 
-			stderr=subprocess.PIPE
+		if module_params['im_shared']:
+			lines.append("  <preference name='com.ibm.cic.common.core.preferences.eclipseCache' value={0}/>".format(quoteattr(module_params['im_shared'])))
+		for pref in module_params['preferences'] or []:
+			for item in pref.split(","):
+				key, value = (item.split("=", 1) + [""])[:2]
+				lines.append("  <preference name={0} value={1}/>".format(quoteattr(key), quoteattr(value)))
+		lines.append("</agent-input>")
+		return "\n".join(lines) + "\n"
+
+	def getPackages(self, module_params):
+		"""
+		Turns the packages parameter into a list of dicts with the keys id, dest and features
+		:return: list
+		"""
+		packages = []
+		for item in module_params['packages']:
+			if not isinstance(item, dict):
+				item = dict(id=item)
+			if not item.get('id'):
+				self.module.fail_json(msg="Each item in packages needs an id: {0}".format(item))
+			features = item.get('features') or []
+			if not isinstance(features, list):
+				features = [f.strip() for f in str(features).split(",") if f.strip()]
+			packages.append(dict(id=item['id'], dest=item.get('dest') or module_params['dest'], features=features))
+		return packages
+
+	def mirrorRepositories(self, module_params):
+		"""
+		Brings the local mirror of each http, https and file repository up to
+		date
+		:return: copy of module_params with the repositories pointing at the mirrors
+		"""
+		if not module_params['mirror'] or self.module.check_mode:
+			return module_params
+		repositories = []
+		mirrors = []
+		for repository in module_params['repositories'] or []:
+			if not isMirrorable(repository):
+				repositories.append(repository)
+				continue
+			mirror = Mirror(
+				repository,
+				os.path.expanduser(module_params['mirror_dir']),
+				concurrency=module_params['mirror_concurrency'],
+				manifest=module_params['mirror_manifest'],
+				validate_certs=module_params['validate_certs']
+			)
+			started = datetime.datetime.now()
+			try:
+				path = mirror.sync()
+			except (MirrorError, IOError, OSError) as e:
+				self.module.fail_json(msg="Failed mirroring repository {0}: {1}".format(repository, e))
+			repositories.append(path)
+			mirrors.append(dict(mirror.stats, repository=repository, path=path, wall=round((datetime.datetime.now() - started).total_seconds(), 3)))
+		self.module_facts['mirrors'] = mirrors
+		return dict(module_params, repositories=repositories)
+
+	def runImcl(self, module_params, cmd, label):
+		"""
+		Runs an imcl command that installs, updates or uninstalls, with its
+		progress going to the progress file as it comes
+		:return: tuple of returncode, the last output_tail lines of the output and an empty stderr, as it goes to the same file
+		"""
+		path = module_params['progress_file']
+		if path:
+			path = os.path.expanduser(path)
+		else:
+			directory = os.path.expanduser("~/.ansible/ibmim_logs")
+			if not os.path.isdir(directory):
+				os.makedirs(directory, 0o700)
+			path = os.path.join(directory, "imcl_{0}_{1}_{2}.log".format(label, datetime.datetime.now().strftime("%Y%m%d%H%M%S"), os.getpid()))
+		self.module_facts['progress_file'] = path
+		rc, tail = self.module.streamCommand(["{0} -showProgress".format(cmd)], path, label=label, tail=module_params['output_tail'], shell=True)
+		return rc, tail, ""
+
+	def runInstall(self, module_params, packages, label="install"):
+		"""
+		Installs packages with one imcl run. Packages going to the same directory
+		are installed from the command line, otherwise a response file is needed
+		to give each its own directory
+		:param packages: list of package dicts with the keys id, dest, features and optionally version
+		:return: tuple of returncode, stdout and stderr
+		"""
+		dests = set([p['dest'] for p in packages])
+		if len(dests) == 1:
+			specs = []
+			for p in packages:
+				spec = p['id'] if not p.get('version') else "{0}_{1}".format(p['id'], p['version'])
+				specs.append(",".join([spec] + p['features']))
+			return self.runImcl(module_params, self.installCommand(module_params, specs, dests.pop()), label)
+
+		if None in dests:
+			self.module.fail_json(msg="dest is required for every package when they are installed into different directories")
+		fd, path = tempfile.mkstemp(suffix=".xml")
+		try:
+			os.write(fd, self.responseFile(module_params, packages).encode('utf-8'))
+			os.close(fd)
+			cmd = "{0}/eclipse/tools/imcl input {1} -acceptLicense -stopBlockingProcesses".format(module_params['ibmim'], path)
+			if module_params['connect_passport_advantage']:
+				cmd = "{0} -connectPassportAdvantage ".format(cmd)
+			if module_params['log']:
+				cmd = "{0} -log {1} ".format(cmd, module_params['log'])
+			return self.runImcl(module_params, cmd, label)
+		finally:
+			os.unlink(path)
+
+	def installPackages(self, module_params):
+		"""
+		Installs all missing packages of the packages parameter with one imcl run
+		"""
+		packages = self.getPackages(module_params)
+
+		# Find the missing packages with one look at the inventory
+		inventory = self.getInventory()
+		missing = []
+		for package in packages:
+			found = findPackage(inventory, package['id'], package['dest'])
+			package['installed_before'] = found is not None
+			package['changed'] = not package['installed_before']
+			if package['changed']:
+				missing.append(package)
+
+		if not missing:
+			self.module.exit_json(changed=False, msg="All packages are already installed", ansible_facts=self.packageFacts(packages))
+		self.checkAvailable(module_params, [p['id'] for p in missing])
+		if self.module.check_mode:
+			self.module.exit_json(changed=True, msg="Packages {0} are to be installed".format(", ".join([p['id'] for p in missing])), ansible_facts=self.packageFacts(packages))
+
+		# Check if one of repositories and connectPassportAdvantage is provided
+		if not module_params['repositories'] and not module_params['connect_passport_advantage']:
+			self.module.fail_json(msg="One or more repositories are required when installing packages")
+
+		module_params = self.mirrorRepositories(module_params)
+		if self.lock(shared=False):
+			return self.installPackages(module_params)
+		rc, stdout_value, stderr_value = self.runInstall(module_params, missing)
+		if rc != 0:
+			self.module.fail_json(
+				msg="Failed installing packages {0}".format(", ".join([p['id'] for p in missing])),
+				stdout=stdout_value,
+				stderr=stderr_value,
+				ansible_facts=self.packageFacts(packages)
+			)
+
+		# After install, read the inventory again so that we can show the versions to the user
+		self.getInventory(refresh=True)
+		self.module.exit_json(
+			changed=True,
+			msg="Packages {0} installed".format(", ".join([p['id'] for p in missing])),
+			stdout=stdout_value,
+			ansible_facts=self.packageFacts(packages)
 		)
 
-		stdout_value, stderr_value = child.communicate()
-		if child.returncode != 0:
+	def packageFacts(self, packages):
+		"""
+		Adds what the inventory knows to each package
+		:return: dict with the facts to return
+		"""
+		for package in packages:
+			found = findPackage(self.getInventory(), package['id'], package['dest'])
+			package['installed'] = found is not None
+			package['version'] = found and found['version']
+			package['path'] = found and found['path']
+			package['name'] = found and found['name']
+		return dict(self.module_facts, packages=packages)
+
+	def install(self, module_params):
+
+		# Check mode on
+		if self.module.check_mode:
+			self.module.exit_json(msg="Package '{0}' is to be installed".format(module_params['id']))
+
+		# Check wether package is already installed
+		if self.isProvisioned(module_params['dest'], module_params['id']):
+			self.module.exit_json(changed=False, msg="Package '{0}' is already installed".format(module_params['id']), ansible_facts=self.module_facts)
+
+		# Check if one of repositories and connectPassportAdvantage is provided
+		if not module_params['repositories'] and not module_params['connect_passport_advantage']:
+			self.module.fail_json(msg="One or more repositories are required when installing packages")
+
+		module_params = self.mirrorRepositories(module_params)
+		self.checkAvailable(module_params, [module_params['id']])
+		if self.lock(shared=False):
+			return self.install(module_params)
+		cmd = self.installCommand(module_params, [module_params['id']], module_params['dest'])
+
+		rc, stdout_value, stderr_value = self.runImcl(module_params, cmd, "install")
+		if rc != 0:
 			self.module.fail_json(
 				msg="Failed installing package '{0}'".format(module_params['id']),
 				stdout=stdout_value,
-				stderr=stderr_value
+				stderr=stderr_value,
+				ansible_facts=self.module_facts
 		)
 
 		# After install, get versionInfo so that we can show it to the user
-		self.getVersion(module_params['id'])
+		self.getVersion(module_params['id'], refresh=True, dest=module_params['dest'])
 		self.module.exit_json(changed=True, msg="Package '{0}' installed".format(module_params['id']), ansible_facts=self.module_facts)
 
 	def uninstall(self, module_params):
@@ -267,6 +630,9 @@ class InstallationManager():
 		if not self.isProvisioned(module_params['dest'], module_params['id']):
 			self.module.exit_json(changed=False, msg="Package '{0}' is not installed".format(module_params['id']), ansible_facts=self.module_facts)
 
+		if self.lock(shared=False):
+			return self.uninstall(module_params)
+
 		cmd = "{0}/eclipse/tools/imcl uninstall {1} ".format(module_params['ibmim'], module_params['id'])
 
 		if module_params['dest']:
@@ -278,32 +644,112 @@ class InstallationManager():
 		if module_params['log']:
 			cmd = "{0} -log {1} ".format(cmd, module_params['log'])
 
-		child = subprocess.Popen(
-			[cmd], 
-			shell=True, 
-			stdout=subprocess.PIPE, 
-			stderr=subprocess.PIPE
-		)
-		stdout_value, stderr_value = child.communicate()
-		if child.returncode != 0:
-			self.module.fail_json(msg="Failed uninstalling package '{0}'".format(module_params['id']))
+		rc, stdout_value, stderr_value = self.runImcl(module_params, cmd, "uninstall")
+		if rc != 0:
+			self.module.fail_json(msg="Failed uninstalling package '{0}'".format(module_params['id']), stdout=stdout_value, ansible_facts=self.module_facts)
 
 		# Remove AppServer dir forcefully so that it doesn't prevents us from reinstalling.
 		shutil.rmtree(module_params['dest'], ignore_errors=False, onerror=None)
 		self.module.exit_json(changed=True, msg="Package '{0}' uninstalled".format(module_params['id']), ansible_facts=self.module_facts)
 
-	def updateAll(self, module_params):
+	def indexRepositories(self, module_params):
+		"""
+		Reads the packages in the repositories from their indexes
+		:return: dict keyed by package ID with the available versions, or None if a repository can't be indexed
+		"""
+		if not module_params['repository_index'] or not module_params['repositories'] or module_params['connect_passport_advantage']:
+			return None
+		indexes = []
+		for repository in module_params['repositories']:
+			try:
+				index, cached = repositoryIndex(repository, module_params['repository_index_dir'], validate_certs=module_params['validate_certs'])
+			except RepositoryError:
+				return None
+			# A repository laid out in a way the index doesn't know
+			if not index['offerings']:
+				return None
+			indexes.append(index)
+		self.module_facts['available_source'] = "index"
+		return availableVersions(indexes)
+
+	def checkAvailable(self, module_params, packageIds):
+		"""
+		Fails when the repositories can be indexed and a package is in none of them
+		"""
+		available = self.indexRepositories(module_params)
+		if available is None:
+			return
+		missing = [packageId for packageId in packageIds if not isAvailable(available, packageId)]
+		if missing:
+			self.module.fail_json(msg="Packages {0} not found in the repositories".format(", ".join(missing)), ansible_facts=self.module_facts)
+
+	def listAvailable(self, module_params):
+		"""
+		Lists the packages in the repositories from their indexes, or else with
+		imcl listAvailablePackages
+		:return: dict keyed by package ID with the available versions, or None if it failed
+		"""
+		available = self.indexRepositories(module_params)
+		if available is not None:
+			return available
 
-		# Check mode on
-		if self.module.check_mode:
-			self.module.exit_json(changed=False, msg="All installed packages are to be updated".format(module_params['id']), ansible_facts=self.module_facts)
+		cmd = "{0}/eclipse/tools/imcl listAvailablePackages".format(module_params['ibmim'])
+		if module_params['repositories']:
+			cmd = "{0} -repositories {1} ".format(cmd, ",".join(module_params['repositories']))
+		if module_params['preferences']:
+			cmd = "{0} -preferences {1} ".format(cmd, ",".join(module_params['preferences']))
+		if module_params['connect_passport_advantage']:
+			cmd = "{0} -connectPassportAdvantage ".format(cmd)
+
+		rc, stdout_value, stderr_value = self.module.runCommand([cmd], label="listAvailablePackages", shell=True, universal_newlines=True)
+		if rc != 0:
+			return None
+		self.module_facts['available_source'] = "imcl"
+		return parseListAvailable(stdout_value)
+
+	def updateAll(self, module_params):
 
 		# Check if one of repositories and connectPassportAdvantage is provided
 		if not module_params['repositories'] and not module_params['connect_passport_advantage']:
 			self.module.fail_json(msg="One or more repositories are required when installing packages")
 
+		module_params = self.mirrorRepositories(module_params)
+
+		# Find out which installed packages have a newer version in the
+		# repositories. Fixes aren't packages, so leave it to updateAll when
+		# they are to be installed as well.
+		updates = None
+		if module_params['install_fixes'] == 'none':
+			available = self.listAvailable(module_params)
+			if available is not None:
+				updates = findUpdates(self.getInventory(), available)
+				self.module_facts["updates"] = updates
+
+		if updates == []:
+			self.module.exit_json(changed=False, msg="All packages are up to date", ansible_facts=self.module_facts)
+
+		# Check mode on
+		if self.module.check_mode:
+			if updates:
+				self.module.exit_json(changed=True, msg="Packages {0} are to be updated".format(", ".join([p['id'] for p in updates])), ansible_facts=self.module_facts)
+			self.module.exit_json(changed=False, msg="All installed packages are to be updated", ansible_facts=self.module_facts)
+
+		if self.lock(shared=False):
+			return self.updateAll(module_params)
+
+		# Update only the packages that have a newer version
+		if updates:
+			rc, stdout_value, stderr_value = self.runInstall(
+				module_params,
+				[dict(id=p['id'], version=p['latest'], dest=p['path'], features=[]) for p in updates],
+				label="update"
+			)
+			if rc != 0:
+				self.module.fail_json(msg="Failed updating packages", stdout=stdout_value, stderr=stderr_value, ansible_facts=self.module_facts)
+			self.module.exit_json(changed=True, msg="Packages {0} updated".format(", ".join([p['id'] for p in updates])), ansible_facts=self.module_facts)
+
 		cmd = ("{0}/eclipse/tools/imcl updateAll "
-						"-acceptLicense -repositories {1}").format(module_params['ibmim'], ",".join(module_params['repositories']))
+						"-acceptLicense -repositories {1}").format(module_params['ibmim'], ",".join(module_params['repositories'] or []))
 
 		if module_params['preferences']:
 			cmd = "{0} -preferences {1} ".format(cmd, ",".join(module_params['preferences']))
@@ -316,16 +762,9 @@ class InstallationManager():
 		if module_params['log']:
 			cmd = "{0} -log {1} ".format(cmd, module_params['log'])
 
-		child = subprocess.Popen(
-			[cmd], 
-			shell=True, 
-			stdout=subprocess.PIPE, 
-			stderr=subprocess.PIPE
-		)
-		stdout_value, stderr_value = child.communicate()
-		
-		if child.returncode != 0:
-			self.module.fail_json(msg="Failed updating packages", stdout=stdout_value, stderr=stderr_value)		
+		rc, stdout_value, stderr_value = self.runImcl(module_params, cmd, "updateAll")
+		if rc != 0:
+			self.module.fail_json(msg="Failed updating packages", stdout=stdout_value, stderr=stderr_value, ansible_facts=self.module_facts)
 
 		self.module.exit_json(changed=True, msg="All packages updated", ansible_facts=self.module_facts)
 
@@ -335,11 +774,22 @@ class InstallationManager():
 		if not os.path.exists("{0}/eclipse".format(self.module.params['ibmim'])):
 			self.module.fail_json(
 				msg="IBM Installation Manager is not installed. Install it and try again.")
+
+		# Everything starts out looking, which other tasks may do at the same time
+		self.hostlock = HostLock(os.path.expanduser(self.module.params['lock_file'] or defaultLockFile()), self.module.params['lock_timeout'])
+		self.lock(shared=True)
 		
 		# Install
 		if self.module.params['state'] == 'present':
+				if self.module.params['packages']:
+					self.installPackages(self.module.params)
+				if not self.module.params['id']:
+					self.module.fail_json(msg="One of id and packages is required when installing packages")
 				self.install(self.module.params)
 				
+		if self.module.params['packages']:
+			self.module.fail_json(msg="packages can only be used with state=present")
+
 		# Uninstall
 		if self.module.params['state'] == 'absent':
 				self.uninstall(self.module.params)
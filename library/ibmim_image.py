@@ -0,0 +1,513 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+DOCUMENTATION = """
+module: ibmim_image
+version_added: "1.9.4"
+short_description: Capture or restore an image of Installation Manager and the products it installed
+description:
+  - Captures Installation Manager, its agent data with the registry of installed packages, and the directories of
+    every installed product into one compressed archive, and restores it onto other hosts, optionally at other paths.
+  - Files with the same content are stored once. A manifest at the start of the archive lists every directory, file
+    and link, so that restoring reads the archive once from start to end.
+options:
+  state:
+    required: true
+    choices: [ captured, restored ]
+    description:
+      - captured writes the archive from the installation on the host, restored installs the archive on the host
+  archive:
+    required: true
+    description:
+      - Path to the archive
+  ibmim:
+    required: false
+    default: /opt/IBM/InstallationManager
+    description:
+      - Path to installation directory of Installation Manager
+  data_location:
+    required: false
+    description:
+      - Agent data location of Installation Manager. Defaults to cic.appDataLocation in its config.ini, or else
+        /var/ibm/InstallationManager for root and ~/var/ibm/InstallationManager for other users
+  paths:
+    required: false
+    description:
+      - Further directories to capture, e.g. the shared resources directory. The installation directories of all
+        installed packages are captured without being listed here
+  relocate:
+    required: false
+    description:
+      - Dict of captured paths to the paths they are restored to. Links and the .xml, .ini, .properties and .prefs
+        files of Installation Manager and its data location that name a captured path, like installRegistry.xml and
+        config.ini, are rewritten to name the new one. Other files naming a captured path are returned in unrelocated
+  force:
+    required: false
+    default: false
+    description:
+      - Capture even if the archive exists, or restore even if the directories are not empty
+  lock_file:
+    required: false
+    default: /var/ibm/InstallationManager/ansible_ibmim.lock for root, ~/.ansible/ibmim_lock/ansible_ibmim.lock for other users
+    description:
+      - Host-wide lock shared with ibmim, held while capturing or restoring
+  lock_timeout:
+    required: false
+    default: 3600
+    description:
+      - Seconds to wait for the lock before failing
+author: "Amir Mofasser (@amofasser)"
+"""
+
+EXAMPLES = """
+# Capture on a host that was installed with ibmim:
+- ibmim_image: state=captured archive=/nfs/images/was855.tar.gz
+# Restore on a new host:
+- ibmim_image:
+    state: restored
+    archive: /nfs/images/was855.tar.gz
+    relocate:
+      /opt/IBM/WebSphere/AppServer: /apps/was
+"""
+
+import datetime
+import grp
+import hashlib
+import json
+import os
+import pwd
+import shutil
+import socket
+import stat
+import tarfile
+import tempfile
+
+from ansible.module_utils.ibmim_lock import HostLock, LockError, defaultLockFile
+from ansible.module_utils.ibmim_registry import RegistryError, dataLocation, readInstallRegistry
+
+IMAGE_VERSION = 2
+MANIFEST = "manifest.json"
+MARKER = ".ansible_image.json"
+CHUNK = 1024 * 1024
+IM_FILES = ('.xml', '.ini', '.properties', '.prefs')
+
+
+def captureRoots(module):
+    """
+    Lists the directories to capture, i.e. Installation Manager, its data
+    location, the installation directory of every installed package and paths
+    :return: tuple of the data location and the list of absolute paths
+    """
+    ibmim = os.path.expanduser(module.params['ibmim'])
+    location = os.path.expanduser(module.params['data_location'] or dataLocation(ibmim))
+    try:
+        packages = readInstallRegistry(os.path.join(location, "installRegistry.xml"))
+    except RegistryError as e:
+        module.fail_json(msg="No Installation Manager to capture: {0}".format(e))
+    roots = [ibmim, location]
+    roots.extend([p['path'] for p in packages.values() if p['path']])
+    roots.extend([os.path.expanduser(p) for p in module.params['paths'] or []])
+
+    # Directories within other ones are captured with those
+    roots = sorted(set([os.path.realpath(root) for root in roots]))
+    result = []
+    for root in roots:
+        if not [r for r in result if (root + os.sep).startswith(r + os.sep)]:
+            result.append(root)
+    return os.path.realpath(location), result
+
+
+def fileDigest(path):
+    sha = hashlib.sha256()
+    f = open(path, 'rb')
+    try:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            sha.update(chunk)
+    finally:
+        f.close()
+    return sha.hexdigest()
+
+
+def namesPath(path, roots):
+    """
+    Tells whether a text file names one of roots. Files with NUL bytes are
+    taken for binary and only reported, as a path of another length would
+    break them.
+    :return: tuple of True if a root is named and True if the file is text
+    """
+    needles = [root.encode('utf-8') for root in roots]
+    f = open(path, 'rb')
+    try:
+        head = f.read(8192)
+        text = b"\0" not in head
+        carry = b""
+        data = head
+        while data:
+            window = carry + data
+            for needle in needles:
+                if needle in window:
+                    return True, text
+            carry = window[-4096:]
+            data = f.read(CHUNK)
+    finally:
+        f.close()
+    return False, text
+
+
+def imConfig(path, ibmim, location):
+    """
+    :return: whether path is a configuration or registry file of Installation Manager or its data location
+    """
+    return path.endswith(IM_FILES) and any([(path + os.sep).startswith(d + os.sep) for d in (ibmim, location)])
+
+
+def owner(st, names):
+    """
+    :param names: dict caching user and group names by ('u', uid) and ('g', gid)
+    :return: list of uid, gid, user name and group name, the names None if unknown
+    """
+    for key, lookup in ((('u', st.st_uid), pwd.getpwuid), (('g', st.st_gid), grp.getgrgid)):
+        if key not in names:
+            try:
+                names[key] = lookup(key[1])[0]
+            except KeyError:
+                names[key] = None
+    return [st.st_uid, st.st_gid, names[('u', st.st_uid)], names[('g', st.st_gid)]]
+
+
+def buildManifest(ibmim, location, roots):
+    """
+    Walks roots without following links
+    :return: dict with the roots and their owners, a list of entries [root, relative path, type, mode, mtime,
+             sha256 or link, size, relocate, uid, gid, user, group] and the files that name a root and are not relocated
+    """
+    entries = []
+    unrelocated = []
+    names = {}
+    for index, root in enumerate(roots):
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in sorted(dirnames + filenames):
+                path = os.path.join(dirpath, name)
+                rel = os.path.relpath(path, root)
+                if path == os.path.join(ibmim, MARKER):
+                    continue
+                st = os.lstat(path)
+                if stat.S_ISLNK(st.st_mode):
+                    target = os.readlink(path)
+                    entries.append([index, rel, 'l', 0, st.st_mtime, target, 0, any([target.startswith(r) for r in roots])] + owner(st, names))
+                elif stat.S_ISDIR(st.st_mode):
+                    entries.append([index, rel, 'd', stat.S_IMODE(st.st_mode), st.st_mtime, None, 0, False] + owner(st, names))
+                elif stat.S_ISREG(st.st_mode):
+                    named, text = namesPath(path, roots)
+                    relocate = named and text and imConfig(path, ibmim, location)
+                    if named and not relocate:
+                        unrelocated.append(path)
+                    entries.append([index, rel, 'f', stat.S_IMODE(st.st_mode), st.st_mtime, fileDigest(path), st.st_size, relocate] + owner(st, names))
+    return dict(
+        version=IMAGE_VERSION,
+        created=datetime.datetime.utcnow().isoformat() + "Z",
+        host=socket.gethostname(),
+        ibmim=ibmim,
+        roots=roots,
+        owners=[owner(os.lstat(root), names) for root in roots],
+        entries=entries,
+        unrelocated=unrelocated
+    )
+
+
+def capture(ibmim, location, roots, archive):
+    """
+    Writes the manifest and then every distinct file content once, named by its digest
+    :return: the manifest
+    """
+    manifest = buildManifest(ibmim, location, roots)
+
+    directory = os.path.dirname(os.path.abspath(archive))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        tar = tarfile.open(tmp, "w:gz")
+        try:
+            data = json.dumps(manifest).encode('utf-8')
+            info = tarfile.TarInfo(MANIFEST)
+            info.size = len(data)
+            info.mtime = 0
+            tar.addfile(info, _BytesReader(data))
+            seen = set()
+            for entry in manifest['entries']:
+                root, rel, kind, digest, size = entry[0], entry[1], entry[2], entry[5], entry[6]
+                if kind != 'f' or digest in seen:
+                    continue
+                seen.add(digest)
+                info = tarfile.TarInfo("blobs/" + digest)
+                info.size = size
+                info.mtime = 0
+                f = open(os.path.join(roots[root], rel), 'rb')
+                try:
+                    tar.addfile(info, f)
+                finally:
+                    f.close()
+        finally:
+            tar.close()
+        os.rename(tmp, archive)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return manifest
+
+
+class _BytesReader(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.data)
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+def relocated(path, mapping):
+    """
+    :return: path with the longest matching captured path replaced
+    """
+    for old in sorted(mapping, key=len, reverse=True):
+        if path == old or path.startswith(old + os.sep):
+            return mapping[old] + path[len(old):]
+    return path
+
+
+class _Owners(object):
+    """
+    Finds the uid and gid to restore a captured owner with, by the user and
+    group names where they exist on the host and by the captured ids otherwise
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.groups = {}
+
+    def _id(self, ids, name, captured, lookup):
+        if name is None:
+            return captured
+        if name not in ids:
+            try:
+                ids[name] = lookup(name)[2]
+            except KeyError:
+                ids[name] = captured
+        return ids[name]
+
+    def chown(self, path, uid, gid, user, group):
+        os.lchown(path, self._id(self.users, user, uid, pwd.getpwnam), self._id(self.groups, group, gid, grp.getgrnam))
+
+
+def rewrite(path, mapping):
+    """
+    Replaces the captured paths in a text file with the ones they are restored to
+    """
+    f = open(path, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    # Longest first, so that a root within another one is replaced as a whole
+    for old in sorted(mapping, key=len, reverse=True):
+        if mapping[old] != old:
+            data = data.replace(old.encode('utf-8'), mapping[old].encode('utf-8'))
+    f = open(path, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
+def restore(module, archive, mapping_param, force):
+    """
+    Restores an archive written by capture(), reading it once from start to end
+    :return: tuple of the manifest, the mapping of captured to restored roots and the number of files written
+    """
+    tar = tarfile.open(archive, "r|gz")
+    try:
+        first = tar.next()
+        if first is None or first.name != MANIFEST:
+            module.fail_json(msg="{0} is not an image, it does not start with a manifest".format(archive))
+        manifest = json.loads(tar.extractfile(first).read().decode('utf-8'))
+        if manifest.get('version') != IMAGE_VERSION:
+            module.fail_json(msg="{0} is an image of another version".format(archive))
+
+        roots = manifest['roots']
+        mapping = dict((root, os.path.expanduser(relocated(root, mapping_param))) for root in roots)
+        targets = [mapping[root] for root in roots]
+
+        # An image restored before is recognised by its marker
+        marker = os.path.join(relocated(manifest['ibmim'], mapping), MARKER)
+        if os.path.exists(marker) and not force:
+            try:
+                f = open(marker)
+                try:
+                    restored = json.load(f)
+                finally:
+                    f.close()
+                if restored.get('created') == manifest['created'] and restored.get('host') == manifest['host']:
+                    return manifest, mapping, None
+            except (IOError, OSError, ValueError):
+                pass
+        for target in targets:
+            if os.path.isdir(target) and os.listdir(target) and not force:
+                module.fail_json(msg="{0} is not empty, set force to restore over it".format(target))
+        if module.check_mode:
+            return manifest, mapping, 0
+
+        for target in targets:
+            if not os.path.isdir(target):
+                os.makedirs(target)
+        # Only root can give files away, others restore them as their own
+        owners = _Owners() if os.geteuid() == 0 else None
+
+        # Directories and links first, files as their content comes
+        byDigest = {}
+        for root, rel, kind, mode, mtime, data, size, relocate, uid, gid, user, group in manifest['entries']:
+            path = os.path.join(targets[root], rel)
+            if kind == 'd':
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+            elif kind == 'l':
+                if os.path.lexists(path):
+                    os.unlink(path)
+                os.symlink(relocated(data, mapping) if relocate else data, path)
+                if owners:
+                    owners.chown(path, uid, gid, user, group)
+            else:
+                byDigest.setdefault(data, []).append((path, mode, mtime, relocate, (uid, gid, user, group)))
+
+        written = 0
+        for member in tar:
+            if not member.name.startswith("blobs/"):
+                continue
+            paths = byDigest.get(member.name[len("blobs/"):], [])
+            if not paths:
+                continue
+            source = tar.extractfile(member)
+            first_path = paths[0][0]
+            out = open(first_path, 'wb')
+            try:
+                shutil.copyfileobj(source, out, CHUNK)
+            finally:
+                out.close()
+            for path, mode, mtime, relocate, ids in paths[1:]:
+                shutil.copyfile(first_path, path)
+            for path, mode, mtime, relocate, ids in paths:
+                if relocate:
+                    rewrite(path, mapping)
+                if owners:
+                    # Before chmod, as chown clears the setuid and setgid bits
+                    owners.chown(path, *ids)
+                os.chmod(path, mode)
+                os.utime(path, (mtime, mtime))
+                written += 1
+
+        # Directories last, as writing into them changes their mtime
+        for root, rel, kind, mode, mtime, data, size, relocate, uid, gid, user, group in reversed(manifest['entries']):
+            if kind == 'd':
+                path = os.path.join(targets[root], rel)
+                if owners:
+                    owners.chown(path, uid, gid, user, group)
+                os.chmod(path, mode)
+                os.utime(path, (mtime, mtime))
+        if owners:
+            for target, ids in zip(targets, manifest['owners']):
+                owners.chown(target, *ids)
+    finally:
+        tar.close()
+
+    f = open(marker, 'w')
+    try:
+        json.dump(dict(created=manifest['created'], host=manifest['host'], archive=archive, roots=mapping), f)
+    finally:
+        f.close()
+    return manifest, mapping, written
+
+
+def main():
+
+    # Read arguments
+    module = AnsibleModule(
+        argument_spec = dict(
+            state = dict(required=True, choices=['captured', 'restored']),
+            archive = dict(required=True),
+            ibmim = dict(default='/opt/IBM/InstallationManager'),
+            data_location = dict(required=False),
+            paths = dict(required=False, type='list'),
+            relocate = dict(required=False, type='dict'),
+            force = dict(default=False, type='bool'),
+            lock_file = dict(required=False),
+            lock_timeout = dict(default=3600, type='int')
+        ),
+        supports_check_mode = True
+    )
+
+    state = module.params['state']
+    archive = os.path.expanduser(module.params['archive'])
+    force = module.params['force']
+    started = datetime.datetime.now()
+
+    # Nothing may install or update while the trees are read or written
+    hostlock = HostLock(os.path.expanduser(module.params['lock_file'] or defaultLockFile()), module.params['lock_timeout'])
+    try:
+        hostlock.acquire(shared=(state == 'captured' or module.check_mode))
+    except LockError as e:
+        module.fail_json(msg=str(e))
+
+    if state == 'captured':
+        if os.path.exists(archive) and not force:
+            module.exit_json(changed=False, msg="{0} already exists".format(archive), archive=archive)
+        ibmim = os.path.realpath(os.path.expanduser(module.params['ibmim']))
+        location, roots = captureRoots(module)
+        if module.check_mode:
+            module.exit_json(changed=True, msg="Image of {0} is to be captured".format(", ".join(roots)), roots=roots)
+        try:
+            manifest = capture(ibmim, location, roots, archive)
+        except (IOError, OSError, tarfile.TarError) as e:
+            module.fail_json(msg="Failed capturing {0}: {1}".format(archive, e))
+        files = [e for e in manifest['entries'] if e[2] == 'f']
+        module.exit_json(
+            changed=True,
+            msg="Captured {0} files of {1} into {2}".format(len(files), ", ".join(roots), archive),
+            archive=archive,
+            roots=roots,
+            files=len(files),
+            distinct=len(set([e[5] for e in files])),
+            size=os.path.getsize(archive),
+            unrelocated=manifest['unrelocated'],
+            elapsed=round((datetime.datetime.now() - started).total_seconds(), 3)
+        )
+
+    if not os.path.exists(archive):
+        module.fail_json(msg="{0} does not exist".format(archive))
+    try:
+        manifest, mapping, written = restore(module, archive, module.params['relocate'] or {}, force)
+    except (IOError, OSError, ValueError, tarfile.TarError) as e:
+        module.fail_json(msg="Failed restoring {0}: {1}".format(archive, e))
+    if written is None:
+        module.exit_json(changed=False, msg="{0} is already restored".format(archive), roots=mapping)
+    if module.check_mode:
+        module.exit_json(changed=True, msg="{0} is to be restored".format(archive), roots=mapping)
+    module.exit_json(
+        changed=True,
+        msg="Restored {0} files from {1}".format(written, archive),
+        roots=mapping,
+        files=written,
+        unrelocated=[relocated(path, mapping) for path in manifest['unrelocated']] if module.params['relocate'] else [],
+        elapsed=round((datetime.datetime.now() - started).total_seconds(), 3)
+    )
+
+
+# import module snippets
+from ansible.module_utils.basic import *
+if __name__ == '__main__':
+    main()
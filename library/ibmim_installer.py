@@ -13,7 +13,14 @@ description:
 options:
   src:
     required: false
-    description: Path to installation files for Installation Manager
+    description: Path to installation files for Installation Manager, or path or http(s) URL of the installer zip. A zip is extracted while it is read, into a temporary directory that is removed afterwards
+  checksum:
+    required: false
+    description: Checksum of the installer zip in the form algorithm:hex, e.g. sha256:5f3c..., verified while it is read and before the installer runs
+  validate_certs:
+    required: false
+    default: true
+    description: Validate the certificate when src is an https URL
   dest:
     required: false
     default: "/opt/IBM/InstallationManager"
@@ -31,6 +38,17 @@ options:
     choices: [ present, absent ]
     default: "present"
     description: Whether Installation Manager should be installed or removed
+  lock_file:
+    required: false
+    default: "/var/ibm/InstallationManager/ansible_ibmim.lock for root, ~/.ansible/ibmim_lock/ansible_ibmim.lock for other users"
+    description: File locked on the host while Installation Manager is installed or uninstalled, shared with the ibmim module
+  lock_timeout:
+    required: false
+    default: 3600
+    description: Seconds to wait for the lock before failing
+  timings_file:
+    required: false
+    description: Append the timings of the commands run to this file on the host, one JSON document per line
 author: "Amir Mofasser (@amofasser)"
 """
 
@@ -41,6 +59,12 @@ EXAMPLES = """
         src: /some/dir/install/
         logdir: /tmp/im_install.log
 
+- name: Install from the installer zip
+    ibmim_installer:
+        state: present
+        src: http://myserver.domain.com/im/agent.installer.linux.gtk.x86_64_1.8.5001.20161016_1705.zip
+        checksum: sha256:1f3a6b2c1e0e79ad1c47d6a3df20e2a0c2fbb1e2a5f1c0e6a7d92f4e3c1b0a99
+
 - name: Uninstall
     ibmim:
         state: absent
@@ -48,30 +72,71 @@ EXAMPLES = """
 """
 
 import os
+import re
 import subprocess
 import platform
 import datetime
 import socket
+import atexit
+import hashlib
+import shutil
+import ssl
+import tempfile
+import zlib
+
+try:
+    from urllib.request import urlopen, build_opener, HTTPSHandler
+except ImportError:
+    from urllib2 import urlopen, build_opener, HTTPSHandler
+
+from ansible.module_utils.ibmim_lock import HostLock, LockError, defaultLockFile
+from ansible.module_utils.ibmim_registry import RegistryError, dataLocation, displayVersion, findPackage, readInstallRegistry
+from ansible.module_utils.timings import TimedModule
+from ansible.module_utils.zipstream import ZipStreamError, extract
+
+def launcherArch(path):
+    """
+    Tells a 32-bit from a 64-bit launcher by the class in its ELF header
+    :return: 32-bit, 64-bit or None
+    """
+    try:
+        f = open(path, 'rb')
+        try:
+            header = f.read(5)
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return None
+    if header[:4] != b"\x7fELF":
+        return None
+    return {1: "32-bit", 2: "64-bit"}.get(bytearray(header)[4])
+
 
 class InstallationManagerInstaller():
 
     module = None
+    hostlock = None
     module_facts = dict(
         im_version = None,
         im_internal_version = None,
         im_arch = None,
-        im_header = None
+        im_header = None,
+        im_source = None
     )
 
     def __init__(self):
         # Read arguments
-        self.module = AnsibleModule(
+        self.module = TimedModule(
             argument_spec     = dict(
                 state           = dict(default='present', choices=['present', 'absent']),
                 src             = dict(required=False),
+                checksum        = dict(required=False),
+                validate_certs  = dict(default=True, type='bool'),
                 dest            = dict(default="/opt/IBM/InstallationManager/"),
                 accessRights     = dict(default="admin", choices=['admin', 'nonAdmin']),
-                logdir          = dict(default="/tmp/")
+                logdir          = dict(default="/tmp/"),
+                lock_file       = dict(required=False),
+                lock_timeout    = dict(default=3600, type='int')
           ),
         supports_check_mode=True
       )
@@ -81,24 +146,54 @@ class InstallationManagerInstaller():
         return self.module_facts[str]
 
 
+    def lock(self, shared):
+        """
+        Takes the host-wide lock shared with the ibmim module
+        """
+        try:
+            self.hostlock.acquire(shared)
+        except LockError as e:
+            self.module.fail_json(msg=str(e), module_facts=self.module_facts)
+
+
     def isProvisioned(self, dest):
         """
-        Checks if Installation Manager is already installed at dest
+        Checks if Installation Manager is already installed at dest. The files
+        of Installation Manager are read first, imcl version only runs if they
+        can't tell
         :param dest: Installation directory of Installation Manager
         :return: True if already provisioned. False if not provisioned
         """
-        # If destination dir does not exists then its safe to assume that IM is not installed
-        if not os.path.exists(dest):
-            print ("Path does not exist: '%s'" % (dest))
+        # If destination dir or imcl does not exists then its safe to assume that IM is not installed
+        if not os.path.exists(os.path.join(dest, "eclipse", "tools", "imcl")):
             return False
-        else:
-            resultDict = self.getVersion(dest)
-            print ("ResultDict is: '%s'" % (resultDict))
-            if "installed" in resultDict["im_header"]:
-                return True
-            print ("installed not found in ReturnDict")
+        if self.readMetadata(dest):
+            return True
+        return self.getVersion(dest)["im_internal_version"] is not None
+
+
+    def readMetadata(self, dest):
+        """
+        Reads the version of Installation Manager from the com.ibm.cic.agent
+        entry in installRegistry.xml, and its architecture from the launcher
+        :param dest: Installation directory of Installation Manager
+        :return: True if the registry knows Installation Manager at dest
+        """
+        try:
+            packages = readInstallRegistry(os.path.join(dataLocation(dest), "installRegistry.xml"))
+        except RegistryError:
+            return False
+        agent = findPackage(packages, "com.ibm.cic.agent", dest)
+        if agent is None:
             return False
 
+        self.module_facts["im_version"] = displayVersion(agent["version"])
+        self.module_facts["im_internal_version"] = agent["version"]
+        self.module_facts["im_arch"] = launcherArch(os.path.join(dest, "eclipse", "IBMIM"))
+        self.module_facts["im_header"] = "{0} {1}".format(agent["name"], self.module_facts["im_version"])
+        self.module_facts["im_source"] = "registry"
+        return True
+
 
     def getVersion(self, dest):
         """
@@ -107,27 +202,65 @@ class InstallationManagerInstaller():
         :return: dict
         """
         imclCmd = "{0}/eclipse/tools/imcl version".format(dest)
-        print ("imclCmd is: '%s'" % (imclCmd))
-        child = subprocess.Popen(
-            [ imclCmd ],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout_value, stderr_value = child.communicate()
-        stdout_value = repr(stdout_value)
-        stderr_value = repr(stderr_value)
+        rc, stdout_value, stderr_value = self.module.runCommand([ imclCmd ], label="version", shell=True, universal_newlines=True)
+        if rc != 0:
+            return self.module_facts
+
+        for key, pattern in (("im_version", r"^\s*Version: ([0-9][^\s]*)"),
+                             ("im_internal_version", r"Internal Version: ([0-9][^\s]*)"),
+                             ("im_arch", r"Architecture: ([0-9]+-bit)"),
+                             ("im_header", r"Installation Manager.*")):
+            match = re.search(pattern, stdout_value, re.MULTILINE)
+            if match:
+                self.module_facts[key] = match.group(1) if match.groups() else match.group(0)
+        self.module_facts["im_source"] = "imcl"
+        return self.module_facts
+
+
+    def extractInstaller(self, src):
+        """
+        Extracts the installer zip at src, a path or URL, into a temporary
+        directory as it is read, leaving out the readme files. The directory
+        is removed when the module exits.
+        :return: directory of the extracted installer
+        """
+        digest = None
+        expected = None
+        if self.module.params['checksum']:
+            try:
+                algorithm, expected = self.module.params['checksum'].split(":", 1)
+                digest = hashlib.new(algorithm.lower())
+            except ValueError:
+                self.module.fail_json(msg="checksum must be of the form algorithm:hex, e.g. sha256:5f3c...")
 
+        tmpdir = tempfile.mkdtemp(prefix="ibmim_installer")
+        atexit.register(shutil.rmtree, tmpdir, True)
         try:
-            self.module_facts["im_version"] = re.search("Version: ([0-9].*)", stdout_value).group(1)
-            self.module_facts["im_internal_version"] = re.search("Internal Version: ([0-9].*)", stdout_value).group(1)
-            self.module_facts["im_arch"] = re.search("Architecture: ([0-9].*-bit)", stdout_value).group(1)
-            self.module_facts["im_header"] = re.search("Installation Manager.*", stdout_value).group(0)
-        except AttributeError:
-            self.module_facts["im_header"] = "**AttributeError**"
-#####             pass
+            if re.match("https?://", src):
+                if src.startswith("https") and not self.module.params['validate_certs']:
+                    context = ssl.create_default_context()
+                    context.check_hostname = False
+                    context.verify_mode = ssl.CERT_NONE
+                    stream = build_opener(HTTPSHandler(context=context)).open(src, timeout=60)
+                else:
+                    stream = urlopen(src, timeout=60)
+            else:
+                stream = open(src, 'rb')
+            try:
+                extract(stream, tmpdir, wanted=lambda name: "/readme/" not in "/" + name.lower(), digest=digest)
+            finally:
+                stream.close()
+        except (ZipStreamError, zlib.error, IOError, OSError) as e:
+            self.module.fail_json(msg="Failed extracting {0}: {1}".format(src, e))
 
-        return self.module_facts
+        if digest and digest.hexdigest() != expected.lower():
+            self.module.fail_json(msg="Checksum of {0} is {1}, expected {2}".format(src, digest.hexdigest(), expected))
+
+        # The installer may sit in a directory of the zip
+        for dirpath, dirnames, filenames in os.walk(tmpdir):
+            if "repository.config" in filenames and os.path.exists(os.path.join(dirpath, "tools", "imcl")):
+                return dirpath
+        self.module.fail_json(msg="{0} does not contain an Installation Manager installer".format(src))
 
 
     def main(self):
@@ -142,17 +275,26 @@ class InstallationManagerInstaller():
         ## users home directory
         dest = os.path.expanduser(dest)
 
+        self.hostlock = HostLock(os.path.expanduser(self.module.params['lock_file'] or defaultLockFile()), self.module.params['lock_timeout'])
+        self.lock(shared=True)
+
         if state == 'present':
 
             if self.module.check_mode:
                 self.module.exit_json(changed=False, msg="IBM IM where to be installed at {0}".format(dest))
 
-            # Check if IM is already installed
+            # Check if IM is already installed, and again once nobody else can install it
             if not self.isProvisioned(dest):
+                self.lock(shared=False)
+            if not self.isProvisioned(dest):
+
+                # Installer zips are extracted first
+                if src and (re.match("https?://", src) or src.lower().endswith(".zip")):
+                    src = self.extractInstaller(src)
 
                 # Check if paths are valid
-                if not os.path.exists(src+"/install"):
-                    self.module.fail_json(msg=src+"/install not found")
+                if not src or not os.path.exists(src+"/install"):
+                    self.module.fail_json(msg="{0}/install not found".format(src))
 
                 if not os.path.exists(logdir):
                     if not os.listdir(logdir):
@@ -160,31 +302,25 @@ class InstallationManagerInstaller():
 
                 logfile = "{0}_ibmim_{1}.xml".format(platform.node(), datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
                 installCmd = "{0}/tools/imcl install com.ibm.cic.agent -repositories {0}/repository.config -accessRights {1} -acceptLicense -log {2}/{3} -installationDirectory {4} -properties com.ibm.cic.common.core.preferences.preserveDownloadedArtifacts=true".format(src, accessRights, logdir, logfile, dest)
-                print ("installCmd is: '%s'" % (installCmd))
-                child = subprocess.Popen(
-                    [ installCmd ],
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
-                )
-                stdout_value, stderr_value = child.communicate()
-                stdout_value = repr(stdout_value)
-                stderr_value = repr(stderr_value)
-                if child.returncode != 0:
+                rc, stdout_value, stderr_value = self.module.runCommand([ installCmd ], label="install", shell=True, universal_newlines=True)
+                if rc != 0:
                     self.module.fail_json(
                         msg="IBM IM installation failed",
                         stderr=stderr_value,
                         stdout=stdout_value,
+                        cmd=installCmd,
                         module_facts=self.module_facts
                     )
 
                 # Module finished. Get version of IM after installation so that we can print it to the user
-                self.getVersion(dest)
+                if not self.readMetadata(dest):
+                    self.getVersion(dest)
                 self.module.exit_json(
                     msg="IBM IM installed successfully",
                     changed=True,
                     stdout=stdout_value,
                     stderr=stderr_value,
+                    cmd=installCmd,
                     module_facts=self.module_facts
                 )
             else:
@@ -203,7 +339,9 @@ class InstallationManagerInstaller():
                     module_facts=self.module_facts
                 )
 
-            # Check if IM is already installed
+            # Check if IM is already installed, and again once nobody else can uninstall it
+            if self.isProvisioned(dest):
+                self.lock(shared=False)
             if self.isProvisioned(dest):
                 if (accessRights == 'admin'):
                     uninstall_dir = "/var/ibm/InstallationManager/uninstall/uninstallc"
@@ -211,16 +349,8 @@ class InstallationManagerInstaller():
                     uninstall_dir = os.path.expanduser("~/var/ibm/InstallationManager/uninstall/uninstallc")
                 if not os.path.exists(uninstall_dir):
                     self.module.fail_json(msg=uninstall_dir + " does not exist")
-                child = subprocess.Popen(
-                    [uninstall_dir],
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
-                )
-                stdout_value, stderr_value = child.communicate()
-                stdout_value = repr(stdout_value)
-                stderr_value = repr(stderr_value)
-                if child.returncode != 0:
+                rc, stdout_value, stderr_value = self.module.runCommand([uninstall_dir], label="uninstall", shell=True, universal_newlines=True)
+                if rc != 0:
                     self.module.fail_json(
                         msg="IBM IM uninstall failed",
                         stderr=stderr_value,
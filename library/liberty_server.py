@@ -9,10 +9,12 @@ import subprocess
 import platform
 import datetime
 
+from ansible.module_utils.timings import TimedModule
+
 def main():
 
     # Read arguments
-    module = AnsibleModule(
+    module = TimedModule(
         argument_spec = dict(
             state   = dict(default='started', choices=['started', 'stopped']),
             name    = dict(required=True),
@@ -29,18 +31,16 @@ def main():
         module.fail_json(msg=libertydir+" does not exists")
 
     if state == 'stopped':
-        child = subprocess.Popen([libertydir+"/bin/server stop " + name], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
+        rc, stdout_value, stderr_value = module.runCommand([libertydir+"/bin/server stop " + name], label="stop", shell=True)
+        if rc != 0:
             if not stderr_value.find("is not running") < 0:
                 module.fail_json(msg=name + " stop failed", stdout=stdout_value, stderr=stderr_value)
 
         module.exit_json(changed=True, msg=name + " stopped successfully", stdout=stdout_value)
 
     if state == 'started':
-        child = subprocess.Popen([libertydir+"/bin/server start " + name], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
+        rc, stdout_value, stderr_value = module.runCommand([libertydir+"/bin/server start " + name], label="start", shell=True)
+        if rc != 0:
             if not stderr_value.find("is running with process") < 0:
                 module.fail_json(msg=name + " start failed", stdout=stdout_value, stderr=stderr_value)
 
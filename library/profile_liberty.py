@@ -7,10 +7,12 @@
 import os
 import subprocess
 
+from ansible.module_utils.timings import TimedModule
+
 def main():
 
     # Read arguments
-    module = AnsibleModule(
+    module = TimedModule(
         argument_spec = dict(
             state   = dict(default='present', choices=['present', 'absent']),
             libertydir  = dict(required=True),
@@ -28,18 +30,16 @@ def main():
 
     # Create a profile
     if state == 'present':
-        child = subprocess.Popen([libertydir+"/bin/server create " + name], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
+        rc, stdout_value, stderr_value = module.runCommand([libertydir+"/bin/server create " + name], label="create", shell=True)
+        if rc != 0:
             module.fail_json(msg="Failed to create liberty server " + name, stdout=stdout_value, stderr=stderr_value)
 
         module.exit_json(changed=True, msg=name + " server created successfully", stdout=stdout_value)
 
     # Remove a profile
     if state == 'absent':
-        child = subprocess.Popen(["rm -rf " + libertydir+"/usr/servers/" + name], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
+        rc, stdout_value, stderr_value = module.runCommand(["rm -rf " + libertydir+"/usr/servers/" + name], label="delete", shell=True)
+        if rc != 0:
                 module.fail_json(msg="Dmgr profile removal failed", stdout=stdout_value, stderr=stderr_value)
 
         module.exit_json(changed=True, msg=name + " server removed successfully", stdout=stdout_value, stderr=stderr_value)
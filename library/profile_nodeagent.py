@@ -18,9 +18,19 @@ options:
     description:
       - The profile should be created or removed
   name:
-    required: true
+    required: false
+    description:
+      - Name of the profile. Either name or profiles is required
+  profiles:
+    required: false
+    description:
+      - List of profiles to create or remove instead of name, each a name or a dict with name and optionally cell_name,
+        host_name and node_name. The other parameters apply to all of them. Missing profiles are created concurrently
+  concurrency:
+    required: false
+    default: 4
     description:
-      - Name of the profile
+      - Number of profiles in profiles created at the same time
   wasdir:
     required: true
     description:
@@ -61,6 +71,37 @@ options:
     default: "present"
     description:
       - The profile should be created or removed
+  minimal:
+    required: false
+    default: false
+    description:
+      - Leave out the optional actions of the template that deploy the default, sample and IVT applications
+  omit_actions:
+    required: false
+    description:
+      - Further actions of the template to leave out, passed to manageprofiles.sh -omitAction
+  port_base:
+    required: false
+    description:
+      - First port of the blocks of ports given to profiles. The profile gets the first block of port_block ports
+        that no other profile uses, written to a ports file for manageprofiles.sh, instead of the ports
+        manageprofiles.sh would find by probing
+  port_block:
+    required: false
+    default: 100
+    description:
+      - Number of ports in each block from port_base
+  template_cache:
+    required: false
+    description:
+      - Directory to cache profiles in. The first profile created with the same options is archived there, and later
+        ones are copied from the archive with their names and ports changed instead of running the whole template.
+        Keystores are not cached, clones get new ones from the key generating action of the template.
+        Requires cell_name, node_name and host_name
+  timings_file:
+    required: false
+    description:
+      - Append the timings of the commands run to this file on the host, one JSON document per line
 author: "Amir Mofasser (@amofasser)"
 """
 
@@ -76,175 +117,86 @@ import subprocess
 import platform
 import datetime
 import shutil
+import threading
 
-def isProvisioned(dest, profileName):
+from ansible.module_utils.timings import TimedModule
+from ansible.module_utils.was_profiles import createProfile, manageProfiles
+
+# Held by the thread federating a node
+federate_lock = threading.Lock()
+
+
+def createNode(module, params):
     """
-    Runs manageprofiles.sh -listProfiles command nd stores the output in a dict
-    :param dest: WAS installation dir
-    :param profilesName: Profile Name
-    :return: boolean
+    Creates a managed profile and federates it
+    :param module: the module, used to run the commands
+    :param params: the module parameters, with the name, cell_name, host_name and node_name of the profile
+    :return: dict with the result for the profile, failed set if it could not be created
     """
-    if not os.path.exists(dest):
-        return False
-    else:
-        child = subprocess.Popen(
-            ["{0}/bin/manageprofiles.sh -listProfiles".format(dest)],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+    result = createProfile(module, params, 'managed')
+    if result.get('failed') or not params['federate']:
+        return result
+
+    # Federate the node. addNode.sh changes the configuration of the
+    # whole cell, so nodes created together join one at a time
+    with federate_lock:
+        rc, stdout_value, stderr_value = module.runCommand([
+            "{0}/bin/addNode.sh {1} {2} "
+            "-conntype SOAP "
+            "-username {3} "
+            "-password {4} "
+            "-profileName {5} "
+            "{6}".format(params['wasdir'], params['dmgr_host'], params['dmgr_port'], params['username'], params['password'],
+                         params['name'], "-portprops " + result['ports_file'] if result['ports_file'] else "")],
+            label="addNode",
+            shell=True
         )
-        stdout_value, stderr_value = child.communicate()
+    if rc != 0:
+        return dict(
+            result,
+            failed=True,
+            msg="Profile {0} federation failed".format(params['name']),
+            stdout=stdout_value,
+            stderr=stderr_value
+        )
+    return result
 
-        if profileName in stdout_value:
-            return True
-    return False
 
 def main():
 
     # Read arguments
-    module = AnsibleModule(
+    module = TimedModule(
         argument_spec = dict(
             state   = dict(default='present', choices=['present', 'absent']),
             wasdir  = dict(required=True),
-            name    = dict(required=True),
+            name    = dict(required=False),
+            profiles = dict(required=False, type='list'),
+            concurrency = dict(default=4, type='int'),
             cell_name   = dict(required=False),
             host_name = dict(required=False),
             node_name = dict(required=False),
             username = dict(required=False),
-            password = dict(required=False),
+            password = dict(required=False, no_log=True),
             dmgr_host = dict(required=False),
             dmgr_port = dict(required=False, default='8879'),
-            federate = dict(required=False, type='bool')
-        )
+            federate = dict(required=False, type='bool'),
+            minimal = dict(default=False, type='bool'),
+            omit_actions = dict(required=False, type='list'),
+            port_base = dict(required=False, type='int'),
+            port_block = dict(default=100, type='int'),
+            template_cache = dict(required=False)
+        ),
+        required_one_of = [['name', 'profiles']],
+        mutually_exclusive = [['name', 'profiles']]
     )
 
-    state = module.params['state']
     wasdir = module.params['wasdir']
-    name = module.params['name']
-    cell_name = module.params['cell_name']
-    host_name = module.params['host_name']
-    node_name = module.params['node_name']
-    username = module.params['username']
-    password = module.params['password']
-    dmgr_host = module.params['dmgr_host']
-    dmgr_port = module.params['dmgr_port']
-    federate = module.params['federate']
 
     # Check if paths are valid
     if not os.path.exists(wasdir):
         module.fail_json(msg=wasdir+" does not exists")
 
-    # Create a profile
-    if state == 'present':
-        if module.check_mode:
-            module.exit_json(
-                changed=False,
-                msg="Profile {0} is to be created".format(name)
-            )
-
-        if not isProvisioned(wasdir, name):
-            child = subprocess.Popen([
-                "{0}/bin/manageprofiles.sh -create "
-                "-profileName {1} "
-                "-profilePath {0}/profiles/{1} "
-                "-templatePath {0}/profileTemplates/managed "
-                "-cellName {2} "
-                "-hostName {3} "
-                "-nodeName {4} "
-                "-enableAdminSecurity true "
-                "-adminUserName {5} "
-                "-adminPassword {6} ".format(wasdir, name, cell_name, host_name, node_name, username, password)],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
-                # Remove profile dir if creation fails so that it doesnt prevents us from retrying
-                shutil.rmtree("{0}/profiles/{1}".format(wasdir, name), ignore_errors=False, onerror=None)
-
-                module.fail_json(
-                    msg="Profile {0} creation failed".format(name),
-                    stdout=stdout_value,
-                    stderr=stderr_value
-                )
-
-            if federate:
-                # Federate the node
-                child = subprocess.Popen([
-                    "{0}/bin/addNode.sh {1} {2} "
-                    "-conntype SOAP "
-                    "-username {3} "
-                    "-password {4} "
-                    "-profileName {5} ".format(wasdir, dmgr_host, dmgr_port, username, password, name)],
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
-                )
-                stdout_value, stderr_value = child.communicate()
-                if child.returncode != 0:
-                    module.fail_json(
-                        msg="Profile {0} federation failed".format(name),
-                        stdout=stdout_value,
-                        stderr=stderr_value
-                    )
-
-            module.exit_json(
-                changed=True,
-                msg="Profile {0} created successfully",
-                stdout=stdout_value
-            )
-
-        else:
-            module.exit_json(
-                changed=False,
-                msg="Profile {0} already exists".format(name)
-            )
-
-    # Remove a profile
-    if state == 'absent':
-        if module.check_mode:
-            module.exit_json(
-                changed=False,
-                msg="Profile {0} is to be removed".format(name)
-            )
-
-        if isProvisioned(wasdir, name):
-
-            child = subprocess.Popen([
-                "{0}/bin/manageprofiles.sh -delete "
-                "-profileName {1} ".format(wasdir, name)],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-
-            stdout_value, stderr_value = child.communicate()
-            if child.returncode != 0:
-                # manageprofiles.sh -delete will fail if the profile does not exist.
-                # But creation of a profile with the same name will also fail if
-                # the directory is not empty. So we better remove the dir forcefully.
-                if not stdout_value.find("INSTCONFFAILED") < 0:
-                    shutil.rmtree(wasdir+"/profiles/"+name, ignore_errors=False, onerror=None)
-                else:
-                    module.fail_json(
-                        msg="Profile {0} removal failed".format(name),
-                        stdout=stdout_value,
-                        stderr=stderr_value
-                    )
-
-            module.exit_json(
-                changed=True,
-                msg="Profile {0} removed successfully".format(name),
-                stdout=stdout_value,
-                stderr=stderr_value
-            )
-
-        else:
-            module.exit_json(
-                changed=False,
-                msg="Profile {0} does not exist".format(name)
-            )
+    manageProfiles(module, lambda params: createNode(module, params))
 
 
 # import module snippets
@@ -14,16 +14,37 @@ options:
   state:
     required: false
     default: started
+    choices: [ started, stopped, restarted ]
     description:
-      - Whether WAS should be stopped or started
+      - Whether WAS should be stopped or started. restarted does a rolling restart of the members of cluster.
   name:
-    required: true
+    required: false
     description:
-      - Name of the application server
+      - Name of the application server. Either name or servers is required
   node:
-    required: true
+    required: false
+    description:
+      - Name of the node on which the application server is running on. Also the default node for servers
+  servers:
+    required: false
+    description:
+      - List of application servers to start or stop in one go, from a single wsadmin. An item is either the name
+        of a server on node, or a dict with the keys name and node.
+  concurrency:
+    required: false
+    default: 4
+    description:
+      - Maximum number of servers in servers that are started or stopped at the same time on each node
+  cluster:
+    required: false
     description:
-      - Name of the node on which the application server is running on
+      - Name of a cluster whose members are restarted in waves, with state=restarted. Each wave is stopped, started
+        and waited for before the next one begins, so the rest of the cluster keeps serving.
+  wave_size:
+    required: false
+    default: 1
+    description:
+      - Number of cluster members restarted at the same time
   username:
     required: false
     description:
@@ -41,6 +62,96 @@ options:
     default: True
     description:
       - Use wsadmin to start/stop processes on a node (True) or the native startServer.sh/stopServer.sh on the node machine (False)
+  connector:
+    required: false
+    default: wsadmin
+    choices: [ auto, soap, wsadmin ]
+    description:
+      - How to talk to the deployment manager when wsadmin=true. wsadmin runs the requests through wsadmin, soap
+        sends the JMX requests straight to its SOAP connector without starting a JVM. auto uses the SOAP connector
+        when it answers and wsadmin otherwise. Rolling restarts of clusters always use wsadmin.
+  host:
+    required: false
+    default: localhost
+    description:
+      - Host name of the deployment manager, for the SOAP connector
+  port:
+    required: false
+    default: 8879
+    description:
+      - SOAP connector port of the deployment manager
+  use_ssl:
+    required: false
+    default: true
+    description:
+      - Talk to the SOAP connector over HTTPS. Turn off when administrative security is disabled
+  validate_certs:
+    required: false
+    default: true
+    description:
+      - Validate the SSL certificate of the SOAP connector
+  timeout:
+    required: false
+    default: 1200
+    description:
+      - Seconds to wait for a server to start or stop when using the SOAP connector. A server that stops again
+        while starting fails the task right away
+  profile_path:
+    required: false
+    description:
+      - Path to the profile of the server, used to find the server's PID file and serverStatus.sh.
+        Defaults to wasdir, which works when wasdir points at a profile.
+  probe:
+    required: false
+    default: true
+    description:
+      - Find out whether the server is running before doing anything, from the PID file in the profile's logs
+        directory and falling back to serverStatus.sh only when that is inconclusive. Servers that already are in the
+        desired state are left alone without starting any JVM. With wsadmin only the servers of the node of the
+        profile at profile_path are probed, same-named servers on other nodes are left to wsadmin.
+  wait_for_ready:
+    required: false
+    default: false
+    description:
+      - After starting a server, follow its SystemOut.log until it reports that it is ready. Only the bytes
+        written since the start are read, and log rotation is followed. Needs the server's logs under profile_path,
+        so only servers on the node of that profile are followed. Servers on other nodes count as ready once
+        they are STARTED.
+        For a rolling restart of a cluster, wait until every application of the cluster runs on the member instead.
+  ready_message:
+    required: false
+    default: WSVR0001I
+    description:
+      - Regular expression matching the log line that tells the server is ready. Defaults to the "open for e-business" message.
+  ready_error:
+    required: false
+    default: WSVR0009E
+    description:
+      - Regular expression matching a log line that tells the server failed to start
+  ready_timeout:
+    required: false
+    default: 600
+    description:
+      - Seconds to wait for ready_message before failing
+  session:
+    required: false
+    default: false
+    description:
+      - Send the wsadmin commands to a persistent wsadmin session on the host instead of starting a new wsadmin
+        process for every task. Only used together with wsadmin=true.
+  session_idle_timeout:
+    required: false
+    default: 600
+    description:
+      - Seconds a persistent session may stay unused before its wsadmin process exits
+  session_dir:
+    required: false
+    description:
+      - Directory holding the session sockets. Defaults to ansible-wsadmin-<uid> in the system temp directory
+  timings_file:
+    required: false
+    description:
+      - Append the timings of the commands run to this file on the host, one JSON document per line
 author: "Amir Mofasser (@amofasser)"
 """
 
@@ -49,12 +160,36 @@ EXAMPLES = """
 - was_server: state=stopped name=AppSrv01 node=devnode wasdir=/usr/local/WebSphere/AppServer/
 # Start:
 - was_server: state=started name=AppSrv01 node=devnode wasdir=/usr/local/WebSphere/AppServer/
+# Restart a set of servers, at most three at a time on each node:
+- was_server:
+    state: stopped
+    wasdir: /usr/local/WebSphere/AppServer/
+    concurrency: 3
+    servers:
+      - { name: AppSrv01, node: node01 }
+      - { name: AppSrv02, node: node01 }
+      - { name: AppSrv01, node: node02 }
+# Rolling restart of a cluster, two members at a time:
+- was_server: state=restarted cluster=myCluster wave_size=2 wait_for_ready=true wasdir=/usr/local/WebSphere/AppServer/
+# Start using a persistent wsadmin session:
+- was_server: state=started name=AppSrv01 node=devnode wasdir=/usr/local/WebSphere/AppServer/ session=true
 """
 
 import os
+import re
+import ast
+import errno
 import subprocess
 import platform
 import datetime
+import tempfile
+import threading
+import time
+
+from ansible.module_utils.wsadmin_session import WsadminSession, WsadminSessionError, wsadmin_command
+from ansible.module_utils.was_soap import AdminClient, SoapError
+from ansible.module_utils.was_profiles import profileNames
+from ansible.module_utils.timings import TimedModule
 
 was_dict = dict(
     was_name = None,
@@ -73,20 +208,20 @@ def getState(stdout_value, name, wsadmin):
     :return: dict
     """
 
-    was_dict["check_stdout"] = stdout_value 
+    was_dict["check_stdout"] = stdout_value
     was_dict["was_name"] = name
 
     try:
-	if wsadmin:
-           match = re.search("(Server \"{0}\" is already running)".format(name), stdout_value)
-           if match:
-               if match.group(0):
-                   was_dict["was_state"] = 1
-	else:
-	   match = re.search("(An instance of the server may already be running: {0})".format(name), stdout_value)
-	   if match:
-	      if match.group(0):
-		   was_dict["was_state"] = 1 
+        if wsadmin:
+            match = re.search("(Server \"{0}\" is already running)".format(name), stdout_value)
+            if match:
+                if match.group(0):
+                    was_dict["was_state"] = 1
+        else:
+            match = re.search("(An instance of the server may already be running: {0})".format(name), stdout_value)
+            if match:
+                if match.group(0):
+                    was_dict["was_state"] = 1
 
     except AttributeError:
         raise
@@ -94,19 +229,770 @@ def getState(stdout_value, name, wsadmin):
     return was_dict
 
 
+def probeState(profile_path, name):
+    """
+    Finds out whether a server is running by looking at its PID file, so
+    that no JVM needs to be started for it
+    :param profile_path: Path to the profile of the server
+    :param name: name of the application server
+    :return: STARTED, STOPPED or None if unsure
+    """
+    logdir = os.path.join(profile_path, "logs", name)
+    if not os.path.isdir(logdir):
+        # Not a server of this profile, or one that never ran here
+        return None
+
+    # The server removes its PID file when it stops. A file that is left
+    # behind after a crash points to a process that is gone.
+    try:
+        pid = int(open(os.path.join(logdir, "{0}.pid".format(name))).read().strip())
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return 'STOPPED'
+        return None
+    except ValueError:
+        return None
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return 'STOPPED'
+        if e.errno != errno.EPERM:
+            return None
+
+    # Make sure the PID hasn't been reused by something else. A server JVM
+    # runs com.ibm.ws.runtime.WsServer with cell, node and server last.
+    try:
+        cmdline = open("/proc/{0}/cmdline".format(pid)).read().split("\0")
+    except IOError:
+        return None
+    cmdline = [arg for arg in cmdline if arg]
+    if cmdline and "java" in os.path.basename(cmdline[0]) and "com.ibm.ws.runtime.WsServer" in cmdline and cmdline[-1] == name:
+        return 'STARTED'
+    return 'STOPPED'
+
+
+def serverStatus(module, profile_path, name, credentials):
+    """
+    Asks serverStatus.sh whether a server is running
+    :return: STARTED, STOPPED or None if unsure
+    """
+    script = "{0}/bin/serverStatus.sh".format(profile_path)
+    if not os.path.exists(script):
+        return None
+    rc, stdout_value, stderr_value = runCommand(module, "{0} {1} {2}".format(script, name, credentials), "serverStatus")
+    if re.search("ADMU0508I.*\"{0}\" is STARTED".format(re.escape(name)), stdout_value):
+        return 'STARTED'
+    if re.search("ADMU0509I.*\"{0}\"".format(re.escape(name)), stdout_value):
+        return 'STOPPED'
+    return None
+
+
+def isLocal(module, node):
+    """
+    Tells whether a server of node lives in the local profile, and so has
+    its PID file and logs under profile_path. Servers of the same name on
+    other nodes of the cell must not be judged by those of this one.
+    """
+    if not module.params['wsadmin'] or node is None:
+        # startServer.sh and stopServer.sh only reach local servers
+        return True
+    profile_path = module.params['profile_path'] or module.params['wasdir']
+    return profileNames(profile_path)['node'] == node
+
+
+def probeServer(module, name, node, credentials):
+    """
+    Finds out whether a server is running, as cheap as possible. Only
+    servers on the node of the local profile are probed.
+    :return: tuple of STARTED, STOPPED or None if unknown, and the method used
+    """
+    if not isLocal(module, node):
+        return None, None
+    profile_path = module.params['profile_path'] or module.params['wasdir']
+    current = probeState(profile_path, name)
+    if current is not None:
+        return current, 'pid'
+    # Only ask serverStatus.sh about servers that live in this profile. With
+    # wsadmin the server may well be on another node, and it would only fail.
+    if os.path.isdir(os.path.join(profile_path, "logs", name)) or not module.params['wsadmin']:
+        current = serverStatus(module, profile_path, name, credentials)
+        if current is not None:
+            return current, 'serverStatus'
+    return None, None
+
+
+class LogTail(object):
+    """
+    Follows a log file from where it ended when the object was created.
+    Handles the file being rotated away or truncated in the meantime.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = None
+        self.partial = b""
+        try:
+            st = os.stat(path)
+            self.inode = st.st_ino
+            self.offset = st.st_size
+        except OSError:
+            self.inode = None
+            self.offset = 0
+
+    def _open(self):
+        try:
+            self.fh = open(self.path, 'rb')
+        except IOError:
+            return False
+        st = os.fstat(self.fh.fileno())
+        # Only continue from the recorded offset if it's still the same file
+        if st.st_ino == self.inode and st.st_size >= self.offset:
+            self.fh.seek(self.offset)
+        self.inode = st.st_ino
+        return True
+
+    def read(self):
+        """
+        Returns the complete lines written since the last call
+        :return: list
+        """
+        if self.fh is None and not self._open():
+            return []
+        data = b""
+        while True:
+            data += self.fh.read()
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                # Rotated away and not created again yet
+                break
+            if st.st_ino != self.inode:
+                # Rotated. The rest of the old file has just been read, so
+                # carry on from the start of the new one.
+                self.fh.close()
+                self.fh = None
+                self.offset = 0
+                if not self._open():
+                    break
+                continue
+            if st.st_size < self.fh.tell():
+                # Truncated
+                self.fh.seek(0)
+                continue
+            break
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        return [line.decode('utf-8', 'replace') for line in lines]
+
+
+def logTail(module, name):
+    """
+    Returns a LogTail on the SystemOut.log of a server
+    """
+    profile_path = module.params['profile_path'] or module.params['wasdir']
+    return LogTail(os.path.join(profile_path, "logs", name, "SystemOut.log"))
+
+
+def followLog(module, name, node):
+    """
+    Starts following the SystemOut.log of a server that is about to be started
+    :return: LogTail, or None if the server is on another node and its log can't be followed from here
+    """
+    if not isLocal(module, node):
+        return None
+    return logTail(module, name)
+
+
+def serverReady(module, name, tail, current):
+    """
+    Waits for a server that has just been started to become ready. A server
+    on another node is judged by the state it was started to instead.
+    :param tail: what followLog() returned
+    :param current: state of the server after it was started
+    :return: dict with ready, ready_elapsed and ready_line
+    """
+    if tail is None:
+        return dict(ready=current == 'STARTED', ready_elapsed=0.0,
+                    ready_line="Server {0} is on another node, its log can't be followed. Its state is {1}".format(name, current))
+    return waitForReady(module, {name: tail})[name]
+
+
+def waitForReady(module, tails):
+    """
+    Follows the SystemOut.log of servers until each of them is ready, has
+    failed or the timeout is up
+    :param tails: dict of server name, or (name, node) tuple, and LogTail
+    :return: dict with the keys of tails and dict with ready, ready_elapsed and ready_line
+    """
+    ready_re = re.compile(module.params['ready_message'])
+    error_re = re.compile(module.params['ready_error']) if module.params['ready_error'] else None
+    start = time.time()
+    deadline = start + module.params['ready_timeout']
+    status = {}
+    pending = dict(tails)
+    while pending:
+        for key, tail in list(pending.items()):
+            for line in tail.read():
+                if ready_re.search(line):
+                    status[key] = dict(ready=True, ready_elapsed=round(time.time() - start, 3), ready_line=line.strip())
+                    break
+                if error_re and error_re.search(line):
+                    status[key] = dict(ready=False, ready_elapsed=round(time.time() - start, 3), ready_line=line.strip())
+                    break
+            if key in status:
+                del pending[key]
+        if not pending or time.time() >= deadline:
+            break
+        time.sleep(0.25)
+    for key in pending:
+        status[key] = dict(ready=False, ready_elapsed=round(time.time() - start, 3), ready_line="Timed out after {0} seconds".format(module.params['ready_timeout']))
+    return status
+
+
+def getClient(module):
+    """
+    Returns an AdminClient for the SOAP connector if it is to be used and
+    answers, otherwise None
+    """
+    if not module.params['wsadmin'] or module.params['connector'] == 'wsadmin':
+        return None
+    client = AdminClient(
+        module.params['host'],
+        module.params['port'],
+        module.params['username'],
+        module.params['password'],
+        secure=module.params['use_ssl'],
+        validate_certs=module.params['validate_certs']
+    )
+    try:
+        client.queryNames("WebSphere:type=Server,*")
+    except SoapError as e:
+        if module.params['connector'] == 'soap':
+            module.fail_json(msg="SOAP connector not available: {0}".format(e))
+        return None
+    return client
+
+
+def runSession(module, session, command):
+    """
+    Runs a jython command in the persistent wsadmin session
+    :param session: WsadminSession to use
+    :param command: jython command
+    :return: tuple of returncode, stdout and stderr
+    """
+    try:
+        rc, stdout_value = session.run(code=command)
+    except WsadminSessionError as e:
+        module.fail_json(msg="wsadmin session failed: {0}".format(e), session_key=session.key)
+    return rc, stdout_value, ""
+
+
+def runCommand(module, cmd, label=None):
+    """
+    Runs cmd in a shell
+    :param label: step the command is recorded under in timings
+    :return: tuple of returncode, stdout and stderr
+    """
+    return module.runCommand([cmd], label=label, shell=True, universal_newlines=True)
+
+
+RESULT_MARKER = "__ANSIBLE_WAS_SERVER__"
+
+# Starts or stops a list of servers from a single wsadmin. Every server gets
+# a thread, and a semaphore per node caps how many are in flight on a node.
+BULK = """import sys
+import time
+import threading
+__ansible_servers = %(servers)r
+__ansible_action = %(action)r
+__ansible_print = threading.Lock()
+__ansible_slots = {}
+for __ansible_name, __ansible_node in __ansible_servers:
+    if not __ansible_slots.has_key(__ansible_node):
+        __ansible_slots[__ansible_node] = threading.Semaphore(%(concurrency)d)
+
+def __ansible_state(name, node):
+    on = AdminControl.completeObjectName('type=Server,node=%%s,process=%%s,*' %% (node, name))
+    if not on:
+        return 'STOPPED'
+    try:
+        return AdminControl.getAttribute(on, 'state')
+    except:
+        return 'STARTED'
+
+def __ansible_control(name, node):
+    slot = __ansible_slots[node]
+    slot.acquire()
+    try:
+        start = time.time()
+        rc = 0
+        msg = ''
+        before = after = 'UNKNOWN'
+        try:
+            before = __ansible_state(name, node)
+            if __ansible_action == 'start' and before == 'STOPPED':
+                AdminControl.startServer(name, node)
+            elif __ansible_action == 'stop' and before != 'STOPPED':
+                AdminControl.stopServer(name, node)
+            after = __ansible_state(name, node)
+        except:
+            rc = 1
+            msg = str(sys.exc_info()[1])
+        __ansible_print.acquire()
+        print '%(marker)s %%r' %% ((name, node, before, after, rc, time.time() - start, msg),)
+        sys.stdout.flush()
+        __ansible_print.release()
+    finally:
+        slot.release()
+
+__ansible_threads = []
+for __ansible_name, __ansible_node in __ansible_servers:
+    __ansible_t = threading.Thread(target=__ansible_control, args=(__ansible_name, __ansible_node))
+    __ansible_t.start()
+    __ansible_threads.append(__ansible_t)
+for __ansible_t in __ansible_threads:
+    __ansible_t.join()
+"""
+
+# Restarts the members of a cluster in waves. The members of a wave are
+# restarted in parallel and the next wave only begins once all of them are
+# started again, and with apps set, run every application of the cluster.
+ROLLING = """import sys
+import time
+import threading
+__ansible_cluster = %(cluster)r
+__ansible_wave_size = %(wave_size)d
+__ansible_timeout = %(timeout)d
+__ansible_print = threading.Lock()
+__ansible_failed = []
+
+def __ansible_emit(*fields):
+    __ansible_print.acquire()
+    print '%(marker)s %%r' %% (fields,)
+    sys.stdout.flush()
+    __ansible_print.release()
+
+def __ansible_state(name, node):
+    on = AdminControl.completeObjectName('type=Server,node=%%s,process=%%s,*' %% (node, name))
+    if not on:
+        return 'STOPPED'
+    try:
+        return AdminControl.getAttribute(on, 'state')
+    except:
+        return 'STARTED'
+
+def __ansible_ready(name, node):
+    if __ansible_state(name, node) != 'STARTED':
+        return 0
+    for app in __ansible_apps:
+        if not AdminControl.completeObjectName('type=Application,name=%%s,node=%%s,process=%%s,*' %% (app, node, name)):
+            return 0
+    return 1
+
+def __ansible_restart(name, node):
+    start = time.time()
+    stop_elapsed = start_elapsed = ready_elapsed = 0.0
+    before = after = 'UNKNOWN'
+    rc = 0
+    msg = ''
+    try:
+        before = __ansible_state(name, node)
+        if before != 'STOPPED':
+            AdminControl.stopServer(name, node)
+        stop_elapsed = time.time() - start
+        AdminControl.startServer(name, node)
+        start_elapsed = time.time() - start - stop_elapsed
+        deadline = time.time() + __ansible_timeout
+        while not __ansible_ready(name, node):
+            if time.time() > deadline:
+                rc = 1
+                msg = 'Timed out waiting for %%s to become ready' %% name
+                break
+            time.sleep(2)
+        ready_elapsed = time.time() - start - stop_elapsed - start_elapsed
+        after = __ansible_state(name, node)
+    except:
+        rc = 1
+        msg = str(sys.exc_info()[1])
+    if rc != 0:
+        __ansible_failed.append(name)
+    __ansible_emit('member', name, node, before, after, rc, stop_elapsed, start_elapsed, ready_elapsed, time.time() - start, msg)
+
+__ansible_cid = AdminConfig.getid('/ServerCluster:%%s/' %% __ansible_cluster)
+if not __ansible_cid:
+    __ansible_emit('error', 'Cluster %%s does not exist' %% __ansible_cluster)
+    sys.exit(1)
+__ansible_members = []
+for __ansible_m in AdminConfig.list('ClusterMember', __ansible_cid).splitlines():
+    __ansible_members.append((AdminConfig.showAttribute(__ansible_m, 'memberName'), AdminConfig.showAttribute(__ansible_m, 'nodeName')))
+__ansible_apps = []
+if %(apps)d:
+    __ansible_apps = AdminApp.list('WebSphere:cell=%%s,cluster=%%s' %% (AdminControl.getCell(), __ansible_cluster)).splitlines()
+__ansible_emit('members', __ansible_members, __ansible_apps)
+
+for __ansible_w in range(0, len(__ansible_members), __ansible_wave_size):
+    __ansible_wave = __ansible_members[__ansible_w:__ansible_w + __ansible_wave_size]
+    __ansible_start = time.time()
+    __ansible_threads = []
+    for __ansible_name, __ansible_node in __ansible_wave:
+        __ansible_t = threading.Thread(target=__ansible_restart, args=(__ansible_name, __ansible_node))
+        __ansible_t.start()
+        __ansible_threads.append(__ansible_t)
+    for __ansible_t in __ansible_threads:
+        __ansible_t.join()
+    __ansible_emit('wave', __ansible_w / __ansible_wave_size, [m[0] for m in __ansible_wave], time.time() - __ansible_start)
+    # Don't take down the next wave while members of this one are broken
+    if __ansible_failed:
+        break
+"""
+
+def getServers(module):
+    """
+    Turns the servers parameter into a list of (name, node) tuples. A
+    server is known by its name and node together, the same name may well
+    be used on every node of a cell.
+    :return: list, without duplicates
+    """
+    servers = []
+    for item in module.params['servers']:
+        if not isinstance(item, dict):
+            item = dict(name=item)
+        node = item.get('node') or module.params['node']
+        if not item.get('name') or (module.params['wsadmin'] and not node):
+            module.fail_json(msg="Each item in servers needs a name and a node: {0}".format(item))
+        if (item['name'], node) not in servers:
+            servers.append((item['name'], node))
+    return servers
+
+
+def bulkWsadmin(module, session, servers, action):
+    """
+    Starts or stops all servers from one wsadmin
+    :return: tuple of the list of server results, stdout and stderr
+    """
+    driver = BULK % dict(
+        servers=servers,
+        action=action,
+        concurrency=module.params['concurrency'],
+        marker=RESULT_MARKER
+    )
+    rc, stdout_value, stderr_value = runDriver(module, session, driver)
+    parsed = parseResults(stdout_value)
+    # The driver records every server it gets to, so wsadmin failing or
+    # printing nothing means it never connected or died halfway
+    if rc != 0 or (servers and not parsed):
+        module.fail_json(
+            msg="wsadmin failed to {0} servers, rc {1}".format(action, rc),
+            stdout=stdout_value,
+            stderr=stderr_value
+        )
+
+    results = []
+    for fields in parsed:
+        name, node, before, after, rc, elapsed, msg = fields
+        results.append(dict(name=name, node=node, state_before=before, state_after=after, rc=rc, elapsed=round(elapsed, 3), msg=msg))
+    return results, stdout_value, stderr_value
+
+
+def runDriver(module, session, driver):
+    """
+    Runs a generated jython script in the session or in a new wsadmin
+    :return: tuple of returncode, stdout and stderr
+    """
+    if session:
+        return runSession(module, session, driver)
+    fd, path = tempfile.mkstemp(suffix=".py")
+    try:
+        os.write(fd, driver.encode('utf-8'))
+        os.close(fd)
+        rc, stdout_value, stderr_value = module.runCommand(
+            wsadmin_command(module.params['wasdir'], username=module.params['username'], password=module.params['password'], conntype=None) + ["-f", path],
+            label="wsadmin",
+            universal_newlines=True
+        )
+        return rc, stdout_value, stderr_value
+    finally:
+        os.unlink(path)
+
+
+def parseResults(stdout_value):
+    """
+    Returns the tuples a driver printed after RESULT_MARKER
+    :return: list
+    """
+    results = []
+    for line in stdout_value.splitlines():
+        if line.startswith(RESULT_MARKER + " "):
+            results.append(ast.literal_eval(line[len(RESULT_MARKER) + 1:]))
+    return results
+
+
+def bulkSoap(module, client, servers, action):
+    """
+    Starts or stops all servers through the SOAP connector, at most
+    concurrency of them at the same time on each node
+    :return: tuple of the list of server results, stdout and stderr
+    """
+    results = []
+    lock = threading.Lock()
+    slots = {}
+    for name, node in servers:
+        slots.setdefault(node, threading.Semaphore(module.params['concurrency']))
+
+    def control(name, node):
+        slots[node].acquire()
+        try:
+            start = time.time()
+            rc, msg = 0, ""
+            before = after = 'UNKNOWN'
+            try:
+                before = client.serverState(name, node)
+                if action == 'start' and before == 'STOPPED':
+                    client.startServer(name, node, module.params['timeout'])
+                elif action == 'stop' and before != 'STOPPED':
+                    client.stopServer(name, node, module.params['timeout'])
+                after = client.serverState(name, node)
+            except SoapError as e:
+                rc, msg = 1, str(e)
+            with lock:
+                results.append(dict(name=name, node=node, state_before=before, state_after=after, rc=rc, elapsed=round(time.time() - start, 3), msg=msg))
+        finally:
+            slots[node].release()
+
+    threads = [threading.Thread(target=control, args=server) for server in servers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, "", ""
+
+
+def bulkNative(module, servers, action, credentials):
+    """
+    Starts or stops all servers with startServer.sh/stopServer.sh, running
+    at most concurrency of them at the same time
+    :return: tuple of the list of server results, stdout and stderr
+    """
+    results = []
+    outputs = []
+    slots = threading.Semaphore(module.params['concurrency'])
+    lock = threading.Lock()
+
+    def control(name, node):
+        slots.acquire()
+        try:
+            start = time.time()
+            rc, stdout_value, stderr_value = runCommand(module, "{0}/bin/{1}Server.sh {2} {3}".format(module.params['wasdir'], action, name, credentials), action + "Server")
+            if action == 'start':
+                running = re.search("An instance of the server may already be running: {0}".format(name), stdout_value)
+                before = 'STARTED' if running else 'STOPPED'
+                after = 'STARTED' if rc == 0 else 'UNKNOWN'
+            else:
+                before = 'STOPPED' if re.search("appears to be stopped", stdout_value) else 'STARTED'
+                after = 'STOPPED' if rc == 0 else 'UNKNOWN'
+            with lock:
+                results.append(dict(name=name, node=node, state_before=before, state_after=after, rc=rc, elapsed=round(time.time() - start, 3), msg=stderr_value))
+                outputs.append(stdout_value)
+        finally:
+            slots.release()
+
+    threads = [threading.Thread(target=control, args=server) for server in servers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, "".join(outputs), ""
+
+
+def bulkControl(module, session, client, action, credentials):
+    """
+    Starts or stops every server in the servers parameter and exits the module
+    """
+    requested = getServers(module)
+    target = 'STARTED' if action == 'start' else 'STOPPED'
+    start = time.time()
+
+    # Status of each server by (name, node)
+    status = {}
+
+    # Leave out the servers that already are in the desired state
+    servers = requested
+    if module.params['probe']:
+        pending = []
+        for name, node in servers:
+            current, method = probeServer(module, name, node, credentials)
+            if current == target:
+                status[(name, node)] = dict(name=name, node=node, state_before=current, state_after=current, rc=0, elapsed=0.0, msg="", probe=method)
+            else:
+                pending.append((name, node))
+        servers = pending
+
+    # Only the servers of the local node write their logs where they can be followed
+    tails = {}
+    if module.params['wait_for_ready'] and action == 'start' and not module.check_mode:
+        tails = dict(((name, node), followLog(module, name, node)) for name, node in servers)
+
+    results, stdout_value, stderr_value = [], "", ""
+    if servers and module.check_mode:
+        results = [dict(name=server[0], node=server[1], state_before='UNKNOWN', state_after=target, rc=0, elapsed=0.0, msg="") for server in servers]
+    elif servers and client:
+        results, stdout_value, stderr_value = bulkSoap(module, client, servers, action)
+    elif servers and module.params['wsadmin']:
+        results, stdout_value, stderr_value = bulkWsadmin(module, session, servers, action)
+    elif servers:
+        results, stdout_value, stderr_value = bulkNative(module, servers, action, credentials)
+    for result in results:
+        if (result['name'], result['node']) in servers:
+            status[(result['name'], result['node'])] = result
+    results = [status[server] for server in requested if server in status]
+    missing = [server for server in requested if server not in status]
+    elapsed = round(time.time() - start, 3)
+
+    for result in results:
+        result['changed'] = result['state_before'] != result['state_after']
+
+    # Wait until the servers that have just been started are ready
+    started = [r for r in results if r['changed'] and r['rc'] == 0 and (r['name'], r['node']) in tails]
+    if started:
+        ready = waitForReady(module, dict(((r['name'], r['node']), tails[(r['name'], r['node'])]) for r in started if tails[(r['name'], r['node'])]))
+        for result in started:
+            key = (result['name'], result['node'])
+            result.update(ready[key] if key in ready else serverReady(module, result['name'], None, result['state_after']))
+        elapsed = round(time.time() - start, 3)
+
+    failed = [r for r in results if r['rc'] != 0 or r['state_after'] != target or r.get('ready') is False]
+    if failed or missing:
+        module.fail_json(
+            msg="Failed to {0} servers: {1}".format(action, ", ".join(sorted(["{0}/{1}".format(r['node'], r['name']) for r in failed] + ["{1}/{0}".format(*m) for m in missing]))),
+            results=results,
+            elapsed=elapsed,
+            stdout=stdout_value,
+            stderr=stderr_value
+        )
+
+    module.exit_json(
+        changed=any(r['changed'] for r in results),
+        msg="{0} servers {1}".format(len(results), target.lower()),
+        results=results,
+        elapsed=elapsed,
+        stdout=stdout_value
+    )
+
+
+def rollingRestart(module, session):
+    """
+    Restarts the members of a cluster in waves of wave_size and exits the module
+    """
+    cluster = module.params['cluster']
+    if module.check_mode:
+        module.exit_json(changed=True, msg="Cluster {0} is to be restarted".format(cluster))
+
+    start = time.time()
+    driver = ROLLING % dict(
+        cluster=cluster,
+        wave_size=module.params['wave_size'],
+        timeout=module.params['ready_timeout'],
+        apps=module.params['wait_for_ready'],
+        marker=RESULT_MARKER
+    )
+    rc, stdout_value, stderr_value = runDriver(module, session, driver)
+    elapsed = round(time.time() - start, 3)
+
+    members, apps, results, waves = None, [], [], []
+    for fields in parseResults(stdout_value):
+        if fields[0] == 'error':
+            module.fail_json(msg=fields[1], stdout=stdout_value, stderr=stderr_value)
+        elif fields[0] == 'members':
+            members, apps = fields[1], fields[2]
+        elif fields[0] == 'member':
+            name, node, before, after, rc, stop_elapsed, start_elapsed, ready_elapsed, total, msg = fields[1:]
+            results.append(dict(
+                name=name,
+                node=node,
+                state_before=before,
+                state_after=after,
+                rc=rc,
+                stop_elapsed=round(stop_elapsed, 3),
+                start_elapsed=round(start_elapsed, 3),
+                ready_elapsed=round(ready_elapsed, 3),
+                elapsed=round(total, 3),
+                msg=msg
+            ))
+        elif fields[0] == 'wave':
+            waves.append(dict(wave=int(fields[1]), members=fields[2], elapsed=round(fields[3], 3)))
+
+    # Without the members record wsadmin never got as far as the cluster
+    if rc != 0 or members is None:
+        module.fail_json(
+            changed=bool(results),
+            msg="Rolling restart of cluster {0} failed, wsadmin returned {1}{2}".format(cluster, rc, "" if members is not None else " before listing the members"),
+            results=results,
+            waves=waves,
+            elapsed=elapsed,
+            stdout=stdout_value,
+            stderr=stderr_value
+        )
+
+    failed = [r for r in results if r['rc'] != 0]
+    if failed or len(results) != len(members):
+        module.fail_json(
+            changed=bool(results),
+            msg="Rolling restart of cluster {0} failed: {1}".format(cluster, ", ".join(["{0}/{1}".format(r['node'], r['name']) for r in failed]) or "not all members were restarted"),
+            results=results,
+            waves=waves,
+            applications=apps,
+            elapsed=elapsed,
+            stdout=stdout_value,
+            stderr=stderr_value
+        )
+
+    module.exit_json(
+        changed=bool(results),
+        msg="Cluster {0} restarted, {1} members in {2} waves".format(cluster, len(results), len(waves)),
+        results=results,
+        waves=waves,
+        applications=apps,
+        elapsed=elapsed
+    )
+
+
 def main():
 
     # Read arguments
-    module = AnsibleModule(
+    module = TimedModule(
         argument_spec = dict(
-            state   = dict(default='started', choices=['started', 'stopped']),
-            name    = dict(required=True),
-            node = dict(required=True),
+            state   = dict(default='started', choices=['started', 'stopped', 'restarted']),
+            name    = dict(required=False),
+            node = dict(required=False),
+            servers = dict(required=False, type='list'),
+            concurrency = dict(default=4, type='int'),
+            cluster = dict(required=False),
+            wave_size = dict(default=1, type='int'),
             username = dict(required=False),
-            password = dict(required=False),
+            password = dict(required=False, no_log=True),
             wasdir  = dict(required=True),
-	    wsadmin = dict(default=True, type='bool')
+            wsadmin = dict(default=True, type='bool'),
+            session = dict(default=False, type='bool'),
+            session_idle_timeout = dict(default=600, type='int'),
+            session_dir = dict(required=False),
+            wait_for_ready = dict(default=False, type='bool'),
+            ready_message = dict(default='WSVR0001I'),
+            ready_error = dict(default='WSVR0009E'),
+            ready_timeout = dict(default=600, type='int'),
+            connector = dict(default='wsadmin', choices=['auto', 'soap', 'wsadmin']),
+            host = dict(default='localhost'),
+            port = dict(default=8879, type='int'),
+            use_ssl = dict(default=True, type='bool'),
+            validate_certs = dict(default=True, type='bool'),
+            timeout = dict(default=1200, type='int'),
+            profile_path = dict(required=False),
+            probe = dict(default=True, type='bool')
         ),
+        required_one_of = [['name', 'servers', 'cluster']],
+        mutually_exclusive = [['name', 'servers', 'cluster']],
+        required_if = [['state', 'restarted', ['cluster']]],
         supports_check_mode = True
     )
 
@@ -121,34 +1007,126 @@ def main():
     # Check if paths are valid
     if not os.path.exists(wasdir):
         module.fail_json(msg="{0} does not exists".format(wasdir))
+    if name and not node:
+        module.fail_json(msg="node is required together with name")
+
+    session = None
+    if wsadmin and module.params['session']:
+        session = WsadminSession(
+            wsadmin_command(wasdir, username=username, password=password, conntype=None),
+            session_dir=module.params['session_dir'],
+            idle_timeout=module.params['session_idle_timeout']
+        )
 
     cmd = ""
     credentials = ""
     if username is not None:
-	credentials += " {0} -username {1} ".format(credentials, username)
+        credentials += " -username {0} ".format(username)
     if password is not None:
-  	credentials += " {0} -password {1} ".format(credentials, password)
+        credentials += " -password {0} ".format(password)
+
+    # Rolling restart of a cluster
+    if module.params['cluster']:
+        if state != 'restarted' or not wsadmin:
+            module.fail_json(msg="cluster can only be used with state=restarted and wsadmin=true")
+        if module.params['wave_size'] < 1:
+            module.fail_json(msg="wave_size must be at least 1")
+        rollingRestart(module, session)
+
+    # Start or stop a list of servers
+    if module.params['servers']:
+        bulkControl(module, session, getClient(module), 'start' if state == 'started' else 'stop', credentials)
+
+    # Find out if there is anything to do before starting any JVM
+    current, method = None, None
+    if module.params['probe']:
+        current, method = probeServer(module, name, node, credentials)
+        if current == ('STARTED' if state == 'started' else 'STOPPED'):
+            module.exit_json(
+                changed=False,
+                msg="Server {0} is already {1}".format(name, state),
+                was_name=name,
+                was_state=1 if current == 'STARTED' else 0,
+                probe=method
+            )
+
+    client = None
+    if current is None or not module.check_mode:
+        client = getClient(module)
+    if client and current is None:
+        try:
+            current, method = client.serverState(name, node), 'soap'
+        except SoapError:
+            client = None
+        if current == ('STARTED' if state == 'started' else 'STOPPED'):
+            module.exit_json(
+                changed=False,
+                msg="Server {0} is already {1}".format(name, state),
+                was_name=name,
+                was_state=1 if current == 'STARTED' else 0,
+                probe=method
+            )
+
+    if module.check_mode:
+        module.exit_json(
+            changed=True,
+            msg="Server {0} is to be {1}".format(name, state),
+            was_name=name,
+            probe=method
+        )
+
+    # Start or stop the server through the SOAP connector
+    if client:
+        if state == 'started' and module.params['wait_for_ready']:
+            tail = followLog(module, name, node)
+        try:
+            if state == 'started':
+                current = client.startServer(name, node, module.params['timeout'])
+            else:
+                current = client.stopServer(name, node, module.params['timeout'])
+        except SoapError as e:
+            module.fail_json(
+                msg="Failed to {0} server {1} on node {2}: {3}".format('start' if state == 'started' else 'stop', name, node, e),
+                connector='soap'
+            )
+        ready = {}
+        if state == 'started' and module.params['wait_for_ready']:
+            ready = serverReady(module, name, tail, current)
+            if not ready['ready']:
+                module.fail_json(
+                    changed=True,
+                    msg="Server {0} started but did not become ready: {1}".format(name, ready['ready_line']),
+                    connector='soap',
+                    **ready
+                )
+        module.exit_json(
+            changed=True,
+            msg="Server {0} successfully {1}".format(name, state),
+            was_name=name,
+            was_state=1 if current == 'STARTED' else 0,
+            connector='soap',
+            **ready
+        )
 
     # Start server
     if state == 'started':
-	if wsadmin: 
-	    cmd = "{0}/bin/wsadmin.sh -lang jython {1} -c \"AdminControl.startServer('{2}', '{3}')\"".format(wasdir, credentials, name, node) 
-	else:
-	    cmd = "{0}/bin/startServer.sh {1} {2}".format(wasdir, name, credentials)
-        child = subprocess.Popen(
-            [cmd],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE    
-        )
-        stdout_value, stderr_value = child.communicate()
-	if child.returncode != 0:
-	    module.fail_json(
-		changed=False,
-		msg="Failed to start server {0} on node {1}".format(name, node),
-		stdout=stdout_value,
-		stderr=stderr_value
-	    )
+        if module.params['wait_for_ready']:
+            tail = followLog(module, name, node)
+        if session:
+            rc, stdout_value, stderr_value = runSession(module, session, "AdminControl.startServer('{0}', '{1}')".format(name, node))
+        else:
+            if wsadmin:
+                cmd = "{0}/bin/wsadmin.sh -lang jython {1} -c \"AdminControl.startServer('{2}', '{3}')\"".format(wasdir, credentials, name, node)
+            else:
+                cmd = "{0}/bin/startServer.sh {1} {2}".format(wasdir, name, credentials)
+            rc, stdout_value, stderr_value = runCommand(module, cmd, "startServer")
+        if rc != 0:
+            module.fail_json(
+                changed=False,
+                msg="Failed to start server {0} on node {1}".format(name, node),
+                stdout=stdout_value,
+                stderr=stderr_value
+            )
 
         if getState(stdout_value, name, wsadmin)["was_state"] == 1:
             module.exit_json(
@@ -160,38 +1138,49 @@ def main():
                 was_state=getItem("was_state"),
                 check_stdout=getItem("check_stdout")
             )
-        else: 
+        else:
+            ready = {}
+            if module.params['wait_for_ready']:
+                # startServer returned without an error, so the server is up
+                ready = serverReady(module, name, tail, 'STARTED')
+                if not ready['ready']:
+                    module.fail_json(
+                        changed=True,
+                        msg="Server {0} started but did not become ready: {1}".format(name, ready['ready_line']),
+                        stdout=stdout_value,
+                        stderr=stderr_value,
+                        **ready
+                    )
             module.exit_json(
-                changed=False,
+                changed=True,
                 msg="Server {0} successfully started".format(name),
                 stdout=stdout_value,
                 stderr=stderr_value,
                 was_name=getItem("was_name"),
                 was_state=getItem("was_state"),
-                check_stdout=getItem("check_stdout")
+                check_stdout=getItem("check_stdout"),
+                **ready
             )
 
     # Stop server
     if state == 'stopped':
-	if wsadmin:
-	   cmd = "{0}/bin/wsadmin.sh -lang jython {1} -c \"AdminControl.stopServer('{2}', '{3}')\"".format(wasdir, credentials, name, node)
-	else:
-	   cmd = "{0}/bin/stopServer.sh {1} {2}".format(wasdir, name, credentials)
-        child = subprocess.Popen(
-            [cmd],
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE    
-        )
-        stdout_value, stderr_value = child.communicate()
-	if child.returncode != 0:
-	    module.fail_json(
-		changed=False,
-		msg="Failed to stop server {0} on node {1}".format(name, node),
-		stdout=stdout_value,
-		stderr=stderr_value
-	    )
-        if getState(stdout_value, name, wsadmin)["was_state"] == 0:
+        if session:
+            rc, stdout_value, stderr_value = runSession(module, session, "AdminControl.stopServer('{0}', '{1}')".format(name, node))
+        else:
+            if wsadmin:
+                cmd = "{0}/bin/wsadmin.sh -lang jython {1} -c \"AdminControl.stopServer('{2}', '{3}')\"".format(wasdir, credentials, name, node)
+            else:
+                cmd = "{0}/bin/stopServer.sh {1} {2}".format(wasdir, name, credentials)
+            rc, stdout_value, stderr_value = runCommand(module, cmd, "stopServer")
+        if rc != 0:
+            module.fail_json(
+                changed=False,
+                msg="Failed to stop server {0} on node {1}".format(name, node),
+                stdout=stdout_value,
+                stderr=stderr_value
+            )
+        getState(stdout_value, name, wsadmin)
+        if re.search("appears to be stopped", stdout_value):
             module.exit_json(
                 changed=False,
                 msg="Server {0} is already stopped".format(name),
@@ -203,7 +1192,7 @@ def main():
             )
         else:
             module.exit_json(
-                changed=False,
+                changed=True,
                 msg="Server {0} successfully stopped".format(name),
                 stdout=stdout_value,
                 stderr=stderr_value,
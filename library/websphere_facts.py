@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+DOCUMENTATION = """
+module: websphere_facts
+version_added: "1.9.4"
+short_description: Gather facts about the topology of a WebSphere cell
+description:
+  - Reads the cells, nodes, servers, clusters and endpoints of a cell from the configuration repository of a profile,
+    without starting wsadmin, and returns them as the websphere fact
+options:
+  profile_path:
+    required: true
+    description:
+      - Path to the profile whose configuration repository is read, e.g. the deployment manager profile
+  cell:
+    required: false
+    description:
+      - Only return this cell. Defaults to all cells in the repository
+  cache:
+    required: false
+    default: true
+    description:
+      - Keep what was read from each file on the host and only read the files again whose mtime or size has changed
+  cache_dir:
+    required: false
+    default: ~/.ansible/websphere_facts
+    description:
+      - Directory holding the cached index
+author: "Amir Mofasser (@amofasser)"
+"""
+
+EXAMPLES = """
+# Gather facts:
+- websphere_facts: profile_path=/usr/local/WebSphere/AppServer/profiles/dmgr
+# Use them:
+- debug: msg="{{ websphere.cells['cell01'].nodes['node01'].servers.keys() }}"
+"""
+
+import os
+import xml.etree.ElementTree as ET
+
+from ansible.module_utils.was_config import buildIndex, cachePath
+
+
+def filterCell(index, cell):
+    """
+    Drops everything from the index that does not belong to cell
+    """
+    index['cells'] = dict((name, data) for name, data in index['cells'].items() if name == cell)
+    index['endpoints'] = [e for e in index['endpoints'] if e['cell'] == cell]
+    ports = {}
+    for e in index['endpoints']:
+        if e['port']:
+            ports.setdefault(e['host'], set()).add(e['port'])
+    index['ports'] = dict((host, sorted(used)) for host, used in ports.items())
+    return index
+
+
+def main():
+
+    # Read arguments
+    module = AnsibleModule(
+        argument_spec = dict(
+            profile_path = dict(required=True),
+            cell = dict(required=False),
+            cache = dict(default=True, type='bool'),
+            cache_dir = dict(default='~/.ansible/websphere_facts')
+        ),
+        supports_check_mode = True
+    )
+
+    profile_path = module.params['profile_path']
+    cell = module.params['cell']
+
+    # Check if paths are valid
+    if not os.path.exists(os.path.join(profile_path, "config", "cells")):
+        module.fail_json(msg="{0} does not contain a configuration repository".format(profile_path))
+
+    cache_file = None
+    if module.params['cache']:
+        cache_file = cachePath(module.params['cache_dir'], profile_path)
+
+    try:
+        index, parsed = buildIndex(profile_path, cache_file)
+    except (ET.ParseError, IOError, OSError) as e:
+        module.fail_json(msg="Failed reading the configuration of {0}: {1}".format(profile_path, e))
+
+    if cell:
+        if cell not in index['cells']:
+            module.fail_json(msg="Cell {0} not found in {1}".format(cell, profile_path))
+        index = filterCell(index, cell)
+
+    nodes = sum([len(data['nodes']) for data in index['cells'].values()])
+    clusters = sum([len(data['clusters']) for data in index['cells'].values()])
+    module.exit_json(
+        changed=False,
+        msg="Found {0} cells, {1} nodes and {2} clusters".format(len(index['cells']), nodes, clusters),
+        files_parsed=parsed,
+        ansible_facts=dict(websphere=index)
+    )
+
+
+# import module snippets
+from ansible.module_utils.basic import *
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,503 @@
-#!/usr/bin/python
-# -*- coding: utf-8 -*-
-# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
-
-# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
-
-import os
-import subprocess
-import platform
-import datetime
-
-def main():
-
-    # Read arguments
-    module = AnsibleModule(
-        argument_spec = dict(
-            params = dict(required=True),
-            host = dict(default='localhost', required=False),
-            port = dict(default='8879', required=False),
-            username = dict(required=False),
-            password = dict(required=False),
-            script = dict(required=True)
-        )
-    )
-
-    params = module.params['params']
-    host = module.params['host']
-    port = module.params['port']
-    username = module.params['username']
-    password = module.params['password']
-    script = module.params['script']
-
-    # Run wsadmin command server
-    if state == 'stopped':
-        child = subprocess.Popen([wasdir+"/bin/wsadmin.sh -lang jython -conntype SOAP -host "+host+" -port "+port+" -username " + username + " -password " + password " -f "+script+" "+params], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout_value, stderr_value = child.communicate()
-        if child.returncode != 0:
-            module.fail_json(msg="Failed executing wsadmin script: " + ¨script, stdout=stdout_value, stderr=stderr_value)
-
-        module.exit_json(changed=True, msg="Script executed successfully: " + script, stdout=stdout_value)
-
-
-# import module snippets
-from ansible.module_utils.basic import *
-if __name__ == '__main__':
-    main()
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+DOCUMENTATION = """
+module: wsadmin
+version_added: "1.9.4"
+short_description: Run a wsadmin jython script
+description:
+  - Runs a jython script with wsadmin, either in a new wsadmin process or in a persistent wsadmin session on the host
+options:
+  wasdir:
+    required: true
+    description:
+      - Path to root of WAS installation directory or profile
+  script:
+    required: false
+    description:
+      - Path to the jython script on the host. Either script or scripts is required
+  params:
+    required: false
+    description:
+      - Arguments passed to the script
+  scripts:
+    required: false
+    description:
+      - Ordered list of scripts to run in one wsadmin invocation. An item is either the path to a script, a dict
+        with the keys script and params, or a dict with an inline jython command under the key command.
+        The batch stops at the first script that fails.
+  save:
+    required: false
+    default: end
+    choices: [ end, each, none ]
+    description:
+      - When running scripts, call AdminConfig.save() once after the last script (end), after every script (each)
+        or not at all (none)
+  host:
+    required: false
+    default: localhost
+    description:
+      - Host name of the deployment manager
+  port:
+    required: false
+    default: 8879
+    description:
+      - SOAP port of the deployment manager
+  username:
+    required: false
+    description:
+      - Administrative user username
+  password:
+    required: false
+    description:
+      - Administrative user password
+  session:
+    required: false
+    default: false
+    description:
+      - Run the script in a persistent wsadmin session. The first task starts a wsadmin process that later tasks
+        with the same wasdir, host, port and credentials reuse, which saves the JVM startup and connect on every task.
+  session_idle_timeout:
+    required: false
+    default: 600
+    description:
+      - Seconds a persistent session may stay unused before its wsadmin process exits
+  session_dir:
+    required: false
+    description:
+      - Directory holding the session sockets. Defaults to ansible-wsadmin-<uid> in the system temp directory
+  cache:
+    required: false
+    default: false
+    description:
+      - Remember successful runs on the host, keyed by a hash of the contents of the scripts, their params, the
+        target host and port, the username and the guard. When the same inputs ran successfully before, the module returns the stored result
+        with changed=false instead of running wsadmin. Only use this for idempotent scripts.
+  cache_dir:
+    required: false
+    default: ~/.ansible/wsadmin_cache
+    description:
+      - Directory holding the stored results
+  cache_ttl:
+    required: false
+    default: 86400
+    description:
+      - Seconds a stored result stays valid. 0 keeps it until it is invalidated
+  cache_invalidate:
+    required: false
+    default: false
+    description:
+      - Throw away the stored result for these inputs and run the scripts
+  guard:
+    required: false
+    description:
+      - Inline jython command whose output is stored along with a result. A stored result is only used when the
+        guard prints the same as it did after the last run, e.g. a query of the configuration the script changes.
+        Runs in wsadmin, so combine it with session to keep the check cheap.
+  timings_file:
+    required: false
+    description:
+      - Append the timings of the commands run to this file on the host, one JSON document per line
+author: "Amir Mofasser (@amofasser)"
+"""
+
+EXAMPLES = """
+# Run a script:
+- wsadmin: wasdir=/usr/local/WebSphere/AppServer/ script=/tmp/create_cluster.py params="myCluster"
+# Run several scripts and commands in one wsadmin and save once at the end:
+- wsadmin:
+    wasdir: /usr/local/WebSphere/AppServer/
+    scripts:
+      - /tmp/create_cluster.py
+      - script: /tmp/create_member.py
+        params: myCluster member01
+      - command: AdminTask.createAuthDataEntry('[-alias db -user db -password secret]')
+    save: end
+# Run a script in a persistent session:
+- wsadmin: wasdir=/usr/local/WebSphere/AppServer/ script=/tmp/create_cluster.py params="myCluster" session=true
+# Only run a script again when it or the clusters have changed:
+- wsadmin:
+    wasdir: /usr/local/WebSphere/AppServer/
+    script: /tmp/create_cluster.py
+    params: myCluster
+    session: true
+    cache: true
+    guard: print AdminConfig.list('ServerCluster')
+"""
+
+import os
+import re
+import shlex
+import subprocess
+import platform
+import datetime
+import tempfile
+import hashlib
+import json
+import time
+
+from ansible.module_utils.wsadmin_session import WsadminSession, WsadminSessionError, wsadmin_command
+from ansible.module_utils.timings import TimedModule
+
+STEP_MARKER = "__ANSIBLE_WSADMIN_STEP__"
+
+# Runs the steps of a batch one after the other in the same wsadmin, each
+# in its own namespace. Every step is framed by markers carrying its exit
+# status and elapsed time so that the output can be split up afterwards.
+BATCH = """import sys
+import time
+import traceback
+__ansible_steps = %(steps)s
+__ansible_rc = 0
+for __ansible_i in range(len(__ansible_steps)):
+    __ansible_kind, __ansible_src, __ansible_argv = __ansible_steps[__ansible_i]
+    __ansible_g = {'__name__': '__main__'}
+    for __ansible_k in globals().keys():
+        if __ansible_k[:5] == 'Admin' or __ansible_k == 'Help':
+            __ansible_g[__ansible_k] = globals()[__ansible_k]
+    sys.argv = __ansible_argv
+    print '%(marker)s begin %%d' %% __ansible_i
+    __ansible_start = time.time()
+    try:
+        if __ansible_kind == 'script':
+            execfile(__ansible_src, __ansible_g)
+        else:
+            exec __ansible_src in __ansible_g
+        if %(save_each)d:
+            AdminConfig.save()
+    except SystemExit, __ansible_e:
+        __ansible_rc = getattr(__ansible_e, 'code', 1)
+        if __ansible_rc is None:
+            __ansible_rc = 0
+        elif type(__ansible_rc) != type(0):
+            print __ansible_rc
+            __ansible_rc = 1
+        if __ansible_rc == 0 and %(save_each)d:
+            AdminConfig.save()
+    except:
+        traceback.print_exc(file=sys.stdout)
+        __ansible_rc = 1
+    sys.stdout.flush()
+    print '%(marker)s end %%d %%d %%.3f' %% (__ansible_i, __ansible_rc, time.time() - __ansible_start)
+    if __ansible_rc != 0:
+        break
+if __ansible_rc == 0 and %(save_end)d:
+    print '%(marker)s begin save'
+    __ansible_start = time.time()
+    try:
+        AdminConfig.save()
+    except:
+        traceback.print_exc(file=sys.stdout)
+        __ansible_rc = 1
+    sys.stdout.flush()
+    print '%(marker)s end save %%d %%.3f' %% (__ansible_rc, time.time() - __ansible_start)
+sys.stdout.flush()
+sys.exit(__ansible_rc)
+"""
+
+def getSteps(module):
+    """
+    Turns the scripts parameter into a list of dicts with the keys script,
+    params and command
+    :return: list
+    """
+    steps = []
+    for item in module.params['scripts']:
+        if not isinstance(item, dict):
+            item = dict(script=item)
+        step = dict(script=item.get('script'), params=item.get('params') or '', command=item.get('command'))
+        if (step['script'] is None) == (step['command'] is None):
+            module.fail_json(msg="Each item in scripts needs exactly one of script and command: {0}".format(item))
+        if step['script'] is not None and not os.path.exists(step['script']):
+            module.fail_json(msg="{0} does not exists".format(step['script']))
+        steps.append(step)
+    return steps
+
+
+def batchScript(steps, save):
+    """
+    Generates the jython that runs all steps in one wsadmin
+    :param steps: list of steps from getSteps()
+    :param save: end, each or none
+    :return: str
+    """
+    batch = []
+    for step in steps:
+        if step['script'] is not None:
+            batch.append(('script', step['script'], [step['script']] + shlex.split(step['params'])))
+        else:
+            batch.append(('command', step['command'], []))
+    return BATCH % dict(
+        steps=repr(batch),
+        marker=STEP_MARKER,
+        save_each=save == 'each',
+        save_end=save == 'end'
+    )
+
+
+def parseBatch(steps, stdout_value):
+    """
+    Splits the output of a batch into the results of each step
+    :return: tuple of the list of step results and the result of the final save, if any
+    """
+    results = []
+    save = None
+    current = None
+    lines = []
+    for line in stdout_value.splitlines(True):
+        begin = re.match(r"{0} begin (\d+|save)\s*$".format(STEP_MARKER), line)
+        end = re.match(r"{0} end (\d+|save) (-?\d+) ([0-9.]+)\s*$".format(STEP_MARKER), line)
+        if begin:
+            current = begin.group(1)
+            lines = []
+        elif end and end.group(1) == current:
+            result = dict(rc=int(end.group(2)), elapsed=float(end.group(3)), stdout="".join(lines))
+            if current == 'save':
+                save = result
+            else:
+                result.update(steps[int(current)])
+                results.append(result)
+            current = None
+        elif current is not None:
+            lines.append(line)
+    return results, save
+
+
+def runBatch(module, session, cmd, steps):
+    """
+    Runs all steps in one wsadmin
+    :return: dict with the results to exit the module with
+    """
+    driver = batchScript(steps, module.params['save'])
+    stderr_value = ""
+    if session:
+        try:
+            rc, stdout_value = session.run(code=driver)
+        except WsadminSessionError as e:
+            module.fail_json(msg="Failed executing wsadmin scripts", stdout=str(e), session_key=session.key)
+    else:
+        fd, path = tempfile.mkstemp(suffix=".py")
+        try:
+            os.write(fd, driver.encode('utf-8'))
+            os.close(fd)
+            rc, stdout_value, stderr_value = module.runCommand(cmd + ["-f", path], label="wsadmin", universal_newlines=True)
+        finally:
+            os.unlink(path)
+
+    results, save = parseBatch(steps, stdout_value)
+    failed = [r for r in results if r['rc'] != 0]
+    if failed:
+        step = failed[0]
+        module.fail_json(
+            msg="Failed executing wsadmin script: {0}".format(step['script'] or step['command']),
+            results=results,
+            stdout=stdout_value,
+            stderr=stderr_value
+        )
+    if rc != 0 or len(results) != len(steps) or (save and save['rc'] != 0):
+        module.fail_json(
+            msg="Failed executing wsadmin scripts",
+            results=results,
+            save=save,
+            stdout=stdout_value,
+            stderr=stderr_value
+        )
+
+    return dict(
+        changed=True,
+        msg="{0} scripts executed successfully".format(len(results)),
+        results=results,
+        save=save,
+        stdout=stdout_value
+    )
+
+
+def cacheKey(module, steps):
+    """
+    Hashes everything that decides the outcome of a run: the contents of
+    the scripts, their params, the save mode, the target, the user the
+    scripts run as and the guard whose output is stored with the result
+    :return: str
+    """
+    digest = hashlib.sha256()
+    for item in [module.params['wasdir'], module.params['host'], str(module.params['port']), module.params['save'] if module.params['scripts'] else '',
+                 module.params['username'] or '', module.params['guard'] or '']:
+        digest.update(item.encode('utf-8') + b"\0")
+    for step in steps:
+        if step['script'] is not None:
+            f = open(step['script'], 'rb')
+            try:
+                digest.update(b"script\0" + hashlib.sha256(f.read()).digest())
+            finally:
+                f.close()
+        else:
+            digest.update(b"command\0" + step['command'].encode('utf-8'))
+        digest.update(b"\0" + step['params'].encode('utf-8') + b"\0")
+    return digest.hexdigest()
+
+
+def runGuard(module, session, cmd):
+    """
+    Runs the guard command and returns what it printed, without the
+    informational WASX messages wsadmin prints when connecting
+    :return: str
+    """
+    guard = module.params['guard']
+    if session:
+        try:
+            rc, stdout_value = session.run(code=guard)
+        except WsadminSessionError as e:
+            module.fail_json(msg="Failed executing guard: {0}".format(guard), stdout=str(e))
+    else:
+        rc, stdout_value, stderr_value = module.runCommand(cmd + ["-c", guard], label="guard", universal_newlines=True)
+    if rc != 0:
+        module.fail_json(msg="Failed executing guard: {0}".format(guard), rc=rc, stdout=stdout_value)
+    return "".join([line for line in stdout_value.splitlines(True) if not re.match(r"WASX\d+I: ", line)])
+
+
+def readCache(module, path):
+    """
+    Returns the stored result at path if it is still valid, otherwise None
+    """
+    if module.params['cache_invalidate']:
+        if os.path.exists(path):
+            os.unlink(path)
+        return None
+    try:
+        f = open(path)
+        try:
+            entry = json.load(f)
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError):
+        return None
+    ttl = module.params['cache_ttl']
+    if ttl > 0 and time.time() - entry['created'] > ttl:
+        return None
+    return entry
+
+
+def writeCache(path, entry):
+    """
+    Stores a result, replacing the file in one go so that concurrent runs
+    never read half of it
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    try:
+        os.write(fd, json.dumps(entry).encode('utf-8'))
+    finally:
+        os.close(fd)
+    os.rename(tmp, path)
+
+
+def main():
+
+    # Read arguments
+    module = TimedModule(
+        argument_spec = dict(
+            wasdir = dict(required=True),
+            params = dict(default='', required=False),
+            host = dict(default='localhost', required=False),
+            port = dict(default='8879', required=False),
+            username = dict(required=False),
+            password = dict(required=False, no_log=True),
+            script = dict(required=False),
+            scripts = dict(required=False, type='list'),
+            save = dict(default='end', choices=['end', 'each', 'none']),
+            session = dict(default=False, type='bool'),
+            session_idle_timeout = dict(default=600, type='int'),
+            session_dir = dict(required=False),
+            cache = dict(default=False, type='bool'),
+            cache_dir = dict(default='~/.ansible/wsadmin_cache'),
+            cache_ttl = dict(default=86400, type='int'),
+            cache_invalidate = dict(default=False, type='bool'),
+            guard = dict(required=False)
+        ),
+        required_one_of = [['script', 'scripts']],
+        mutually_exclusive = [['script', 'scripts']]
+    )
+
+    wasdir = module.params['wasdir']
+    params = module.params['params']
+    host = module.params['host']
+    port = module.params['port']
+    username = module.params['username']
+    password = module.params['password']
+    script = module.params['script']
+    session = module.params['session']
+
+    # Check if paths are valid
+    if not os.path.exists(wasdir):
+        module.fail_json(msg="{0} does not exists".format(wasdir))
+    if script and not os.path.exists(script):
+        module.fail_json(msg="{0} does not exists".format(script))
+
+    cmd = wsadmin_command(wasdir, host, port, username, password)
+    ws = None
+    if session:
+        ws = WsadminSession(cmd, session_dir=module.params['session_dir'], idle_timeout=module.params['session_idle_timeout'])
+
+    if module.params['scripts']:
+        steps = getSteps(module)
+    else:
+        steps = [dict(script=script, params=params, command=None)]
+
+    # Return the result of an earlier identical run
+    path = None
+    if module.params['cache']:
+        path = os.path.join(os.path.expanduser(module.params['cache_dir']), cacheKey(module, steps) + ".json")
+        entry = readCache(module, path)
+        if entry is not None and (not module.params['guard'] or runGuard(module, ws, cmd) == entry['guard']):
+            result = entry['result']
+            result.update(
+                changed=False,
+                msg="Skipped, identical run succeeded before: {0}".format(result['msg']),
+                cached=True,
+                cache_age=round(time.time() - entry['created'], 3)
+            )
+            module.exit_json(**result)
+
+    # Run a batch of scripts in one wsadmin
+    if module.params['scripts']:
+        result = runBatch(module, ws, cmd, steps)
+
+    # Run the script in a persistent wsadmin session
+    elif session:
+        try:
+            rc, stdout_value = ws.run(script=script, args=shlex.split(params))
+        except WsadminSessionError as e:
+            module.fail_json(msg="Failed executing wsadmin script: {0}".format(script), stdout=str(e), session_key=ws.key)
+        if rc != 0:
+            module.fail_json(msg="Failed executing wsadmin script: {0}".format(script), rc=rc, stdout=stdout_value, session_key=ws.key)
+
+        result = dict(changed=True, msg="Script executed successfully: {0}".format(script), stdout=stdout_value, session_key=ws.key, session_restarted=ws.restarted)
+
+    # Run the script in a new wsadmin process
+    else:
+        rc, stdout_value, stderr_value = module.runCommand(cmd + ["-f", script] + shlex.split(params), label="wsadmin", universal_newlines=True)
+        if rc != 0:
+            module.fail_json(msg="Failed executing wsadmin script: {0}".format(script), stdout=stdout_value, stderr=stderr_value)
+
+        result = dict(changed=True, msg="Script executed successfully: {0}".format(script), stdout=stdout_value)
+
+    # Remember the result, together with what the guard says afterwards
+    if path:
+        guard = None
+        if module.params['guard']:
+            guard = runGuard(module, ws, cmd)
+        writeCache(path, dict(created=time.time(), guard=guard, result=result))
+        result['cached'] = False
+
+    module.exit_json(**result)
+
+
+# import module snippets
+from ansible.module_utils.basic import *
+if __name__ == '__main__':
+    main()
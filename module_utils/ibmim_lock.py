@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Host-wide lock for Installation Manager operations.
+
+flock() alone hands the lock to whichever waiter happens to ask first, so a
+steady stream of readers can keep an install waiting forever. Every process
+therefore takes a ticket in a queue file next to the lock first, and only
+tries the lock once nothing ahead of it is in the way: an exclusive waiter
+has to be first in the queue, a shared one only needs shared entries ahead
+of it. Entries of processes that died are dropped from the queue.
+
+The lock lives in the agent data location of an admin installation for
+root, and in a directory only the user can enter for other users, rather
+than somewhere anybody could create it first.
+"""
+
+import atexit
+import errno
+import fcntl
+import os
+import time
+
+from ansible.module_utils.ibmim_registry import ADMIN_DATA_LOCATION
+
+LOCK_NAME = "ansible_ibmim.lock"
+USER_LOCK_DIR = "~/.ansible/ibmim_lock"
+
+
+class LockError(Exception):
+    pass
+
+
+class LockTimeout(LockError):
+    pass
+
+
+def defaultLockFile():
+    """
+    :return: path of the host-wide lock of the current user when none is given
+    """
+    if os.getuid() == 0:
+        return os.path.join(ADMIN_DATA_LOCATION, LOCK_NAME)
+    return os.path.join(os.path.expanduser(USER_LOCK_DIR), LOCK_NAME)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class HostLock(object):
+    """
+    Shared or exclusive lock on path, granted in the order it was asked for
+    """
+
+    def __init__(self, path, timeout=3600, poll=0.2):
+        self.path = path
+        self.queue_path = path + ".queue"
+        self.timeout = timeout
+        self.poll = poll
+        self.fd = None
+        self.ticket = None
+        self.shared = None
+        atexit.register(self.release)
+
+    def _open(self, path):
+        """
+        Opens or creates path without following links, and its directory if missing
+        :return: file descriptor
+        """
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            return os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o644)
+        except (IOError, OSError) as e:
+            raise LockError("Could not open the lock file {0}: {1}".format(path, e))
+
+    def _queue(self, update):
+        """
+        Runs update() on the live entries of the queue while holding it, and
+        writes back the entries it returns
+        :param update: function taking the list of (ticket, pid, mode) and returning a tuple of a result and the new list
+        :return: the result of update()
+        """
+        fd = self._open(self.queue_path)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = b""
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                data += chunk
+            entries = []
+            for line in data.decode('ascii', 'replace').splitlines():
+                fields = line.split()
+                if len(fields) == 3 and fields[0].isdigit() and fields[1].isdigit():
+                    entries.append((int(fields[0]), int(fields[1]), fields[2]))
+            live = [e for e in entries if e[1] == os.getpid() or _alive(e[1])]
+            result, updated = update(live)
+            if updated != entries:
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, "".join(["{0} {1} {2}\n".format(*e) for e in updated]).encode('ascii'))
+            return result
+        finally:
+            os.close(fd)
+
+    def _enqueue(self, mode):
+        def update(entries):
+            ticket = max([e[0] for e in entries] + [0]) + 1
+            return ticket, entries + [(ticket, os.getpid(), mode)]
+        self.ticket = self._queue(update)
+
+    def _dequeue(self):
+        ticket = self.ticket
+        self.ticket = None
+        self._queue(lambda entries: (None, [e for e in entries if e[0] != ticket]))
+
+    def _ahead(self):
+        def update(entries):
+            return [e for e in entries if e[0] < self.ticket], entries
+        return self._queue(update)
+
+    def acquire(self, shared=False):
+        """
+        Waits in the queue for the lock, for at most timeout seconds. A held
+        lock of the other mode is released first and asked for again at the
+        end of the queue.
+        :return: seconds waited
+        """
+        if self.fd is not None:
+            if self.shared == shared:
+                return 0
+            self.release()
+        mode = 'shared' if shared else 'exclusive'
+        start = time.time()
+        self._enqueue(mode)
+        try:
+            fd = self._open(self.path)
+        except LockError:
+            self._dequeue()
+            raise
+        try:
+            while True:
+                ahead = self._ahead()
+                if not ahead or (shared and all([e[2] == 'shared' for e in ahead])):
+                    try:
+                        fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+                        break
+                    except (IOError, OSError) as e:
+                        # Held by a process that doesn't queue, or just leaving
+                        if e.errno not in (errno.EAGAIN, errno.EACCES):
+                            raise
+                if time.time() - start > self.timeout:
+                    raise LockTimeout("Timed out after {0} seconds waiting for the {1} lock on {2}, held or queued for by pids {3}".format(
+                        self.timeout, mode, self.path, ", ".join([str(e[1]) for e in ahead]) or "unknown"))
+                time.sleep(self.poll)
+        except BaseException:
+            os.close(fd)
+            self._dequeue()
+            raise
+        self.fd = fd
+        self.shared = shared
+        return round(time.time() - start, 3)
+
+    def release(self):
+        """
+        Releases the lock and leaves the queue
+        """
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+            self.shared = None
+        if self.ticket is not None:
+            self._dequeue()
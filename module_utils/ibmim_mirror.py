@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Keeps a local mirror of an Installation Manager repository.
+
+Every file is stored once under objects/ in the cache directory, named by
+its sha256 digest, and hard linked into mirrors/<key>/ where it has the same
+relative path as in the remote repository. imcl is then pointed at the
+repository.config of the mirror. Files that were fetched before are reused
+as long as the remote size and ETag, Last-Modified or mtime are unchanged,
+or, with a manifest, as long as the digest is the same. Downloads run in
+parallel, and an interrupted download is resumed where it stopped.
+
+The files of a remote repository are found through a manifest of
+"<sha256>  <path>" lines like sha256sum writes them, or else by walking
+the directory, or the directory listings of the web server.
+"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import socket
+import ssl
+import tempfile
+import threading
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+try:
+    from urllib.request import Request, urlopen, HTTPSHandler, build_opener
+    from urllib.error import HTTPError, URLError
+    from urllib.parse import quote, unquote, urljoin, urlparse
+except ImportError:
+    from urllib2 import Request, urlopen, HTTPSHandler, build_opener, HTTPError, URLError
+    from urllib import quote, unquote
+    from urlparse import urljoin, urlparse
+
+CHUNK = 1024 * 1024
+HREF_RE = re.compile(r'href\s*=\s*["\']([^"\'#?]+)["\']', re.IGNORECASE)
+
+
+class MirrorError(Exception):
+    pass
+
+
+def isMirrorable(repository):
+    """
+    Returns True for the repositories that can be mirrored, i.e. http, https
+    and file URLs. Plain paths are already local and are left alone.
+    """
+    return urlparse(repository).scheme in ('http', 'https', 'file')
+
+
+def relativePath(path):
+    """
+    Normalizes the path of a file in a repository as a manifest or directory
+    listing gives it, e.g. ./disk1/repository.config
+    :return: the path relative to the root of the repository
+    """
+    if path.startswith("./"):
+        path = path[2:]
+    rel = os.path.normpath(path)
+    if os.path.isabs(rel) or rel == os.curdir or rel == os.pardir or rel.startswith(os.pardir + os.sep):
+        raise MirrorError("{0} is not a path within the repository".format(path))
+    return rel
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        # Another thread or host may have just created it
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class Mirror(object):
+    """
+    Mirror of one repository in cache_dir
+    """
+
+    def __init__(self, url, cache_dir, concurrency=4, manifest=None, timeout=60, validate_certs=True):
+        # Strip repository.config, the mirror is of the directory holding it
+        if url.endswith("repository.config"):
+            url = url[:-len("repository.config")]
+        self.url = url.rstrip("/") + "/"
+        self.scheme = urlparse(self.url).scheme
+        self.cache_dir = cache_dir
+        self.concurrency = max(1, concurrency)
+        self.manifest = manifest
+        self.timeout = timeout
+        self.key = hashlib.sha256(self.url.encode('utf-8')).hexdigest()[:16]
+        self.root = os.path.join(cache_dir, "mirrors", self.key)
+        self.objects = os.path.join(cache_dir, "objects")
+        self.index_path = os.path.join(cache_dir, "mirrors", self.key + ".json")
+        self.lock = threading.Lock()
+        self.stats = dict(files=0, downloaded=0, reused=0, resumed=0, bytes=0)
+        self.opener = None
+        if self.scheme == 'https' and not validate_certs:
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            self.opener = build_opener(HTTPSHandler(context=context))
+
+    # Access to the remote repository
+
+    def _open(self, url, headers=None, method=None):
+        request = Request(url, headers=headers or {})
+        if method:
+            request.get_method = lambda: method
+        try:
+            if self.opener:
+                return self.opener.open(request, timeout=self.timeout)
+            return urlopen(request, timeout=self.timeout)
+        except HTTPError as e:
+            raise MirrorError("{0} {1} fetching {2}".format(e.code, e.reason, url))
+        except (URLError, socket.error) as e:
+            raise MirrorError("Failed fetching {0}: {1}".format(url, e))
+
+    def _localPath(self, rel):
+        return os.path.join(unquote(urlparse(self.url).path), rel)
+
+    def _read(self, rel):
+        if self.scheme == 'file':
+            try:
+                f = open(self._localPath(rel), 'rb')
+            except (IOError, OSError) as e:
+                raise MirrorError("Failed reading {0}: {1}".format(self._localPath(rel), e))
+        else:
+            f = self._open(self.url + quote(rel))
+        try:
+            return f.read().decode('utf-8', 'replace')
+        finally:
+            f.close()
+
+    def _stat(self, rel):
+        """
+        :return: tuple of the size and a stamp that changes with the content
+        """
+        if self.scheme == 'file':
+            try:
+                st = os.stat(self._localPath(rel))
+            except OSError as e:
+                raise MirrorError("Failed reading {0}: {1}".format(self._localPath(rel), e))
+            return st.st_size, str(st.st_mtime)
+        response = self._open(self.url + quote(rel), method='HEAD')
+        try:
+            size = response.headers.get('Content-Length')
+            stamp = response.headers.get('ETag') or response.headers.get('Last-Modified')
+            return (int(size) if size is not None else None), stamp
+        finally:
+            response.close()
+
+    def listFiles(self):
+        """
+        Lists the files of the repository
+        :return: dict of relative path to the expected sha256 digest, or None if unknown
+        """
+        if self.manifest:
+            files = {}
+            for line in self._read(self.manifest).splitlines():
+                fields = line.strip().split(None, 1)
+                if len(fields) == 2:
+                    # sha256sum marks files read in binary mode with a *
+                    path = fields[1][1:] if fields[1].startswith("*") else fields[1]
+                    files[relativePath(path)] = fields[0].lower()
+            return files
+
+        files = {}
+        if self.scheme == 'file':
+            top = self._localPath("")
+            for dirpath, dirnames, filenames in os.walk(top):
+                for name in filenames:
+                    files[os.path.relpath(os.path.join(dirpath, name), top)] = None
+        else:
+            pending = [""]
+            seen = set()
+            while pending:
+                directory = pending.pop()
+                for href in HREF_RE.findall(self._read(directory)):
+                    target = urljoin(self.url + directory, href)
+                    if not target.startswith(self.url) or target in seen:
+                        continue
+                    seen.add(target)
+                    rel = unquote(target[len(self.url):])
+                    if not rel:
+                        continue
+                    if rel.endswith("/"):
+                        pending.append(rel)
+                    else:
+                        files[relativePath(rel)] = None
+        if "repository.config" not in files:
+            raise MirrorError("{0} is not a repository, it has no repository.config".format(self.url))
+        return files
+
+    # The local store
+
+    def _objectPath(self, digest):
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def _link(self, digest, rel):
+        target = os.path.join(self.root, rel)
+        if not os.path.isdir(os.path.dirname(target)):
+            _makedirs(os.path.dirname(target))
+        if os.path.exists(target) and os.path.samefile(target, self._objectPath(digest)):
+            return
+        # Link next to the target and rename, so that a concurrent run never
+        # sees the file missing or half copied
+        tmp = "{0}.{1}.{2}.tmp".format(target, socket.gethostname(), os.getpid())
+        try:
+            os.link(self._objectPath(digest), tmp)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.copyfile(self._objectPath(digest), tmp)
+        os.rename(tmp, target)
+
+    def _fetch(self, rel, size, stamp, expected=None):
+        """
+        Fetches a file into the object store, resuming a partial download.
+        Runs on the same host wait for each other through a lock next to the
+        partial file, runs on other hosts have partial files of their own.
+        :return: sha256 digest of the file
+        """
+        tmp = os.path.join(self.objects, "tmp")
+        if not os.path.isdir(tmp):
+            _makedirs(tmp)
+        part = os.path.join(tmp, "{0}.{1}.part".format(hashlib.sha256((self.url + rel).encode('utf-8')).hexdigest()[:32], socket.gethostname()))
+        lock = open(part + ".lock", 'a')
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            if expected and os.path.exists(self._objectPath(expected)):
+                return expected
+            return self._download(rel, size, stamp, part)
+        finally:
+            lock.close()
+
+    def _download(self, rel, size, stamp, part):
+        sha = hashlib.sha256()
+        offset = 0
+        # A partial file can only be continued with the version of the file
+        # it was started on, recorded in the stamp file next to it
+        started = None
+        if os.path.exists(part) and os.path.getsize(part) > 0:
+            try:
+                f = open(part + ".stamp")
+                try:
+                    started = f.read() or None
+                finally:
+                    f.close()
+            except (IOError, OSError):
+                pass
+        if self.scheme == 'file':
+            source = open(self._localPath(rel), 'rb')
+            if started is not None and started == stamp:
+                offset = os.path.getsize(part)
+                source.seek(offset)
+        else:
+            headers = {}
+            if started is not None:
+                offset = os.path.getsize(part)
+                headers['Range'] = "bytes={0}-".format(offset)
+                headers['If-Range'] = started
+            source = self._open(self.url + quote(rel), headers)
+            if offset and getattr(source, 'status', source.getcode()) != 206:
+                # The file has changed since, the server sent all of it
+                offset = 0
+            stamp = source.headers.get('ETag') or source.headers.get('Last-Modified') or stamp
+        if not offset:
+            if stamp is None:
+                if os.path.exists(part + ".stamp"):
+                    os.unlink(part + ".stamp")
+            else:
+                f = open(part + ".stamp", 'w')
+                try:
+                    f.write(stamp)
+                finally:
+                    f.close()
+
+        try:
+            if offset:
+                with self.lock:
+                    self.stats['resumed'] += 1
+                f = open(part, 'rb')
+                try:
+                    for chunk in iter(lambda: f.read(CHUNK), b""):
+                        sha.update(chunk)
+                finally:
+                    f.close()
+            out = open(part, 'ab' if offset else 'wb')
+            try:
+                for chunk in iter(lambda: source.read(CHUNK), b""):
+                    sha.update(chunk)
+                    out.write(chunk)
+                    with self.lock:
+                        self.stats['bytes'] += len(chunk)
+            except (httplib.HTTPException, socket.error) as e:
+                # What has arrived stays in the partial file for the next run
+                raise MirrorError("Download of {0} was interrupted: {1!r}".format(rel, e))
+            finally:
+                out.close()
+        finally:
+            source.close()
+
+        # A server that hangs up early may just end the body
+        if size is not None and os.path.getsize(part) < size:
+            raise MirrorError("Download of {0} was interrupted after {1} of {2} bytes".format(rel, os.path.getsize(part), size))
+
+        digest = sha.hexdigest()
+        target = self._objectPath(digest)
+        if not os.path.isdir(os.path.dirname(target)):
+            _makedirs(os.path.dirname(target))
+        os.rename(part, target)
+        if os.path.exists(part + ".stamp"):
+            os.unlink(part + ".stamp")
+        return digest
+
+    def _syncFile(self, rel, expected, index):
+        """
+        Makes sure rel is in the store and linked into the mirror
+        :param expected: sha256 digest from the manifest or None
+        :param index: what the previous sync recorded for each file
+        :return: the new index entry of the file
+        """
+        size, stamp = self._stat(rel)
+        entry = index.get(rel)
+
+        # Reuse what is already in the store
+        digest = None
+        if expected and os.path.exists(self._objectPath(expected)):
+            digest = expected
+        elif not expected and entry and os.path.exists(self._objectPath(entry['sha256'])) \
+                and entry['size'] == size and entry['stamp'] == stamp and stamp is not None:
+            digest = entry['sha256']
+
+        if digest:
+            with self.lock:
+                self.stats['reused'] += 1
+        else:
+            digest = self._fetch(rel, size, stamp, expected)
+            if expected and digest != expected:
+                os.unlink(self._objectPath(digest))
+                raise MirrorError("Digest of {0} is {1}, expected {2}".format(rel, digest, expected))
+            if size is not None and os.path.getsize(self._objectPath(digest)) != size:
+                os.unlink(self._objectPath(digest))
+                raise MirrorError("Size of {0} does not match, the download was incomplete".format(rel))
+            with self.lock:
+                self.stats['downloaded'] += 1
+
+        self._link(digest, rel)
+        return dict(sha256=digest, size=size, stamp=stamp)
+
+    def _loadIndex(self):
+        try:
+            f = open(self.index_path)
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _saveIndex(self, index):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.index_path))
+        try:
+            os.write(fd, json.dumps(index).encode('utf-8'))
+        finally:
+            os.close(fd)
+        os.rename(tmp, self.index_path)
+
+    def sync(self):
+        """
+        Brings the mirror up to date with the remote repository
+        :return: path to repository.config of the mirror
+        """
+        if not os.path.isdir(self.root):
+            _makedirs(self.root)
+        files = self.listFiles()
+        old = self._loadIndex()
+        index = {}
+        errors = []
+        queue = sorted(files.items())
+
+        def worker():
+            while True:
+                with self.lock:
+                    if not queue or errors:
+                        return
+                    rel, expected = queue.pop()
+                try:
+                    entry = self._syncFile(rel, expected, old)
+                    with self.lock:
+                        index[rel] = entry
+                except (MirrorError, IOError, OSError) as e:
+                    with self.lock:
+                        errors.append(str(e))
+
+        threads = [threading.Thread(target=worker) for i in range(min(self.concurrency, len(queue)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self._saveIndex(dict(old, **index) if errors else index)
+        if errors:
+            raise MirrorError(errors[0])
+
+        # Drop files that are gone from the remote repository
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                rel = os.path.relpath(os.path.join(dirpath, name), self.root)
+                if rel not in files:
+                    os.unlink(os.path.join(dirpath, name))
+
+        self.stats['files'] = len(files)
+        return os.path.join(self.root, "repository.config")
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Reads what IBM Installation Manager has installed from its own files.
+
+Installation Manager keeps the packages it installed in installRegistry.xml
+in its agent data location. Reading that file takes milliseconds, where
+imcl listInstalledPackages starts a full Eclipse runtime. The inventory is a
+dict keyed by exact package ID and installation directory, so that
+com.ibm.websphere.ND.v85 never matches com.ibm.websphere.ND.v85.fixpack or
+the like, and a package installed in several directories has an entry for
+each of them.
+"""
+
+import os
+import re
+import xml.etree.ElementTree as ET
+
+# Default agent data locations, see the IM documentation on installation modes
+ADMIN_DATA_LOCATION = "/var/ibm/InstallationManager"
+NONADMIN_DATA_LOCATION = "~/var/ibm/InstallationManager"
+
+
+class RegistryError(Exception):
+    pass
+
+
+def readIni(path):
+    """
+    Reads the key=value lines of an Eclipse .ini or config.ini file
+    :return: dict, empty if the file can't be read
+    """
+    values = {}
+    try:
+        f = open(path)
+        try:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#') and '=' in line:
+                    key, value = line.split('=', 1)
+                    values[key.strip()] = value.strip()
+        finally:
+            f.close()
+    except (IOError, OSError):
+        pass
+    return values
+
+
+def dataLocation(ibmim):
+    """
+    Returns the agent data location of the Installation Manager installed
+    at ibmim, as configured in its config.ini or else the default for the
+    current user
+    """
+    config = readIni(os.path.join(ibmim, "eclipse", "configuration", "config.ini"))
+    location = config.get('cic.appDataLocation')
+    if location:
+        # config.ini is a Java properties file, so colons may be escaped
+        return os.path.expanduser(location.replace('\\:', ':').replace('\\\\', '\\'))
+    if os.getuid() == 0:
+        return ADMIN_DATA_LOCATION
+    return os.path.expanduser(NONADMIN_DATA_LOCATION)
+
+
+def readInstallRegistry(path):
+    """
+    Parses installRegistry.xml
+    :param path: path to installRegistry.xml
+    :return: dict keyed by tuples of package ID and installation directory with the version, path and name of each installed package
+    """
+    packages = {}
+    group = None
+    location = None
+    offerings = []
+    try:
+        for event, elem in ET.iterparse(path, events=('start', 'end')):
+            if event == 'start' and elem.tag == 'profile':
+                group = elem.get('id')
+                location = None
+                offerings = []
+            elif event == 'end' and elem.tag == 'property' and elem.get('name') == 'installLocation':
+                location = elem.get('value')
+            elif event == 'end' and elem.tag == 'offering':
+                offerings.append((elem.get('id'), elem.get('version')))
+                elem.clear()
+            elif event == 'end' and elem.tag == 'profile':
+                # installLocation may come after the offerings
+                for package_id, version in offerings:
+                    packages[(package_id, location)] = dict(
+                        id=package_id,
+                        version=version,
+                        path=location,
+                        name=group
+                    )
+                elem.clear()
+    except (ET.ParseError, IOError, OSError) as e:
+        raise RegistryError("Could not read {0}: {1}".format(path, e))
+    return packages
+
+
+def displayVersion(version):
+    """
+    Turns an internal version like 1.8.5001.20161016_1705 into the version
+    shown to users, e.g. 1.8.5.1
+    """
+    parts = (version or "").split(".")
+    if len(parts) < 3 or not parts[2].isdigit() or len(parts[2]) < 4:
+        return version
+    shown = parts[:2] + [str(int(parts[2]) // 1000)]
+    if int(parts[2]) % 1000:
+        shown.append(str(int(parts[2]) % 1000))
+    return ".".join(shown)
+
+
+def parseListInstalled(stdout_value):
+    """
+    Parses the output of imcl listInstalledPackages -long, lines of the form
+    path : id_version : name : version
+    :return: dict keyed by package ID and installation directory like readInstallRegistry()
+    """
+    packages = {}
+    for line in stdout_value.splitlines():
+        fields = [field.strip() for field in line.split(" : ")]
+        if len(fields) < 4:
+            continue
+        # Use the version from the ID like installRegistry.xml has it, the
+        # last field is the version as shown to users, e.g. 8.5.5.11
+        package_id, version = (fields[1].split('_', 1) + [fields[3]])[:2]
+        packages[(package_id, fields[0])] = dict(
+            id=package_id,
+            version=version,
+            path=fields[0],
+            name=fields[2]
+        )
+    return packages
+
+
+def samePath(path, other):
+    """
+    :return: whether two paths name the same directory, trailing slashes and links aside
+    """
+    return os.path.realpath(os.path.expanduser(path)) == os.path.realpath(os.path.expanduser(other))
+
+
+def findPackage(packages, packageId, dest=None):
+    """
+    Looks up a package by its exact ID, or by ID and version when given as
+    id_version like imcl does
+    :param dest: installation directory the package has to be in, any if None
+    :return: dict, the one in the first directory if there are several, or None
+    """
+    found = [p for p in packages.values() if p['id'] == packageId]
+    if not found and '_' in packageId:
+        name, version = packageId.split('_', 1)
+        found = [p for p in packages.values() if p['id'] == name and p['version'] == version]
+    if dest:
+        found = [p for p in found if p['path'] and samePath(p['path'], dest)]
+    if not found:
+        return None
+    return sorted(found, key=lambda p: p['path'] or "")[0]
+
+
+def versionKey(version):
+    """
+    Sort key for package versions like 8.5.5011.20161206_1434
+    :return: tuple
+    """
+    return tuple([(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"[._-]", version or "")])
+
+
+def parseListAvailable(stdout_value):
+    """
+    Parses the output of imcl listAvailablePackages, one id_version per line
+    :return: dict keyed by package ID with the list of available versions
+    """
+    available = {}
+    for line in stdout_value.splitlines():
+        line = line.strip()
+        if not line or '_' not in line or ' ' in line:
+            continue
+        package_id, version = line.split('_', 1)
+        available.setdefault(package_id, []).append(version)
+    return available
+
+
+def findUpdates(packages, available):
+    """
+    Compares the installed packages with the available versions
+    :param packages: inventory from readInstallRegistry() or parseListInstalled()
+    :param available: available versions like parseListAvailable() returns them
+    :return: list of the installed packages with a newer version available, each with the key latest added
+    """
+    updates = []
+    for key in sorted(packages, key=lambda k: (k[0], k[1] or "")):
+        package = packages[key]
+        versions = available.get(package['id'])
+        if not versions:
+            continue
+        latest = max(versions, key=versionKey)
+        if versionKey(latest) > versionKey(package['version']):
+            updates.append(dict(package, latest=latest))
+    return updates
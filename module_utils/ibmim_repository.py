@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Lists the offerings and fixes of an Installation Manager repository without
+imcl.
+
+A repository keeps every offering as Offerings/<id>_<version>.jar and every
+fix as Fixes/<id>_<version>.jar, and may describe them in repository.xml as
+well. A composite repository points at its children with repository.url
+entries in repository.config. The index is built from those names alone, so
+a zipped repository is read from its central directory and never extracted.
+It is cached in a cache directory, under a digest of the location of the
+repository, and built again when the mtime, size, ETag or Last-Modified of a
+file it was read from changes. Nothing is written to the repository.
+"""
+
+import hashlib
+import json
+import os
+import posixpath
+import re
+import socket
+import ssl
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+
+try:
+    from urllib.request import Request, urlopen, HTTPSHandler, build_opener
+    from urllib.error import HTTPError, URLError
+    from urllib.parse import unquote, urljoin, urlparse
+except ImportError:
+    from urllib2 import Request, urlopen, HTTPSHandler, build_opener, HTTPError, URLError
+    from urllib import unquote
+    from urlparse import urljoin, urlparse
+
+INDEX_VERSION = 1
+HREF_RE = re.compile(r'href\s*=\s*["\']([^"\'#?]+)["\']', re.IGNORECASE)
+ENTRY_RE = re.compile(r'^([^_/]+)_(\d[^/]*?)\.(?:jar|zip)$')
+KINDS = (('Offerings', 'offerings'), ('Fixes', 'fixes'))
+
+
+class RepositoryError(Exception):
+    pass
+
+
+def parseEntryName(name):
+    """
+    Splits the file name of an offering or fix into ID and version, e.g.
+    com.ibm.websphere.ND.v85_8.5.5011.20161206_1434.jar
+    :return: tuple of id and version, or None
+    """
+    match = ENTRY_RE.match(posixpath.basename(name))
+    if not match:
+        return None
+    return match.group(1), match.group(2)
+
+
+def _add(index, kind, package_id, version):
+    versions = index[kind].setdefault(package_id, [])
+    if version not in versions:
+        versions.append(version)
+
+
+def readProperties(text):
+    """
+    Reads the key=value lines of repository.config
+    :return: dict
+    """
+    values = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith('#') and '=' in line:
+            key, value = line.split('=', 1)
+            values[key.strip()] = value.strip()
+    return values
+
+
+def children(properties):
+    """
+    :return: the relative or absolute locations of the child repositories of a composite repository
+    """
+    return [value for key, value in sorted(properties.items()) if key.startswith('repository.url') and value]
+
+
+def parseRepositoryXml(source, index):
+    """
+    Adds the offerings and fixes described in repository.xml to index
+    :param source: path or file object
+    """
+    try:
+        for event, elem in ET.iterparse(source):
+            tag = elem.tag.rsplit('}', 1)[-1].lower()
+            if tag in ('offering', 'fix') and elem.get('id') and elem.get('version'):
+                _add(index, 'offerings' if tag == 'offering' else 'fixes', elem.get('id'), elem.get('version'))
+            elem.clear()
+    except ET.ParseError as e:
+        raise RepositoryError("Could not parse repository.xml: {0}".format(e))
+
+
+class _Directory(object):
+    """
+    Repository in a local directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def location(self, rel):
+        return os.path.join(self.path, rel)
+
+    def exists(self, rel):
+        return os.path.exists(self.location(rel))
+
+    def read(self, rel):
+        f = open(self.location(rel), 'rb')
+        try:
+            return f.read().decode('utf-8', 'replace')
+        finally:
+            f.close()
+
+    def open(self, rel):
+        return open(self.location(rel), 'rb')
+
+    def list(self, rel):
+        try:
+            return os.listdir(self.location(rel))
+        except OSError:
+            return []
+
+    def child(self, location):
+        return _Directory(os.path.normpath(os.path.join(self.path, location)))
+
+
+class _Zip(object):
+    """
+    Repository in a zip file, or in a directory of one. Only the central
+    directory and the small metadata files are read.
+    """
+
+    def __init__(self, archive, prefix=""):
+        self.archive = archive
+        self.names = set(archive.namelist())
+        self.prefix = prefix
+
+    def location(self, rel):
+        return None
+
+    def exists(self, rel):
+        return self.prefix + rel in self.names
+
+    def read(self, rel):
+        return self.archive.read(self.prefix + rel).decode('utf-8', 'replace')
+
+    def open(self, rel):
+        return self.archive.open(self.prefix + rel)
+
+    def list(self, rel):
+        top = self.prefix + rel + "/"
+        return [name[len(top):] for name in self.names if name.startswith(top) and "/" not in name[len(top):]]
+
+    def child(self, location):
+        return _Zip(self.archive, posixpath.normpath(posixpath.join(self.prefix, location)) + "/")
+
+
+class _Http(object):
+    """
+    Repository on a web server that lists its directories
+    """
+
+    def __init__(self, url, timeout=60, validate_certs=True):
+        self.url = url.rstrip("/") + "/"
+        self.timeout = timeout
+        self.validate_certs = validate_certs
+
+    def location(self, rel):
+        return self.url + rel
+
+    def exists(self, rel):
+        response = _fetch(self.location(rel), self.timeout, self.validate_certs, method='HEAD')
+        if response is None:
+            return False
+        response.close()
+        return True
+
+    def read(self, rel):
+        response = self.open(rel)
+        try:
+            return response.read().decode('utf-8', 'replace')
+        finally:
+            response.close()
+
+    def open(self, rel):
+        response = _fetch(self.location(rel), self.timeout, self.validate_certs)
+        if response is None:
+            raise RepositoryError("{0} not found".format(self.location(rel)))
+        return response
+
+    def list(self, rel):
+        top = self.location(rel) + "/"
+        response = _fetch(top, self.timeout, self.validate_certs)
+        if response is None:
+            return []
+        try:
+            listing = response.read().decode('utf-8', 'replace')
+        finally:
+            response.close()
+        names = []
+        for href in HREF_RE.findall(listing):
+            target = urljoin(top, href)
+            name = unquote(target[len(top):])
+            if target.startswith(top) and name and "/" not in name:
+                names.append(name)
+        return names
+
+    def child(self, location):
+        return _Http(urljoin(self.url, location), self.timeout, self.validate_certs)
+
+
+def _fetch(url, timeout, validate_certs, method=None):
+    """
+    :return: the response, or None if url does not exist
+    """
+    request = Request(url)
+    if method:
+        request.get_method = lambda: method
+    try:
+        if url.startswith("https:") and not validate_certs:
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            return build_opener(HTTPSHandler(context=context)).open(request, timeout=timeout)
+        return urlopen(request, timeout=timeout)
+    except HTTPError as e:
+        if e.code == 404:
+            return None
+        raise RepositoryError("{0} {1} fetching {2}".format(e.code, e.reason, url))
+    except (URLError, socket.error) as e:
+        raise RepositoryError("Failed fetching {0}: {1}".format(url, e))
+
+
+def _stamp(location, timeout, validate_certs):
+    """
+    :return: mtime and size of a local file or directory, or the ETag or Last-Modified of a URL, None if it does not exist
+    """
+    if location.startswith("http://") or location.startswith("https://"):
+        response = _fetch(location, timeout, validate_certs, method='HEAD')
+        if response is None:
+            return None
+        try:
+            return response.headers.get('ETag') or response.headers.get('Last-Modified')
+        finally:
+            response.close()
+    try:
+        st = os.stat(location)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def _walk(repository, index, files, depth=0):
+    """
+    Adds the offerings and fixes of repository and its children to index,
+    and the locations of the files they were found through to files
+    """
+    if depth > 8:
+        raise RepositoryError("Composite repositories are nested too deep")
+    if not repository.exists("repository.config"):
+        raise RepositoryError("No repository.config found")
+    files.append(repository.location("repository.config"))
+    properties = readProperties(repository.read("repository.config"))
+
+    for directory, kind in KINDS:
+        # The mtime of a directory changes when files are added or removed
+        files.append(repository.location(directory))
+        for name in repository.list(directory):
+            entry = parseEntryName(name)
+            if entry:
+                _add(index, kind, entry[0], entry[1])
+
+    if repository.exists("repository.xml"):
+        files.append(repository.location("repository.xml"))
+        source = repository.open("repository.xml")
+        try:
+            parseRepositoryXml(source, index)
+        finally:
+            source.close()
+
+    for location in children(properties):
+        _walk(repository.child(location), index, files, depth + 1)
+
+
+def _location(repository):
+    """
+    :return: tuple of the kind of repository, i.e. dir, zip or http, and its location
+    """
+    parsed = urlparse(repository)
+    if parsed.scheme in ('http', 'https'):
+        if repository.endswith("repository.config"):
+            repository = repository[:-len("repository.config")]
+        return 'http', repository
+    if parsed.scheme == 'file':
+        repository = unquote(parsed.path)
+    repository = os.path.normpath(os.path.expanduser(repository))
+    if os.path.basename(repository) == "repository.config":
+        repository = os.path.dirname(repository)
+    if repository.lower().endswith(".zip"):
+        return 'zip', repository
+    return 'dir', repository
+
+
+def cachePath(repository, cache_dir):
+    """
+    Returns where the index of repository is cached in cache_dir
+    """
+    kind, location = _location(repository)
+    key = hashlib.sha256(location.encode('utf-8')).hexdigest()[:32]
+    return os.path.join(os.path.expanduser(cache_dir), key + ".json")
+
+
+def _loadIndex(path):
+    try:
+        f = open(path)
+        try:
+            cached = json.load(f)
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError):
+        return None
+    if cached.get('version') != INDEX_VERSION:
+        return None
+    return cached
+
+
+def _saveIndex(path, cached):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    try:
+        os.write(fd, json.dumps(cached).encode('utf-8'))
+    finally:
+        os.close(fd)
+    os.rename(tmp, path)
+
+
+def buildIndex(repository, timeout=60, validate_certs=True):
+    """
+    Reads the offerings and fixes of a repository
+    :return: tuple of dict with the keys offerings and fixes, each keyed by ID with the list of versions, and the list of files or URLs whose stamps decide whether it is current
+    """
+    kind, location = _location(repository)
+    index = dict(offerings={}, fixes={})
+    files = []
+    try:
+        if kind == 'zip':
+            archive = zipfile.ZipFile(location)
+            try:
+                # The repository may sit in a directory inside the zip
+                configs = sorted([name for name in archive.namelist() if posixpath.basename(name) == "repository.config"], key=len)
+                if not configs:
+                    raise RepositoryError("No repository.config found")
+                _walk(_Zip(archive, configs[0][:-len("repository.config")]), index, [])
+            finally:
+                archive.close()
+            files = [location]
+        elif kind == 'http':
+            _walk(_Http(location, timeout, validate_certs), index, files)
+        else:
+            _walk(_Directory(location), index, files)
+    except (IOError, OSError, zipfile.BadZipfile) as e:
+        raise RepositoryError("Could not read {0}: {1}".format(location, e))
+    except RepositoryError as e:
+        raise RepositoryError("{0}: {1}".format(repository, e))
+    return index, files
+
+
+def repositoryIndex(repository, cache_dir='~/.ansible/ibmim_index', timeout=60, validate_certs=True):
+    """
+    Returns the offerings and fixes of a repository, from the cached index
+    while none of the files it was built from has changed
+    :param repository: path, zip, file URL or http(s) URL of the repository
+    :return: tuple of the index like buildIndex() returns it and True if it came from the cache
+    """
+    kind, location = _location(repository)
+    path = cachePath(repository, cache_dir)
+    cached = _loadIndex(path)
+    if cached is not None and cached.get('location') == location:
+        stamps = [_stamp(location, timeout, validate_certs) for location in cached['files']]
+        if stamps == cached['stamps'] and None not in stamps[:1]:
+            return dict(offerings=cached['offerings'], fixes=cached['fixes']), True
+
+    index, files = buildIndex(repository, timeout, validate_certs)
+    cached = dict(
+        version=INDEX_VERSION,
+        location=location,
+        files=files,
+        stamps=[_stamp(location, timeout, validate_certs) for location in files],
+        offerings=index['offerings'],
+        fixes=index['fixes']
+    )
+    try:
+        _saveIndex(path, cached)
+    except (IOError, OSError):
+        # The index still serves this run
+        pass
+    return index, False
+
+
+def availableVersions(indexes):
+    """
+    Merges the offerings of several repository indexes
+    :return: dict keyed by package ID with the available versions, like parseListAvailable() returns
+    """
+    available = {}
+    for index in indexes:
+        for package_id, versions in index['offerings'].items():
+            for version in versions:
+                if version not in available.setdefault(package_id, []):
+                    available[package_id].append(version)
+    return available
+
+
+def isAvailable(available, packageId):
+    """
+    Looks up a package by its ID, or by ID and version when given as
+    id_version like imcl does
+    :param available: dict like availableVersions() returns it
+    :return: True if a repository has the package
+    """
+    if packageId in available:
+        return True
+    if '_' in packageId:
+        name, version = packageId.split('_', 1)
+        return version in available.get(name, [])
+    return False
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Records how long the external commands run by a module take.
+
+TimedModule is an AnsibleModule whose runCommand() runs a command the same
+way the modules used subprocess.Popen() and communicate() before, but also
+reaps the child with wait4() to get its CPU time. Every command ends up in
+the timings fact returned by exit_json() and fail_json(), and is appended
+to timings_file on the host when that parameter is set.
+"""
+
+import collections
+import datetime
+import fcntl
+import json
+import os
+import subprocess
+import threading
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+
+MASK = "********"
+
+
+def mask(argv, secrets):
+    """
+    Replaces every occurrence of a secret in argv
+    :param argv: list of arguments or a shell command line
+    :return: masked copy of argv
+    """
+    def masked(value):
+        for secret in secrets:
+            if secret:
+                value = value.replace(secret, MASK)
+        return value
+    if isinstance(argv, (list, tuple)):
+        return [masked(str(arg)) for arg in argv]
+    return masked(str(argv))
+
+
+def _drain(child):
+    """
+    Reads stdout and stderr of child until both are closed, without
+    waiting for the child itself
+    :return: tuple of stdout and stderr
+    """
+    output = {}
+
+    def read(name, pipe):
+        output[name] = pipe.read()
+        pipe.close()
+
+    threads = []
+    for name, pipe in (('stdout', child.stdout), ('stderr', child.stderr)):
+        if pipe is not None:
+            t = threading.Thread(target=read, args=(name, pipe))
+            t.start()
+            threads.append(t)
+    for t in threads:
+        t.join()
+    return output.get('stdout'), output.get('stderr')
+
+
+class TimedModule(AnsibleModule):
+    """
+    AnsibleModule that keeps a record of every command run through
+    runCommand() and returns them as the timings fact
+    """
+
+    def __init__(self, argument_spec, **kwargs):
+        argument_spec = dict(argument_spec)
+        argument_spec['timings_file'] = dict(required=False)
+        self.timings = []
+        self.timings_lock = threading.Lock()
+        AnsibleModule.__init__(self, argument_spec=argument_spec, **kwargs)
+
+    def runCommand(self, args, label=None, **kwargs):
+        """
+        Runs a command and records its timing
+        :param args: arguments for subprocess.Popen
+        :param label: short description of the step the command is for
+        :param kwargs: further arguments for subprocess.Popen, stdout and stderr default to pipes
+        :return: tuple of returncode, stdout and stderr
+        """
+        kwargs.setdefault('stdout', subprocess.PIPE)
+        kwargs.setdefault('stderr', subprocess.PIPE)
+        started = datetime.datetime.utcnow()
+        start = time.time()
+        child = subprocess.Popen(args, **kwargs)
+        stdout_value, stderr_value = _drain(child)
+        self._reap(child, args, label, started, start)
+        return child.returncode, stdout_value, stderr_value
+
+    def streamCommand(self, args, log_path, label=None, tail=50, **kwargs):
+        """
+        Runs a command and records its timing like runCommand(), but writes
+        stdout and stderr to log_path as they come instead of collecting them,
+        so that the log can be followed while the command runs
+        :param log_path: file the output is appended to
+        :param tail: number of lines of output to keep and return
+        :return: tuple of returncode and the last lines of the output
+        """
+        kwargs['stdout'] = subprocess.PIPE
+        kwargs['stderr'] = subprocess.STDOUT
+        lines = collections.deque(maxlen=tail)
+        partial = b""
+        log = open(log_path, 'ab')
+        try:
+            started = datetime.datetime.utcnow()
+            start = time.time()
+            child = subprocess.Popen(args, **kwargs)
+            fd = child.stdout.fileno()
+            while True:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                log.write(chunk)
+                log.flush()
+                # Progress bars may go without a newline for a long time
+                partial = (partial + chunk)[-65536:]
+                complete = partial.split(b"\n")
+                partial = complete.pop()
+                lines.extend(complete)
+            child.stdout.close()
+        finally:
+            log.close()
+        if partial:
+            lines.append(partial)
+        self._reap(child, args, label, started, start)
+        return child.returncode, b"\n".join(lines).decode('utf-8', 'replace')
+
+    def _reap(self, child, args, label, started, start):
+        """
+        Waits for child and records its timing
+        """
+        pid, status, usage = os.wait4(child.pid, 0)
+        if os.WIFSIGNALED(status):
+            child.returncode = -os.WTERMSIG(status)
+        else:
+            child.returncode = os.WEXITSTATUS(status)
+        record = dict(
+            label=label,
+            argv=mask(args, self.no_log_values),
+            start=started.isoformat() + "Z",
+            wall=round(time.time() - start, 3),
+            cpu_user=round(usage.ru_utime, 3),
+            cpu_system=round(usage.ru_stime, 3),
+            rc=child.returncode
+        )
+        with self.timings_lock:
+            self.timings.append(record)
+
+    def writeTimings(self):
+        """
+        Appends the records to timings_file as JSON lines
+        """
+        path = getattr(self, 'params', {}).get('timings_file')
+        if not path or not self.timings:
+            return
+        lines = ""
+        for record in self.timings:
+            lines += json.dumps(dict(record, module=self._name)) + "\n"
+        f = open(os.path.expanduser(path), 'a')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            f.write(lines)
+        finally:
+            f.close()
+
+    def _addTimings(self, kwargs):
+        kwargs['ansible_facts'] = dict(kwargs.get('ansible_facts') or {}, timings=list(self.timings))
+        try:
+            self.writeTimings()
+        except (IOError, OSError) as e:
+            self.warn("Could not write timings to {0}: {1}".format(self.params['timings_file'], e))
+
+    def exit_json(self, **kwargs):
+        self._addTimings(kwargs)
+        AnsibleModule.exit_json(self, **kwargs)
+
+    def fail_json(self, **kwargs):
+        self._addTimings(kwargs)
+        AnsibleModule.fail_json(self, **kwargs)
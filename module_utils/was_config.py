@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Reads the topology of a cell straight from the configuration repository of
+a profile, without wsadmin.
+
+The files are parsed with iterparse and every top level element is dropped
+once it has been looked at, so that large server.xml files never have to be
+held in memory as a whole. What each file yields is cached on disk together
+with its mtime and size, and a file is only parsed again when those change.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+
+CACHE_VERSION = 1
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _iterchildren(path):
+    """
+    Yields ('root', element) once the root element starts and ('child',
+    element) for every complete child of the root, clearing each child
+    afterwards
+    """
+    depth = 0
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 1:
+                yield 'root', elem
+        else:
+            depth -= 1
+            if depth == 1:
+                yield 'child', elem
+                elem.clear()
+
+
+def parseServerIndex(path):
+    """
+    Parses nodes/<node>/serverindex.xml
+    :return: dict with the host of the node and its servers, their type, endpoints and applications
+    """
+    result = dict(host=None, servers={})
+    for kind, elem in _iterchildren(path):
+        if kind == 'root':
+            result['host'] = elem.get('hostName')
+        elif _local(elem.tag) == 'serverEntries':
+            endpoints = {}
+            for special in elem.findall('specialEndpoints'):
+                point = special.find('endPoint')
+                if point is not None:
+                    endpoints[special.get('endPointName')] = dict(host=point.get('host'), port=_int(point.get('port')))
+            applications = [app.text.strip().split('/')[-1] for app in elem.findall('deployedApplications') if app.text]
+            result['servers'][elem.get('serverName')] = dict(
+                type=elem.get('serverType'),
+                endpoints=endpoints,
+                applications=applications
+            )
+    return result
+
+
+def parseServer(path):
+    """
+    Parses nodes/<node>/servers/<server>/server.xml
+    :return: dict with the name, cluster and heap sizes of the server
+    """
+    result = dict(name=None, cluster=None, initial_heap=None, maximum_heap=None)
+    for kind, elem in _iterchildren(path):
+        if kind == 'root':
+            result['name'] = elem.get('name')
+            result['cluster'] = elem.get('clusterName')
+        elif _local(elem.tag) == 'processDefinitions':
+            jvm = elem.find('jvmEntries')
+            if jvm is not None:
+                result['initial_heap'] = _int(jvm.get('initialHeapSize'))
+                result['maximum_heap'] = _int(jvm.get('maximumHeapSize'))
+    return result
+
+
+def parseCluster(path):
+    """
+    Parses clusters/<cluster>/cluster.xml
+    :return: dict with the name and members of the cluster
+    """
+    result = dict(name=None, members=[])
+    for kind, elem in _iterchildren(path):
+        if kind == 'root':
+            result['name'] = elem.get('name')
+        elif _local(elem.tag) == 'members':
+            result['members'].append(dict(
+                name=elem.get('memberName'),
+                node=elem.get('nodeName'),
+                weight=_int(elem.get('weight'))
+            ))
+    return result
+
+
+PARSERS = {
+    'serverindex': parseServerIndex,
+    'server': parseServer,
+    'cluster': parseCluster
+}
+
+
+def configFiles(profile_path):
+    """
+    Lists the files of the configuration repository that make up the topology
+    :return: list of (kind, path, cell, node) tuples
+    """
+    files = []
+    for cell_dir in sorted(glob.glob(os.path.join(profile_path, "config", "cells", "*"))):
+        if not os.path.isdir(cell_dir):
+            continue
+        cell = os.path.basename(cell_dir)
+        for path in sorted(glob.glob(os.path.join(cell_dir, "nodes", "*", "serverindex.xml"))):
+            files.append(('serverindex', path, cell, os.path.basename(os.path.dirname(path))))
+        for path in sorted(glob.glob(os.path.join(cell_dir, "nodes", "*", "servers", "*", "server.xml"))):
+            files.append(('server', path, cell, os.path.basename(os.path.dirname(os.path.dirname(os.path.dirname(path))))))
+        for path in sorted(glob.glob(os.path.join(cell_dir, "clusters", "*", "cluster.xml"))):
+            files.append(('cluster', path, cell, None))
+    return files
+
+
+def cachePath(cache_dir, profile_path):
+    key = hashlib.sha256(os.path.realpath(profile_path).encode('utf-8')).hexdigest()[:32]
+    return os.path.join(os.path.expanduser(cache_dir), key + ".json")
+
+
+def _loadCache(path):
+    try:
+        f = open(path)
+        try:
+            cache = json.load(f)
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError):
+        return {}
+    if cache.get('version') != CACHE_VERSION:
+        return {}
+    return cache.get('files', {})
+
+
+def _saveCache(path, files):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    try:
+        os.write(fd, json.dumps(dict(version=CACHE_VERSION, files=files)).encode('utf-8'))
+    finally:
+        os.close(fd)
+    os.rename(tmp, path)
+
+
+def readConfig(profile_path, cache_file=None):
+    """
+    Parses the topology files of a profile, reusing what cache_file holds
+    for files whose mtime and size have not changed
+    :return: tuple of the list of (kind, path, cell, node, data) and the number of files parsed
+    """
+    cached = {}
+    if cache_file:
+        cached = _loadCache(cache_file)
+    entries = {}
+    result = []
+    parsed = 0
+    for kind, path, cell, node in configFiles(profile_path):
+        st = os.stat(path)
+        entry = cached.get(path)
+        if entry is None or entry['mtime'] != st.st_mtime or entry['size'] != st.st_size:
+            entry = dict(mtime=st.st_mtime, size=st.st_size, data=PARSERS[kind](path))
+            parsed += 1
+        entries[path] = entry
+        result.append((kind, path, cell, node, entry['data']))
+    if cache_file and (parsed or len(entries) != len(cached)):
+        _saveCache(cache_file, entries)
+    return result, parsed
+
+
+def buildIndex(profile_path, cache_file=None):
+    """
+    Builds an index of the cells, nodes, servers, clusters and endpoints
+    found in the configuration repository of a profile. Node and cluster
+    names are only unique within a cell, so both are kept under their cell.
+    :return: tuple of the index and the number of files parsed
+    """
+    files, parsed = readConfig(profile_path, cache_file)
+    cells = {}
+
+    def getCell(cell):
+        return cells.setdefault(cell, dict(nodes={}, clusters={}))
+
+    def getNode(cell, node):
+        return getCell(cell)['nodes'].setdefault(node, dict(host=None, servers={}))
+
+    def getServer(cell, node, name):
+        servers = getNode(cell, node)['servers']
+        return servers.setdefault(name, dict(type=None, cluster=None, endpoints={}, applications=[], initial_heap=None, maximum_heap=None))
+
+    for kind, path, cell, node, data in files:
+        getCell(cell)
+        if kind == 'serverindex':
+            getNode(cell, node)['host'] = data['host']
+            for name, server in data['servers'].items():
+                getServer(cell, node, name).update(server)
+        elif kind == 'server':
+            name = os.path.basename(os.path.dirname(path))
+            getServer(cell, node, name).update(
+                cluster=data['cluster'],
+                initial_heap=data['initial_heap'],
+                maximum_heap=data['maximum_heap']
+            )
+        elif kind == 'cluster':
+            getCell(cell)['clusters'][data['name']] = dict(members=data['members'])
+
+    # Flatten the endpoints, with wildcard hosts resolved to the host of the node
+    endpoints = []
+    ports = {}
+    for cell_name in sorted(cells):
+        nodes = cells[cell_name]['nodes']
+        for node_name in sorted(nodes):
+            node = nodes[node_name]
+            for server_name in sorted(node['servers']):
+                for endpoint_name, point in sorted(node['servers'][server_name]['endpoints'].items()):
+                    host = point['host']
+                    if host in (None, '*', ''):
+                        host = node['host']
+                    endpoints.append(dict(
+                        cell=cell_name,
+                        node=node_name,
+                        server=server_name,
+                        name=endpoint_name,
+                        host=host,
+                        port=point['port']
+                    ))
+                    if point['port']:
+                        ports.setdefault(host, set()).add(point['port'])
+
+    return dict(
+        profile_path=profile_path,
+        cells=cells,
+        endpoints=endpoints,
+        ports=dict((host, sorted(used)) for host, used in ports.items())
+    ), parsed
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Creates profiles from a cached copy of a profile built with the same options.
+
+manageprofiles.sh -create runs the whole action chain of its template for
+every profile, which takes minutes and yields the same files on every host
+but for a few names and ports. The first profile created with a set of
+options is archived in the cache directory, keyed by a digest of those
+options and the WebSphere version. Later profiles are extracted from the
+archive instead: directories and the configuration files naming the
+profile, cell, node or host of the cached profile are renamed and rewritten,
+its ports are moved clear of those of the other profiles on the host, and
+new keystores are generated. The caller adds the copy to profileRegistry.xml
+with manageprofiles.sh -register.
+
+Logs, temporary files and the keystores under config are not cached, so that
+no two profiles share private keys. Clones get theirs from the key generating
+action of the template, run with ws_ant.sh; profiles of templates without
+one are not cached.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import xml.etree.ElementTree as ET
+
+from ansible.module_utils.was_profiles import ProfileError, profileEndpoints, profileNames, profilePorts, reservePorts, usedPorts
+
+CACHE_VERSION = 2
+SKIP = ('logs', 'temp', 'wstemp', 'tranlog')
+KEYSTORES = ('.p12', '.jks', '.jceks', '.kdb', '.sth', '.rdb')
+KEY_ACTIONS = ('generateKeysForCellProfile.ant', 'generateKeysForSingleProfile.ant')
+REWRITE_DIRS = ('bin', 'config', 'properties')
+REWRITE_FILES = ('.xml', '.xmi', '.props', '.properties', '.policy', '.sh', '.bat')
+PORT_FILES = ('serverindex.xml', 'virtualhosts.xml')
+CHUNK = 1024 * 1024
+
+
+class ProfileCacheError(Exception):
+    pass
+
+
+def wasVersion(wasdir):
+    """
+    :return: version of the WebSphere installation from properties/version/WAS.product, or None
+    """
+    try:
+        return ET.parse(os.path.join(wasdir, "properties", "version", "WAS.product")).getroot().findtext('version')
+    except (ET.ParseError, IOError, OSError):
+        return None
+
+
+def cacheKey(wasdir, options):
+    """
+    Digest of everything that makes profiles differ other than their names and ports
+    :param options: dict of the options passed to manageprofiles.sh -create, the password included
+    """
+    data = dict(options, version=CACHE_VERSION, wasdir=os.path.realpath(wasdir), was_version=wasVersion(wasdir))
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+
+
+def _paths(cache_dir, key):
+    return os.path.join(cache_dir, key + ".tar.gz"), os.path.join(cache_dir, key + ".json")
+
+
+def lookup(cache_dir, key):
+    """
+    :return: what was recorded about the cached profile, or None if there is none
+    """
+    archive, meta = _paths(cache_dir, key)
+    if not os.path.exists(archive):
+        return None
+    try:
+        f = open(meta)
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def keysAction(wasdir, template):
+    """
+    :return: path of the action of the template generating the keystores of a profile, or None
+    """
+    for action in KEY_ACTIONS:
+        path = os.path.join(wasdir, "profileTemplates", template, "actions", action)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _keystore(rel):
+    """
+    :return: whether rel is a keystore generated for the profile
+    """
+    return rel.split("/")[0] == "config" and rel.endswith(KEYSTORES)
+
+
+def _rewritten(rel):
+    """
+    :return: whether rel is a configuration file that may name the profile, cell, node or host
+    """
+    return rel.split(os.sep)[0] in REWRITE_DIRS and rel.endswith(REWRITE_FILES)
+
+
+def store(cache_dir, key, name, profile_path, keys_action):
+    """
+    Archives a freshly created profile into the cache, along with its names and ports
+    :param keys_action: path of the action generating the keystores, from keysAction()
+    :return: path of the archive
+    """
+    if not keys_action:
+        raise ProfileCacheError("The template has no action generating keystores, profiles made from {0} would share its keys".format(name))
+    archive, meta = _paths(cache_dir, key)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, 0o700)
+    names = profileNames(profile_path)
+    if not (names['cell'] and names['node'] and names['host']):
+        raise ProfileCacheError("Could not read the cell, node and host of {0}".format(profile_path))
+
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        tar = tarfile.open(tmp, "w:gz")
+        try:
+            for entry in sorted(os.listdir(profile_path)):
+                path = os.path.join(profile_path, entry)
+                if entry in SKIP and os.path.isdir(path) and not os.path.islink(path):
+                    # Keep the directory itself, the servers expect it
+                    tar.add(path, entry, recursive=False)
+                else:
+                    tar.add(path, entry, filter=lambda info: None if _keystore(info.name) else info)
+        finally:
+            tar.close()
+        f = open(meta + ".tmp", 'w')
+        try:
+            json.dump(dict(name=name, path=profile_path, ports=sorted(profilePorts(profile_path)),
+                           endpoints=profileEndpoints(profile_path), keys_action=keys_action, **names), f)
+        finally:
+            f.close()
+        os.rename(meta + ".tmp", meta)
+        os.rename(tmp, archive)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return archive
+
+
+def portMapping(meta, used, allocated=None):
+    """
+    Gives the endpoints of the cached profile the ports allocated to them,
+    or else moves all its ports by the same offset until none is in use, the
+    way manageprofiles.sh counts up from the defaults
+    :param allocated: dict of endpoint name to port from allocatePorts()
+    :return: dict of old to new port, empty if the ports are free
+    """
+    if allocated and meta.get('endpoints'):
+        return dict((port, allocated[name]) for name, port in meta['endpoints'].items() if allocated.get(name, port) != port)
+    ports = set(meta['ports'])
+    if not ports:
+        return {}
+    offset = 0
+    while set([p + offset for p in ports]) & used:
+        offset += 1
+        if max(ports) + offset > 65535:
+            raise ProfileCacheError("No free block of {0} ports above {1}".format(len(ports), min(ports)))
+    return dict((p, p + offset) for p in ports if offset)
+
+
+def _renamer(meta, name, profile_path, names):
+    """
+    :return: function rewriting the names and path of the cached profile in a string
+    """
+    tokens = {}
+    for key, new in (('name', name), ('cell', names['cell']), ('node', names['node']), ('host', names['host'])):
+        if meta[key] != new:
+            tokens[meta[key]] = new
+    pattern = None
+    if tokens:
+        # Whole names only, so that node01 doesn't turn up in node011
+        pattern = re.compile(r"(?<![\w.-])(" + "|".join([re.escape(t) for t in sorted(tokens, key=len, reverse=True)]) + r")(?![\w.-])")
+
+    def rename(value):
+        value = value.replace(meta['path'], profile_path)
+        if pattern:
+            value = pattern.sub(lambda m: tokens[m.group(1)], value)
+        return value
+    return rename
+
+
+def _renumber(rel, data, ports):
+    """
+    Replaces the ports of the cached profile in the files that assign them
+    """
+    def sub(match):
+        port = int(match.group(2))
+        return match.group(1) + str(ports.get(port, port))
+    if os.path.basename(rel) in PORT_FILES:
+        return re.sub(r'(\bport=")(\d+)', sub, data)
+    if rel.startswith("properties" + os.sep) and rel.endswith((".props", ".properties")):
+        return re.sub(r'(?im)(^[^#=\n]*port[^=\n]*=\s*)(\d+)', sub, data)
+    return data
+
+
+def clone(cache_dir, key, meta, name, profile_path, names, used, allocated=None):
+    """
+    Extracts the cached profile to profile_path, renamed and with free ports
+    :param meta: what lookup() returned
+    :param names: dict with the cell, node and host of the new profile
+    :param used: set of the ports of the other profiles on the host
+    :param allocated: dict of endpoint name to port from allocatePorts()
+    :return: dict of the ports moved
+    """
+    archive = _paths(cache_dir, key)[0]
+    ports = portMapping(meta, used, allocated)
+    rename = _renamer(meta, name, profile_path, names)
+
+    tar = tarfile.open(archive, "r|gz")
+    try:
+        for member in tar:
+            rel = os.path.normpath(rename(member.name))
+            if os.path.isabs(rel) or rel.startswith(".."):
+                raise ProfileCacheError("Refusing to extract {0} outside of {1}".format(member.name, profile_path))
+            path = os.path.join(profile_path, rel)
+            if member.isdir():
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+                os.chmod(path, member.mode)
+                continue
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            if member.issym():
+                os.symlink(rename(member.linkname), path)
+                continue
+            if not member.isfile():
+                continue
+            source = tar.extractfile(member)
+            out = open(path, 'wb')
+            try:
+                if not _rewritten(rel) or member.size > 16 * CHUNK:
+                    shutil.copyfileobj(source, out, CHUNK)
+                else:
+                    data = source.read()
+                    if b"\0" not in data:
+                        text = data.decode('utf-8', 'surrogateescape') if str is not bytes else data
+                        text = _renumber(rel, rename(text), ports)
+                        data = text.encode('utf-8', 'surrogateescape') if str is not bytes else text
+                    out.write(data)
+            finally:
+                out.close()
+            os.chmod(path, member.mode)
+    finally:
+        tar.close()
+    return ports
+
+
+def generateKeys(module, wasdir, meta, name, profile_path, names):
+    """
+    Runs the key generating action of the template for a cloned profile
+    :return: tuple of rc, stdout and stderr
+    """
+    return module.runCommand([
+        "{0}/bin/ws_ant.sh".format(wasdir),
+        "-profileName", name,
+        "-file", meta['keys_action'],
+        "-DWAS_HOME={0}".format(wasdir),
+        "-DprofileName={0}".format(name),
+        "-DprofilePath={0}".format(profile_path),
+        "-DtemplatePath={0}".format(os.path.dirname(os.path.dirname(meta['keys_action']))),
+        "-DcellName={0}".format(names['cell']),
+        "-DnodeName={0}".format(names['node']),
+        "-DhostName={0}".format(names['host'])
+    ], label="generateKeys", universal_newlines=True)
+
+
+def reserveCachedPorts(wasdir, meta, name):
+    """
+    Reserves the ports of the cached profile moved by the offset portMapping()
+    finds, counting those of the profiles being cloned at the same time
+    :return: dict of endpoint name to port
+    """
+    def choose(used):
+        moved = portMapping(meta, used)
+        return [(endpoint, moved.get(port, port)) for endpoint, port in sorted(meta['endpoints'].items(), key=lambda e: (e[1], e[0]))]
+    return reservePorts(wasdir, name, choose)[1]
+
+
+def createFromCache(module, cache_dir, key, meta, wasdir, name, profile_path, names, allocated=None):
+    """
+    Clones the cached profile and generates its keystores
+    :param module: the module, used to run ws_ant.sh
+    :param allocated: dict of endpoint name to port from allocatePorts(), ports are reserved for the profile without
+    :return: tuple of rc, stdout and stderr, and the ports moved
+    """
+    if os.path.exists(profile_path) and os.listdir(profile_path):
+        return 1, "", "{0} is not empty".format(profile_path), {}
+    try:
+        if not allocated and meta.get('endpoints'):
+            allocated = reserveCachedPorts(wasdir, meta, name)
+        ports = clone(cache_dir, key, meta, name, profile_path, names, usedPorts(wasdir), allocated)
+    except (ProfileCacheError, ProfileError, IOError, OSError, tarfile.TarError) as e:
+        shutil.rmtree(profile_path, ignore_errors=True)
+        return 1, "", "Could not create {0} from the template cache: {1}".format(name, e), {}
+    rc, stdout_value, stderr_value = generateKeys(module, wasdir, meta, name, profile_path, names)
+    if rc != 0:
+        # Leave nothing behind that would keep a retry from creating it
+        shutil.rmtree(profile_path, ignore_errors=True)
+    return rc, stdout_value, stderr_value, ports
@@ -0,0 +1,780 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Reads the profiles of a WebSphere installation from its profile registry.
+
+manageprofiles.sh keeps every profile it created in
+<wasdir>/properties/profileRegistry.xml. Reading that file takes
+milliseconds, where manageprofiles.sh -listProfiles starts a JVM. The
+profiles are a dict keyed by exact profile name, so that AppSrv never
+matches AppSrv01.
+
+Also creates and removes profiles, one or several at a time, for the
+profile modules. Those only add what is particular to their kind of profile.
+"""
+
+import datetime
+import fcntl
+import glob
+import os
+import re
+import shutil
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+
+from ansible.module_utils.was_config import parseServerIndex
+
+
+# Optional actions of the profile templates that only deploy sample and test
+# applications, left out of minimal profiles
+MINIMAL_ACTIONS = ('defaultAppDeployAndConfig', 'deployIVTApplication', 'samplesInstallAndConfig')
+
+# Parameters each entry of profiles may set
+PROFILE_KEYS = ('name', 'cell_name', 'host_name', 'node_name')
+
+# Default ports of the profile templates, for templates without a
+# serverindex.xml in their documents to read them from
+TEMPLATE_PORTS = {
+    'management': dict(
+        BOOTSTRAP_ADDRESS=9809, SOAP_CONNECTOR_ADDRESS=8879, IPC_CONNECTOR_ADDRESS=9632, ORB_LISTENER_ADDRESS=9100,
+        SAS_SSL_SERVERAUTH_LISTENER_ADDRESS=9401, CSIV2_SSL_MUTUALAUTH_LISTENER_ADDRESS=9402,
+        CSIV2_SSL_SERVERAUTH_LISTENER_ADDRESS=9403, WC_adminhost=9060, WC_adminhost_secure=9043,
+        CELL_DISCOVERY_ADDRESS=7277, DCS_UNICAST_ADDRESS=9352, DataPowerMgr_inbound_secure=5555,
+        XDAGENT_PORT=7060, OVERLAY_UDP_LISTENER_ADDRESS=11005, OVERLAY_TCP_LISTENER_ADDRESS=11006,
+        STATUS_LISTENER_ADDRESS=9420
+    ),
+    'default': dict(
+        BOOTSTRAP_ADDRESS=2809, SOAP_CONNECTOR_ADDRESS=8880, IPC_CONNECTOR_ADDRESS=9633, ORB_LISTENER_ADDRESS=9100,
+        SAS_SSL_SERVERAUTH_LISTENER_ADDRESS=9401, CSIV2_SSL_MUTUALAUTH_LISTENER_ADDRESS=9402,
+        CSIV2_SSL_SERVERAUTH_LISTENER_ADDRESS=9403, WC_adminhost=9060, WC_defaulthost=9080, WC_adminhost_secure=9043,
+        WC_defaulthost_secure=9443, DCS_UNICAST_ADDRESS=9353, SIB_ENDPOINT_ADDRESS=7276,
+        SIB_ENDPOINT_SECURE_ADDRESS=7286, SIB_MQ_ENDPOINT_ADDRESS=5558, SIB_MQ_ENDPOINT_SECURE_ADDRESS=5578,
+        SIP_DEFAULTHOST=5060, SIP_DEFAULTHOST_SECURE=5061, OVERLAY_UDP_LISTENER_ADDRESS=11003,
+        OVERLAY_TCP_LISTENER_ADDRESS=11004
+    ),
+    'managed': dict(
+        BOOTSTRAP_ADDRESS=2809, SOAP_CONNECTOR_ADDRESS=8878, IPC_CONNECTOR_ADDRESS=9626, ORB_LISTENER_ADDRESS=9101,
+        SAS_SSL_SERVERAUTH_LISTENER_ADDRESS=9901, CSIV2_SSL_MUTUALAUTH_LISTENER_ADDRESS=9202,
+        CSIV2_SSL_SERVERAUTH_LISTENER_ADDRESS=9201, NODE_DISCOVERY_ADDRESS=7272,
+        NODE_MULTICAST_DISCOVERY_ADDRESS=5000, NODE_IPV6_MULTICAST_DISCOVERY_ADDRESS=5001,
+        DCS_UNICAST_ADDRESS=9354, XDAGENT_PORT=7061, OVERLAY_UDP_LISTENER_ADDRESS=11001,
+        OVERLAY_TCP_LISTENER_ADDRESS=11002
+    )
+}
+PORTS_DIR = "ansible_ports"
+REGISTRIES_DIR = "ansible_registries"
+
+# Held by the thread running a manageprofiles.sh command that writes the
+# profile registry, see updateRegistry()
+_registry_lock = threading.Lock()
+
+
+class ProfileError(Exception):
+    pass
+
+
+def registryPath(wasdir):
+    return os.path.join(wasdir, "properties", "profileRegistry.xml")
+
+
+def readProfileRegistry(wasdir):
+    """
+    Parses profileRegistry.xml of the installation in wasdir
+    :return: dict keyed by profile name with the path, template and default flag of each profile
+    """
+    path = registryPath(wasdir)
+    profiles = {}
+    try:
+        for event, elem in ET.iterparse(path):
+            # Reservation tickets hold a name for a profile still being created
+            if elem.tag == 'profile' and elem.get('isAReservationTicket') != 'true':
+                profiles[elem.get('name')] = dict(
+                    name=elem.get('name'),
+                    path=elem.get('path'),
+                    template=os.path.basename(elem.get('template') or "") or None,
+                    default=elem.get('isDefault') == 'true'
+                )
+                elem.clear()
+    except (ET.ParseError, IOError, OSError) as e:
+        raise ProfileError("Could not read {0}: {1}".format(path, e))
+    return profiles
+
+
+def parseListProfiles(stdout_value):
+    """
+    Parses the output of manageprofiles.sh -listProfiles, e.g. [Dmgr01, AppSrv01]
+    :return: dict keyed by profile name like readProfileRegistry(), without paths or templates
+    """
+    profiles = {}
+    match = re.search(r"\[([^\]]*)\]", stdout_value)
+    if match:
+        for name in match.group(1).split(","):
+            name = name.strip()
+            if name:
+                profiles[name] = dict(name=name, path=None, template=None, default=None)
+    return profiles
+
+
+def listProfiles(module, wasdir):
+    """
+    Lists the profiles from profileRegistry.xml, or from manageprofiles.sh
+    -listProfiles when the registry can't be read
+    :param module: the module, used to run the command
+    :return: tuple of the profiles and where they were read from, registry or manageprofiles
+    """
+    try:
+        return readProfileRegistry(wasdir), 'registry'
+    except ProfileError:
+        pass
+    rc, stdout_value, stderr_value = module.runCommand(
+        ["{0}/bin/manageprofiles.sh -listProfiles".format(wasdir)],
+        label="listProfiles",
+        shell=True,
+        universal_newlines=True
+    )
+    return parseListProfiles(stdout_value), 'manageprofiles'
+
+
+def profileNames(profile_path):
+    """
+    Reads the cell and node of a profile from its bin/setupCmdLine.sh, and
+    the host of the node from its serverindex.xml
+    :return: dict with cell, node and host, each None if it can't be read
+    """
+    names = dict(cell=None, node=None, host=None)
+    try:
+        f = open(os.path.join(profile_path, "bin", "setupCmdLine.sh"))
+        try:
+            for line in f:
+                match = re.match(r"\s*WAS_(CELL|NODE)=(\S+)", line)
+                if match:
+                    names[match.group(1).lower()] = match.group(2).strip("\"'")
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return names
+    if names['cell'] and names['node']:
+        try:
+            names['host'] = parseServerIndex(serverIndexPath(profile_path, names['cell'], names['node']))['host']
+        except (ET.ParseError, IOError, OSError):
+            pass
+    return names
+
+
+def serverIndexPath(profile_path, cell, node):
+    return os.path.join(profile_path, "config", "cells", cell, "nodes", node, "serverindex.xml")
+
+
+def _ownIndexes(profile_path):
+    """
+    Lists the serverindex.xml of the node of a profile. A deployment manager
+    has the nodes of the whole cell in its configuration, only its own node
+    counts.
+    """
+    names = profileNames(profile_path)
+    if names['cell'] and names['node']:
+        return [serverIndexPath(profile_path, names['cell'], names['node'])]
+    return glob.glob(serverIndexPath(profile_path, "*", "*"))
+
+
+def _endpoints(paths):
+    """
+    :return: list of (endpoint name, port) of every server in the serverindex.xml files
+    """
+    endpoints = []
+    for path in paths:
+        try:
+            index = parseServerIndex(path)
+        except (ET.ParseError, IOError, OSError):
+            continue
+        for server in sorted(index['servers']):
+            for name, endpoint in sorted(index['servers'][server]['endpoints'].items()):
+                if endpoint['port']:
+                    endpoints.append((name, endpoint['port']))
+    return endpoints
+
+
+def profilePorts(profile_path):
+    """
+    :return: set of the ports of the node of a profile
+    """
+    return set([port for name, port in _endpoints(_ownIndexes(profile_path))])
+
+
+def profileEndpoints(profile_path):
+    """
+    :return: dict of endpoint name to port of the first server of the node of a profile
+    """
+    endpoints = {}
+    for name, port in _endpoints(_ownIndexes(profile_path)):
+        endpoints.setdefault(name, port)
+    return endpoints
+
+
+def usedPorts(wasdir):
+    """
+    :return: set of the ports of all profiles in profileRegistry.xml
+    """
+    ports = set()
+    try:
+        profiles = readProfileRegistry(wasdir)
+    except ProfileError:
+        return ports
+    for profile in profiles.values():
+        if profile['path']:
+            ports |= profilePorts(profile['path'])
+    return ports
+
+
+def omitActions(wasdir, template, minimal, omit_actions=None):
+    """
+    Lists the actions to pass to manageprofiles.sh -create -omitAction. A
+    minimal profile leaves out those of MINIMAL_ACTIONS that the template
+    has, i.e. that have a script in its actions directory, as
+    manageprofiles.sh fails on actions a template doesn't know.
+    :param omit_actions: further actions to leave out, passed as they are
+    :return: list of action names
+    """
+    actions = []
+    if minimal:
+        directory = os.path.join(wasdir, "profileTemplates", template, "actions")
+        for action in MINIMAL_ACTIONS:
+            if glob.glob(os.path.join(directory, action + ".*")):
+                actions.append(action)
+    for action in omit_actions or []:
+        if action not in actions:
+            actions.append(action)
+    return actions
+
+
+def templatePorts(wasdir, template):
+    """
+    Lists the endpoints a profile of template gets, from the serverindex.xml
+    in the documents of the template or else from TEMPLATE_PORTS
+    :return: list of endpoint names, ordered by their default port
+    """
+    pattern = os.path.join(wasdir, "profileTemplates", template, "documents", "config", "cells", "*", "nodes", "*", "serverindex.xml")
+    defaults = {}
+    for name, port in _endpoints(glob.glob(pattern)):
+        defaults.setdefault(name, port)
+    if not defaults:
+        defaults = TEMPLATE_PORTS.get(template, {})
+    return sorted(defaults, key=lambda name: (defaults[name], name))
+
+
+def readPortsFile(path):
+    """
+    Reads a ports file of NAME=port lines like manageprofiles.sh -portsFile takes
+    :return: dict of endpoint name to port, empty if the file can't be read
+    """
+    ports = {}
+    try:
+        f = open(path)
+        try:
+            for line in f:
+                fields = line.strip().split("=", 1)
+                if len(fields) == 2 and not fields[0].startswith("#") and fields[1].strip().isdigit():
+                    ports[fields[0].strip()] = int(fields[1])
+        finally:
+            f.close()
+    except (IOError, OSError):
+        pass
+    return ports
+
+
+def portsFilePath(wasdir, name):
+    return os.path.join(wasdir, "properties", PORTS_DIR, name + ".props")
+
+
+def reservePorts(wasdir, name, choose):
+    """
+    Writes the ports chosen for a new profile to its ports file. Profiles
+    created in parallel take turns through a lock next to the ports files,
+    and each sees the ports of the profiles in profileRegistry.xml and those
+    in the ports files of the others, so they never get the same ports. A
+    profile created again keeps the ports it got the first time.
+    :param choose: function taking the set of ports in use and returning a list of (endpoint name, port)
+    :return: tuple of the path of the ports file and the dict of endpoint name to port
+    """
+    path = portsFilePath(wasdir, name)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    lock = open(os.path.join(directory, ".lock"), 'a')
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        ports = readPortsFile(path)
+        if ports:
+            return path, ports
+        used = usedPorts(wasdir)
+        for other in glob.glob(os.path.join(directory, "*.props")):
+            used |= set(readPortsFile(other).values())
+        chosen = choose(used)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            os.write(fd, "".join(["{0}={1}\n".format(n, port) for n, port in chosen]).encode('ascii'))
+        finally:
+            os.close(fd)
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, path)
+        return path, dict(chosen)
+    finally:
+        lock.close()
+
+
+def allocatePorts(wasdir, name, template, base, block):
+    """
+    Gives a new profile the first block of block ports from base that is
+    free, see reservePorts(), and writes a ports file for manageprofiles.sh
+    -portsFile
+    :return: tuple of the path of the ports file and the dict of endpoint name to port
+    """
+    names = templatePorts(wasdir, template)
+    if not names:
+        raise ProfileError("The ports of template {0} are not known".format(template))
+    if len(names) > block:
+        raise ProfileError("Template {0} has {1} ports, more than port_block {2}".format(template, len(names), block))
+
+    def choose(used):
+        start = base
+        while start + len(names) - 1 <= 65535:
+            if not set(range(start, min(start + block, 65536))) & used:
+                return [(n, start + i) for i, n in enumerate(names)]
+            start += block
+        raise ProfileError("No free block of {0} ports from {1}".format(block, base))
+    return reservePorts(wasdir, name, choose)
+
+
+def releasePorts(wasdir, name):
+    """
+    Removes the ports file of a deleted profile, so that its block can be given out again
+    """
+    path = portsFilePath(wasdir, name)
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def _withRegistry(wasdir, work):
+    """
+    Calls work() while no other thread or process changes profileRegistry.xml:
+    threads of this process wait for each other on a lock, other processes
+    on a lock file next to the registry
+    :return: what work() returns
+    """
+    with _registry_lock:
+        lock = open(registryPath(wasdir) + ".ansible.lock", 'a')
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            return work()
+        finally:
+            lock.close()
+
+
+def updateRegistry(module, wasdir, args, label):
+    """
+    Runs a manageprofiles.sh command that writes profileRegistry.xml.
+    manageprofiles.sh reads the registry, changes it and writes it back, so
+    runs that overlap lose each other's profiles. Only one of them runs at a
+    time, see _withRegistry().
+    :param args: the command, run in a shell
+    :param label: step the command is recorded under in timings
+    :return: tuple of rc, stdout and stderr
+    """
+    return _withRegistry(wasdir, lambda: module.runCommand([args], label=label, shell=True, universal_newlines=True))
+
+
+def privateRegistry(wasdir, name):
+    """
+    Copies profileRegistry.xml for manageprofiles.sh -create -registryFile,
+    so that a profile can be created while others are, and only registered
+    in the registry itself afterwards
+    :return: path of the copy
+    """
+    directory = os.path.join(wasdir, "properties", REGISTRIES_DIR)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    path = os.path.join(directory, name + ".xml")
+
+    def copy():
+        if os.path.exists(registryPath(wasdir)):
+            shutil.copyfile(registryPath(wasdir), path)
+        else:
+            f = open(path, 'w')
+            try:
+                f.write('<?xml version="1.0" encoding="UTF-8"?><profiles/>\n')
+            finally:
+                f.close()
+    _withRegistry(wasdir, copy)
+    return path
+
+
+def registerProfile(module, wasdir, name, profile_path):
+    """
+    Adds a profile to profileRegistry.xml with manageprofiles.sh -register
+    :param module: the module, used to run the command
+    :return: tuple of rc, stdout and stderr
+    """
+    return updateRegistry(
+        module, wasdir,
+        "{0}/bin/manageprofiles.sh -register "
+        "-profileName {1} "
+        "-profilePath {2}".format(wasdir, name, profile_path),
+        "register"
+    )
+
+
+def expandProfiles(params, keys):
+    """
+    Turns the profiles parameter into the parameters of each profile, the
+    module parameters with those given for the profile in place
+    :param keys: the parameters a profile may set
+    :return: list of dicts
+    """
+    profiles = []
+    for profile in params['profiles']:
+        if not isinstance(profile, dict):
+            profile = dict(name=profile)
+        unknown = [key for key in profile if key not in keys]
+        if unknown:
+            raise ProfileError("Profiles can only set {0}, not {1}".format(", ".join(keys), ", ".join(sorted(unknown))))
+        if not profile.get('name'):
+            raise ProfileError("Every profile needs a name")
+        profiles.append(dict(params, **profile))
+    names = [profile['name'] for profile in profiles]
+    if len(set(names)) != len(names):
+        raise ProfileError("Profile names must be unique")
+    return profiles
+
+
+def runConcurrently(work, items, concurrency):
+    """
+    Calls work(item) for every item, concurrency at a time
+    :return: list of the results in the order of items
+    """
+    results = [None] * len(items)
+    pending = list(enumerate(items))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                index, item = pending.pop(0)
+            try:
+                results[index] = work(item)
+            except Exception as e:
+                results[index] = dict(failed=True, msg=str(e))
+
+    threads = [threading.Thread(target=worker) for i in range(min(max(1, concurrency), len(items)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def createProfiles(module, wasdir, profiles, create, concurrency=4, seed=False):
+    """
+    Creates the profiles that are not in profileRegistry.xml, concurrency at
+    a time. create builds each profile against a copy of the registry, or
+    copies it from the template cache, and only registers it through
+    updateRegistry() once it is built, so the creates overlap and only the
+    registrations take turns. Profiles created but still missing from the
+    registry afterwards are registered, and if the registry can't be read,
+    none of the profiles created counts as done.
+    :param profiles: list of the parameters of each profile, from expandProfiles()
+    :param create: function taking the parameters of a profile and returning its result, with name and path
+    :param seed: create the first missing profile alone, so that the template cache has it for the others
+    :return: list of the results in the order of profiles
+    """
+    existing, source = listProfiles(module, wasdir)
+    results = [None] * len(profiles)
+    missing = []
+    for index, params in enumerate(profiles):
+        profile = existing.get(params['name'])
+        if profile:
+            results[index] = dict(name=params['name'], changed=False, msg="Profile {0} already exists".format(params['name']), profile=profile)
+        else:
+            missing.append(index)
+    if seed and missing:
+        first = missing.pop(0)
+        results[first] = create(profiles[first])
+    for index, result in zip(missing, runConcurrently(create, [profiles[i] for i in missing], concurrency)):
+        results[index] = dict(result, name=profiles[index]['name'])
+
+    try:
+        registered = readProfileRegistry(wasdir)
+    except ProfileError as e:
+        for result in results:
+            if result.get('changed') and not result.get('failed'):
+                result.update(failed=True, msg="Profile {0} was created but the registry can't be read: {1}".format(result['name'], e))
+        return results
+    for result in results:
+        if result.get('changed') and not result.get('failed') and result['name'] not in registered:
+            rc, stdout_value, stderr_value = registerProfile(module, wasdir, result['name'], result['path'])
+            if rc != 0:
+                result.update(failed=True, msg="Profile {0} was created but could not be registered".format(result['name']),
+                              stdout=stdout_value, stderr=stderr_value)
+    return results
+
+
+def createProfile(module, params, template):
+    """
+    Creates a profile, from the template cache when it has a copy
+    :param module: the module, used to run the commands
+    :param params: the module parameters, with the name, cell_name, host_name and node_name of the profile
+    :param template: name of the profile template under profileTemplates
+    :return: dict with the result for the profile, failed set if it could not be created
+    """
+    # was_profile_cache builds on this module
+    from ansible.module_utils.was_profile_cache import ProfileCacheError, cacheKey, createFromCache, keysAction, lookup, store
+
+    wasdir = params['wasdir']
+    name = params['name']
+    cell_name = params['cell_name']
+    host_name = params['host_name']
+    node_name = params['node_name']
+    username = params['username']
+    password = params['password']
+    template_cache = params['template_cache']
+
+    profile_path = "{0}/profiles/{1}".format(wasdir, name)
+    omitted = omitActions(wasdir, template, params['minimal'], params['omit_actions'])
+    result = dict(name=name, path=profile_path, omitted_actions=omitted)
+    ports_file = None
+    ports = None
+    if params['port_base']:
+        try:
+            ports_file, ports = allocatePorts(wasdir, name, template, params['port_base'], params['port_block'])
+        except (ProfileError, IOError, OSError) as e:
+            return dict(result, failed=True, msg="Could not allocate ports for profile {0}: {1}".format(name, e))
+    options = []
+    if ports_file:
+        options.extend(["-portsFile", ports_file])
+    if omitted:
+        options.extend(["-omitAction"] + omitted)
+    cache = None
+    meta = None
+    if template_cache:
+        cache = dict(key=cacheKey(wasdir, dict(template=template, username=username, password=password, omitted=omitted)), hit=False)
+        meta = lookup(template_cache, cache['key'])
+
+    started = datetime.datetime.now()
+
+    if meta:
+        rc, stdout_value, stderr_value, moved = createFromCache(
+            module, template_cache, cache['key'], meta, wasdir, name, profile_path,
+            dict(cell=cell_name, node=node_name, host=host_name), ports
+        )
+        cache.update(hit=True, profile=meta['name'], ports=moved)
+    else:
+        # Built against a copy of the registry, so that other profiles can be built meanwhile
+        registry = privateRegistry(wasdir, name)
+        try:
+            rc, stdout_value, stderr_value = module.runCommand([
+                "{0}/bin/manageprofiles.sh -create "
+                "-profileName {1} "
+                "-profilePath {0}/profiles/{1} "
+                "-templatePath {0}/profileTemplates/{7} "
+                "-registryFile {9} "
+                "-cellName {2} "
+                "-hostName {3} "
+                "-nodeName {4} "
+                "-enableAdminSecurity true "
+                "-adminUserName {5} "
+                "-adminPassword {6} "
+                "{8}".format(wasdir, name, cell_name, host_name, node_name, username, password, template, " ".join(options), registry)],
+                label="create",
+                shell=True,
+                universal_newlines=True
+            )
+        finally:
+            os.unlink(registry)
+    create_time = round((datetime.datetime.now() - started).total_seconds(), 3)
+    if rc == 0:
+        rc, register_stdout, register_stderr = registerProfile(module, wasdir, name, profile_path)
+        stdout_value += register_stdout
+        stderr_value += register_stderr
+    if rc != 0:
+        # Remove profile dir if creation fails so that it doesnt prevents us from retrying
+        if os.path.exists(profile_path):
+            shutil.rmtree(profile_path, ignore_errors=False, onerror=None)
+        return dict(
+            result,
+            failed=True,
+            msg="Profile {0} creation failed".format(name),
+            stdout=stdout_value,
+            stderr=stderr_value,
+            template_cache=cache,
+            create_time=create_time
+        )
+
+    if cache and not cache['hit']:
+        try:
+            cache['archive'] = store(template_cache, cache['key'], name, profile_path, keysAction(wasdir, template))
+        except (ProfileCacheError, IOError, OSError) as e:
+            # The profile is fine, only later ones won't be cloned from it
+            cache['error'] = str(e)
+
+    return dict(
+        result,
+        changed=True,
+        msg="Profile {0} created successfully".format(name),
+        stdout=stdout_value,
+        stderr=stderr_value,
+        template_cache=cache,
+        create_time=create_time,
+        ports=ports,
+        ports_file=ports_file
+    )
+
+
+def removeProfile(module, params):
+    """
+    Removes a profile if it exists
+    :return: dict with the result for the profile, failed set if it could not be removed
+    """
+    wasdir = params['wasdir']
+    name = params['name']
+
+    profiles, source = listProfiles(module, wasdir)
+    if name not in profiles:
+        return dict(
+            name=name,
+            changed=False,
+            msg="Profile {0} does not exist".format(name)
+        )
+
+    rc, stdout_value, stderr_value = updateRegistry(
+        module, wasdir,
+        "{0}/bin/manageprofiles.sh -delete "
+        "-profileName {1}".format(wasdir, name),
+        "delete"
+    )
+    if rc != 0:
+        # manageprofiles.sh -delete will fail if the profile does not exist.
+        # But creation of a profile with the same name will also fail if
+        # the directory is not empty. So we better remove the dir forcefully.
+        if not stdout_value.find("INSTCONFFAILED") < 0:
+            shutil.rmtree("{0}/profiles/{1}".format(wasdir, name), ignore_errors=False, onerror=None)
+        else:
+            return dict(
+                name=name,
+                failed=True,
+                msg="Profile {0} removal failed".format(name),
+                stdout=stdout_value,
+                stderr=stderr_value
+            )
+
+    releasePorts(wasdir, name)
+    return dict(
+        name=name,
+        changed=True,
+        msg="Profile {0} removed successfully".format(name),
+        stdout=stdout_value,
+        stderr=stderr_value
+    )
+
+
+def manageProfiles(module, create):
+    """
+    Creates or removes the profile in name, or every profile in profiles,
+    according to state and exits the module
+    :param create: function taking the parameters of a profile and returning its result, like createProfile()
+    """
+    state = module.params['state']
+    wasdir = module.params['wasdir']
+    name = module.params['name']
+
+    if module.params['profiles']:
+        try:
+            profiles = expandProfiles(module.params, PROFILE_KEYS)
+        except ProfileError as e:
+            module.fail_json(msg=str(e))
+    else:
+        profiles = [module.params]
+
+    for params in profiles:
+        if params['template_cache'] and not (params['cell_name'] and params['node_name'] and params['host_name']):
+            module.fail_json(msg="template_cache requires cell_name, node_name and host_name")
+
+    # Several profiles
+    if module.params['profiles']:
+        names = ", ".join([params['name'] for params in profiles])
+        if module.check_mode:
+            module.exit_json(
+                changed=False,
+                msg="Profiles {0} are to be {1}".format(names, 'created' if state == 'present' else 'removed')
+            )
+        started = datetime.datetime.now()
+        if state == 'present':
+            results = createProfiles(
+                module, wasdir, profiles, create,
+                module.params['concurrency'],
+                seed=bool(module.params['template_cache'])
+            )
+        else:
+            results = [removeProfile(module, params) for params in profiles]
+        elapsed = round((datetime.datetime.now() - started).total_seconds(), 3)
+        failed = [result['name'] for result in results if result.get('failed')]
+        if failed:
+            module.fail_json(
+                msg="Profiles {0} failed".format(", ".join(failed)),
+                profiles=results,
+                elapsed=elapsed
+            )
+        module.exit_json(
+            changed=any([result.get('changed') for result in results]),
+            msg="Profiles {0} are {1}".format(names, 'present' if state == 'present' else 'absent'),
+            profiles=results,
+            elapsed=elapsed
+        )
+
+    # Create a profile
+    if state == 'present':
+
+        if module.check_mode:
+            module.exit_json(
+                changed=False,
+                msg="Profile {0} is to be created".format(name)
+            )
+
+        existing, source = listProfiles(module, wasdir)
+        profile = existing.get(name)
+        if profile:
+            module.exit_json(
+                changed=False,
+                msg="Profile {0} already exists".format(name),
+                profile=profile
+            )
+        result = create(module.params)
+        if result.get('failed'):
+            module.fail_json(**result)
+        module.exit_json(**result)
+
+    # Remove a profile
+    if state == 'absent':
+
+        if module.check_mode:
+            module.exit_json(
+                changed=False,
+                msg="Profile {0} is to be removed".format(name)
+            )
+
+        result = removeProfile(module, module.params)
+        if result.get('failed'):
+            module.fail_json(**result)
+        module.exit_json(**result)
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Minimal client for the WebSphere SOAP JMX connector.
+
+wsadmin launches a JVM just to send a handful of JMX requests to the SOAP
+connector of the deployment manager (port 8879 by default). This module sends
+those requests itself, over keep-alive HTTP(S) connections that are pooled
+per host and port, and covers what was_server needs from AdminControl:
+queryNames, getAttribute, invoke and starting, stopping and querying servers.
+
+Arguments and return values that the connector exchanges as serialized Java
+objects are handled for the simple cases needed here: arrays of strings on the
+way out, and strings (including ObjectNames inside a Set) on the way back.
+"""
+
+import base64
+import re
+import select
+import socket
+import ssl
+import struct
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+from xml.sax.saxutils import escape
+
+SOAP_ENV = "http://schemas.xmlsoap.org/soap/envelope/"
+SOAP_ENC = "http://schemas.xmlsoap.org/soap/encoding/"
+XSI = "http://www.w3.org/2001/XMLSchema-instance"
+
+ENVELOPE = """<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="{env}" xmlns:xsi="{xsi}" xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+<SOAP-ENV:Body>
+<ns1:{operation} xmlns:ns1="urn:AdminService" SOAP-ENV:encodingStyle="{enc}">
+{params}
+</ns1:{operation}>
+</SOAP-ENV:Body>
+</SOAP-ENV:Envelope>"""
+
+# Java serialization constants, see java.io.ObjectStreamConstants
+STREAM_HEADER = b"\xac\xed\x00\x05"
+TC_NULL = 0x70
+TC_CLASSDESC = 0x72
+TC_STRING = 0x74
+TC_ARRAY = 0x75
+TC_ENDBLOCKDATA = 0x78
+SC_SERIALIZABLE = 0x02
+
+# serialVersionUIDs of the array classes
+OBJECT_ARRAY = ("[Ljava.lang.Object;", 0x90CE589F1073296C)
+STRING_ARRAY = ("[Ljava.lang.String;", 0xADD256E7E91D7B47)
+
+OBJECTNAME_RE = re.compile(r"^[^:*?]+:[^=]+=.+$")
+
+# States a server launched by its node agent ends up in when it fails to
+# start, and how long it may take its MBean to show up after the launch
+START_FAILED = ('STOPPING', 'STOPPED', 'FAILED')
+LAUNCH_GRACE = 30
+
+
+class SoapError(Exception):
+    pass
+
+
+def _utf(value):
+    data = value.encode('utf-8')
+    return struct.pack(">H", len(data)) + data
+
+
+def serializeArray(values, array_class=OBJECT_ARRAY):
+    """
+    Serializes a list of strings as a Java Object[] or String[]
+    :return: base64 encoded str
+    """
+    data = STREAM_HEADER
+    data += struct.pack(">BB", TC_ARRAY, TC_CLASSDESC) + _utf(array_class[0])
+    data += struct.pack(">QBH", array_class[1], SC_SERIALIZABLE, 0)
+    data += struct.pack(">BB", TC_ENDBLOCKDATA, TC_NULL)
+    data += struct.pack(">i", len(values))
+    for value in values:
+        data += struct.pack(">B", TC_STRING) + _utf(value)
+    return base64.b64encode(data).decode('ascii')
+
+
+def serializedStrings(data):
+    """
+    Returns the strings found in a serialized Java object. Rather than
+    parsing the whole stream this looks for TC_STRING records holding valid
+    UTF-8, which is enough for Strings, Booleans and sets of ObjectNames.
+    :return: list
+    """
+    strings = []
+    i = 0
+    while i < len(data) - 3:
+        if bytearray(data[i:i + 1])[0] == TC_STRING:
+            length = struct.unpack(">H", data[i + 1:i + 3])[0]
+            chunk = data[i + 3:i + 3 + length]
+            if len(chunk) == length and length > 0:
+                try:
+                    strings.append(chunk.decode('utf-8'))
+                    i += 3 + length
+                    continue
+                except UnicodeDecodeError:
+                    pass
+        i += 1
+    return strings
+
+
+def _element(name, value, xsi_type):
+    if value is None:
+        return '<{0} xsi:type="{1}" xsi:nil="true"/>'.format(name, xsi_type)
+    return '<{0} xsi:type="{1}">{2}</{0}>'.format(name, xsi_type, escape(value))
+
+
+class _Pool(object):
+    """
+    Keeps idle keep-alive connections per host and port. HTTP connections
+    can't be shared between threads, so a connection is handed out to one
+    caller at a time and put back once its response has been read.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def get(self, key, factory):
+        """
+        Hands out an idle connection, skipping those the server has closed
+        since, or a new one from factory
+        """
+        while True:
+            with self.lock:
+                conns = self.idle.get(key)
+                conn = conns.pop() if conns else None
+            if conn is None:
+                return factory()
+            if not _dropped(conn):
+                return conn
+            conn.close()
+
+    def put(self, key, conn):
+        with self.lock:
+            self.idle.setdefault(key, []).append(conn)
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle = {}
+
+
+def _dropped(conn):
+    """
+    An idle connection has nothing to read until a request is sent on it, so
+    if its socket is readable the server has hung up or is out of step
+    :return: whether the connection can't be used for another request
+    """
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (ValueError, select.error, socket.error):
+        return True
+
+
+POOL = _Pool()
+
+
+class AdminClient(object):
+    """
+    Talks to the AdminService of a deployment manager, node agent or
+    server through its SOAP connector
+    """
+
+    def __init__(self, host='localhost', port=8879, username=None, password=None,
+                 secure=True, validate_certs=True, timeout=60):
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.secure = secure
+        self.validate_certs = validate_certs
+        self.timeout = timeout
+        self.key = (host, self.port, secure)
+        self.poll = 2
+
+    def _connect(self):
+        if not self.secure:
+            return httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        context = ssl.create_default_context()
+        if not self.validate_certs:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return httplib.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=context)
+
+    def call(self, operation, params):
+        """
+        Sends one AdminService request
+        :param operation: AdminService operation, e.g. queryNames
+        :param params: list of XML elements holding the arguments
+        :return: the return element of the response, or None
+        """
+        body = ENVELOPE.format(env=SOAP_ENV, xsi=XSI, enc=SOAP_ENC, operation=operation, params="\n".join(params)).encode('utf-8')
+        headers = {
+            "Content-Type": "text/xml; charset=utf-8",
+            "SOAPAction": "urn:AdminService",
+            "Connection": "keep-alive"
+        }
+        if self.username is not None:
+            credentials = "{0}:{1}".format(self.username, self.password or "").encode('utf-8')
+            headers["Authorization"] = "Basic " + base64.b64encode(credentials).decode('ascii')
+
+        # Pooled connections the server has closed are skipped before
+        # anything is sent on them, and a failed connect is tried once more.
+        # Once the request is out it is not sent again, since the server may
+        # have acted on it, e.g. launched a server.
+        for attempt in (1, 2):
+            conn = POOL.get(self.key, self._connect)
+            if conn.sock is None:
+                try:
+                    conn.connect()
+                except (httplib.HTTPException, socket.error) as e:
+                    conn.close()
+                    if attempt == 2:
+                        raise SoapError("Failed talking to {0}:{1}: {2}".format(self.host, self.port, e))
+                    continue
+            break
+        try:
+            conn.request("POST", "/", body, headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (httplib.HTTPException, socket.error) as e:
+            conn.close()
+            raise SoapError("Failed talking to {0}:{1}: {2}".format(self.host, self.port, e))
+        if response.getheader("Connection", "").lower() == "close":
+            conn.close()
+        else:
+            POOL.put(self.key, conn)
+
+        try:
+            root = ET.fromstring(data)
+        except ET.ParseError:
+            raise SoapError("Unexpected response from {0}:{1} (HTTP {2}): {3}".format(self.host, self.port, response.status, data[:200]))
+        fault = root.find(".//{{{0}}}Fault".format(SOAP_ENV))
+        if fault is not None:
+            raise SoapError(fault.findtext("faultstring") or "SOAP fault in {0}".format(operation))
+        if response.status != 200:
+            raise SoapError("HTTP {0} from {1}:{2}".format(response.status, self.host, self.port))
+        for element in root.iter():
+            if element.tag == "return" or element.tag.endswith("}return"):
+                if element.get("{{{0}}}nil".format(XSI)) == "true":
+                    return None
+                return element
+        return None
+
+    def _strings(self, element):
+        """
+        Returns the strings held by a return element, whether they are
+        plain text or a serialized Java object
+        """
+        if element is None:
+            return []
+        text = (element.text or "").strip()
+        if text.startswith("rO0AB"):
+            try:
+                return serializedStrings(base64.b64decode(text))
+            except (TypeError, ValueError):
+                raise SoapError("Could not decode response value")
+        items = [(item.text or "").strip() for item in element]
+        return items or [text]
+
+    def queryNames(self, pattern):
+        """
+        Returns the names of the MBeans matching pattern
+        :return: list
+        """
+        result = self.call("queryNames", [
+            _element("objectname", pattern, "ns1:javax.management.ObjectName"),
+            _element("queryexp", None, "ns1:javax.management.QueryExp")
+        ])
+        return [s for s in self._strings(result) if OBJECTNAME_RE.match(s)]
+
+    def completeObjectName(self, pattern):
+        names = self.queryNames(pattern)
+        return names[0] if names else ""
+
+    def getAttribute(self, objectname, attribute):
+        result = self.call("getAttribute", [
+            _element("objectname", objectname, "ns1:javax.management.ObjectName"),
+            _element("attribute", attribute, "xsd:string")
+        ])
+        strings = self._strings(result)
+        return strings[0] if strings else None
+
+    def invoke(self, objectname, operation, params=(), signature=()):
+        result = self.call("invoke", [
+            _element("objectname", objectname, "ns1:javax.management.ObjectName"),
+            _element("operationname", operation, "xsd:string"),
+            _element("params", serializeArray(list(params)), "ns1:[Ljava.lang.Object;"),
+            _element("signature", serializeArray(list(signature), STRING_ARRAY), "ns1:[Ljava.lang.String;")
+        ])
+        strings = self._strings(result)
+        return strings[0] if strings else None
+
+    def serverState(self, name, node):
+        """
+        Returns the state of a server like AdminControl does, STOPPED if
+        it has no MBean
+        """
+        on = self.completeObjectName("WebSphere:type=Server,node={0},process={1},*".format(node, name))
+        if not on:
+            return 'STOPPED'
+        return self.getAttribute(on, "state") or 'STARTED'
+
+    def _waitFor(self, name, node, states, timeout, failed=(), grace=0):
+        """
+        Polls the state of a server until it is in one of states
+        :param failed: states that end the wait with an error, once grace seconds have passed or the server was seen in another state
+        """
+        start = time.time()
+        deadline = start + timeout
+        seen = False
+        while True:
+            state = self.serverState(name, node)
+            if state in states:
+                return state
+            if state in failed and (seen or time.time() - start >= grace):
+                raise SoapError("Server {0} on node {1} failed to start, it is {2}".format(name, node, state))
+            seen = seen or state not in failed
+            if time.time() > deadline:
+                raise SoapError("Timed out waiting for server {0} on node {1}, it is {2}".format(name, node, state))
+            time.sleep(self.poll)
+
+    def startServer(self, name, node, timeout=1200, grace=LAUNCH_GRACE):
+        """
+        Starts a server through the node agent of its node and waits until
+        it is started, or until it stops again
+        :param grace: seconds the server may have no MBean after the launch before that counts as failed
+        """
+        agent = self.completeObjectName("WebSphere:type=NodeAgent,node={0},*".format(node))
+        if not agent:
+            raise SoapError("No running node agent found on node {0}".format(node))
+        launched = self.invoke(agent, "launchProcess", [name], ["java.lang.String"])
+        if launched is not None and launched.lower() == 'false':
+            raise SoapError("The node agent of node {0} could not launch server {1}".format(node, name))
+        return self._waitFor(name, node, ('STARTED',), timeout, START_FAILED, grace)
+
+    def stopServer(self, name, node, timeout=1200):
+        """
+        Stops a server and waits until its MBean is gone
+        """
+        on = self.completeObjectName("WebSphere:type=Server,node={0},process={1},*".format(node, name))
+        if not on:
+            return 'STOPPED'
+        self.invoke(on, "stop")
+        return self._waitFor(name, node, ('STOPPED',), timeout)
@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Persistent wsadmin sessions.
+
+Every call to wsadmin.sh pays for a JVM launch and a SOAP connect. A session
+keeps one interactive "wsadmin.sh -lang jython" process running on the host.
+The process is owned by a small daemon listening on a UNIX socket, so that
+later tasks can send their Jython to it and read back stdout and exit status.
+
+There is one daemon per session key. The key is a hash of the full wsadmin
+command line, so different cells, ports or credentials never share a session.
+The daemon exits after it has been idle for idle_timeout seconds.
+"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import re
+import select
+import socket
+import subprocess
+import tempfile
+import time
+
+DEFAULT_IDLE_TIMEOUT = 600
+DEFAULT_START_TIMEOUT = 300
+
+MARKER = "__ANSIBLE_WSADMIN_DONE__"
+
+# Executed inside wsadmin. Runs the script in a fresh namespace that only
+# carries the Admin* objects over, and prints the marker with the exit status.
+# Written for Jython 2.1 as well as 2.7.
+WRAPPER = """import sys
+import traceback
+sys.argv = %(argv)s
+__ansible_g = {'__name__': '__main__'}
+for __ansible_k in globals().keys():
+    if __ansible_k[:5] == 'Admin' or __ansible_k == 'Help':
+        __ansible_g[__ansible_k] = globals()[__ansible_k]
+__ansible_rc = 0
+try:
+    execfile(%(path)r, __ansible_g)
+except SystemExit, __ansible_e:
+    __ansible_rc = getattr(__ansible_e, 'code', 1)
+    if __ansible_rc is None:
+        __ansible_rc = 0
+    elif type(__ansible_rc) != type(0):
+        print __ansible_rc
+        __ansible_rc = 1
+except:
+    traceback.print_exc(file=sys.stdout)
+    __ansible_rc = 1
+sys.stdout.flush()
+print '%(marker)s %(token)s %%d' %% __ansible_rc
+sys.stdout.flush()
+"""
+
+PROMPT_RE = re.compile(r"^(wsadmin>)+", re.MULTILINE)
+
+
+class WsadminSessionError(Exception):
+    pass
+
+
+def wsadmin_command(wasdir, host=None, port=None, username=None, password=None, conntype='SOAP'):
+    """
+    Builds the argv used to launch wsadmin
+    :param wasdir: Path to root of WAS installation directory or profile
+    :return: list
+    """
+    cmd = ["{0}/bin/wsadmin.sh".format(wasdir), "-lang", "jython"]
+    if conntype:
+        cmd += ["-conntype", conntype]
+    if host:
+        cmd += ["-host", host]
+    if port:
+        cmd += ["-port", str(port)]
+    if username is not None:
+        cmd += ["-username", username]
+    if password is not None:
+        cmd += ["-password", password]
+    return cmd
+
+
+def session_key(command):
+    """
+    Returns the key of the session serving command. The password is part of
+    the command, so the key is a hash and never the command itself.
+    """
+    return hashlib.sha256("\0".join(command).encode('utf-8')).hexdigest()[:32]
+
+
+def default_session_dir():
+    return os.path.join(tempfile.gettempdir(), "ansible-wsadmin-{0}".format(os.getuid()))
+
+
+def _send(sock, data):
+    sock.sendall((json.dumps(data) + "\n").encode('utf-8'))
+
+
+def _recv(sock):
+    buf = b""
+    while not buf.endswith(b"\n"):
+        chunk = sock.recv(65536)
+        if not chunk:
+            return None
+        buf += chunk
+    return json.loads(buf.decode('utf-8'))
+
+
+class WsadminSession(object):
+    """
+    Client side of a persistent wsadmin session. The daemon is started on the
+    first request if it is not already running.
+    """
+
+    def __init__(self, command, session_dir=None, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 start_timeout=DEFAULT_START_TIMEOUT):
+        self.command = command
+        self.session_dir = session_dir or default_session_dir()
+        self.idle_timeout = idle_timeout
+        self.start_timeout = start_timeout
+        self.key = session_key(command)
+        self.socket_path = os.path.join(self.session_dir, self.key + ".sock")
+        self.lock_path = os.path.join(self.session_dir, self.key + ".lock")
+        self.log_path = os.path.join(self.session_dir, self.key + ".log")
+        self.restarted = False
+
+    def run(self, script=None, code=None, args=None, timeout=None):
+        """
+        Runs a script file or a string of Jython code in the session
+        :param script: Path to a Jython script on the host
+        :param code: Jython code to run instead of a script file
+        :param args: List of arguments, available to the script as sys.argv
+        :param timeout: Seconds to wait for the script. None waits forever
+        :return: tuple of exit status and stdout
+        """
+        response = self._request(dict(op='run', script=script, code=code, args=args or [], timeout=timeout), timeout)
+        if response.get('error'):
+            raise WsadminSessionError("{0}\n{1}".format(response['error'], response.get('stdout', '')))
+        return response['rc'], response['stdout']
+
+    def stop(self):
+        """
+        Stops the daemon and its wsadmin process if they are running
+        """
+        try:
+            sock = self._connect()
+        except socket.error:
+            return False
+        try:
+            _send(sock, dict(op='stop'))
+            _recv(sock)
+        finally:
+            sock.close()
+        return True
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            raise
+        return sock
+
+    def _ensure_daemon(self):
+        """
+        Connects to the daemon, starting it first if needed. A lock file keeps
+        two tasks from starting a daemon for the same key at the same time.
+        """
+        if not os.path.isdir(self.session_dir):
+            os.makedirs(self.session_dir, 0o700)
+        st = os.stat(self.session_dir)
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise WsadminSessionError("{0} must be owned by the current user and not accessible by others".format(self.session_dir))
+        lock = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return self._connect()
+            except socket.error as e:
+                if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                    raise
+            # Either no daemon or a stale socket left behind by a dead one
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self._spawn()
+            deadline = time.time() + 30
+            while True:
+                try:
+                    return self._connect()
+                except socket.error:
+                    if time.time() > deadline:
+                        raise WsadminSessionError("wsadmin session daemon did not start, see {0}".format(self.log_path))
+                    time.sleep(0.1)
+        finally:
+            lock.close()
+
+    def _request(self, request, timeout=None):
+        # A session may drop between two tasks, for example when the daemon
+        # reaches its idle timeout just as we connect. Retry once on a fresh one.
+        for attempt in (1, 2):
+            sock = self._ensure_daemon()
+            try:
+                if timeout is not None:
+                    sock.settimeout(self.start_timeout + timeout + 30)
+                _send(sock, request)
+                response = _recv(sock)
+            except socket.timeout:
+                raise WsadminSessionError("Timed out waiting for wsadmin session {0}".format(self.key))
+            except socket.error:
+                response = None
+            finally:
+                sock.close()
+            if response is not None:
+                self.restarted = self.restarted or response.get('restarted', False)
+                return response
+            self.restarted = True
+        raise WsadminSessionError("Lost connection to wsadmin session {0}, see {1}".format(self.key, self.log_path))
+
+    def _spawn(self):
+        """
+        Starts the daemon as a detached grandchild so that the module process
+        can exit while the session lives on.
+        """
+        pid = os.fork()
+        if pid:
+            os.waitpid(pid, 0)
+            return
+        try:
+            os.setsid()
+            if os.fork():
+                os._exit(0)
+            os.umask(0o077)
+            os.chdir("/")
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            log = os.open(self.log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            os.dup2(devnull, 0)
+            os.dup2(log, 1)
+            os.dup2(log, 2)
+            os.closerange(3, 1024)
+            _Daemon(self.command, self.socket_path, self.idle_timeout, self.start_timeout).serve()
+        finally:
+            os._exit(0)
+
+
+class _Daemon(object):
+    """
+    Owns the wsadmin process and serves requests one at a time. wsadmin is
+    single threaded, so further clients simply wait in the listen backlog.
+    """
+
+    def __init__(self, command, socket_path, idle_timeout, start_timeout):
+        self.command = command
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.start_timeout = start_timeout
+        self.proc = None
+        self.buf = ""
+        self.seq = 0
+        self.starts = 0
+        self.stopping = False
+
+    def serve(self):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(64)
+        try:
+            last = time.time()
+            while not self.stopping:
+                remaining = self.idle_timeout - (time.time() - last)
+                if remaining <= 0:
+                    break
+                ready = select.select([listener], [], [], remaining)[0]
+                if not ready:
+                    continue
+                conn = listener.accept()[0]
+                try:
+                    self.handle(conn)
+                except Exception as e:
+                    self.log("Request failed: {0}".format(e))
+                finally:
+                    conn.close()
+                last = time.time()
+        finally:
+            # Unlink before closing so that clients start a new daemon
+            # rather than queue up on a socket nobody accepts anymore.
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+            listener.close()
+            self.kill()
+
+    def log(self, msg):
+        # Straight to the log on fd 1, sys.stdout may be a wrapper around a
+        # descriptor of the parent that _spawn() has closed
+        os.write(1, "{0} {1}\n".format(time.strftime("%Y-%m-%d %H:%M:%S"), msg).encode('utf-8'))
+
+    def handle(self, conn):
+        request = _recv(conn)
+        if request is None:
+            return
+        if request['op'] == 'ping':
+            _send(conn, dict(rc=0, stdout=""))
+        elif request['op'] == 'stop':
+            self.stopping = True
+            _send(conn, dict(rc=0, stdout=""))
+        elif request['op'] == 'run':
+            _send(conn, self.run(request))
+        else:
+            _send(conn, dict(rc=1, stdout="", error="Unknown operation {0}".format(request['op'])))
+
+    def run(self, request):
+        restarted = False
+        if self.proc is None or self.proc.poll() is not None:
+            restarted = self.starts > 0
+            error, output = self.start()
+            if error:
+                return dict(rc=1, stdout=output, error=error, restarted=restarted)
+
+        path = request.get('script')
+        tmp = None
+        if request.get('code') is not None:
+            fd, tmp = tempfile.mkstemp(suffix=".py", dir=os.path.dirname(self.socket_path))
+            os.write(fd, request['code'].encode('utf-8'))
+            os.close(fd)
+            path = tmp
+        try:
+            rc, output = self.execute(path, [path] + list(request.get('args') or []), request.get('timeout'))
+        finally:
+            if tmp:
+                os.unlink(tmp)
+        if rc is None:
+            # We can't tell where wsadmin stopped, so start over next time
+            self.kill()
+            return dict(rc=1, stdout=output, error="wsadmin session dropped or timed out", restarted=restarted)
+        return dict(rc=rc, stdout=output, restarted=restarted)
+
+    def start(self):
+        self.log("Starting wsadmin")
+        self.starts += 1
+        self.buf = ""
+        self.proc = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+        rc, output = self.execute(None, None, self.start_timeout)
+        if rc is None:
+            self.kill()
+            return "wsadmin failed to start", output
+        return None, output
+
+    def kill(self):
+        if self.proc is not None and self.proc.poll() is None:
+            try:
+                self.proc.stdin.write(b"exit\n")
+                self.proc.stdin.flush()
+                self.proc.stdin.close()
+            except (IOError, OSError):
+                pass
+            deadline = time.time() + 10
+            while self.proc.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if self.proc.poll() is None:
+                self.proc.kill()
+                self.proc.wait()
+        self.proc = None
+
+    def execute(self, path, argv, timeout):
+        """
+        Sends one script to wsadmin and reads its output up to the marker.
+        Without a path only the marker is printed, which tells us that
+        wsadmin has come up and accepts input.
+        :return: tuple of exit status and output. Status is None if wsadmin
+                 died or did not answer within timeout
+        """
+        self.seq += 1
+        token = "{0}.{1}".format(os.getpid(), self.seq)
+        if path is None:
+            line = "print '{0} {1} 0'\n".format(MARKER, token)
+        else:
+            fd, wrapper = tempfile.mkstemp(suffix=".py", dir=os.path.dirname(self.socket_path))
+            os.write(fd, (WRAPPER % dict(argv=repr(argv), path=path, marker=MARKER, token=token)).encode('utf-8'))
+            os.close(fd)
+            line = "execfile({0!r})\n".format(wrapper)
+
+        # Drop whatever is left over from the last command, typically a prompt
+        self.buf = ""
+        fd = self.proc.stdout.fileno()
+        while select.select([fd], [], [], 0)[0]:
+            if not os.read(fd, 65536):
+                break
+        done = re.compile(r"{0} {1} (-?\d+)".format(MARKER, re.escape(token)))
+        try:
+            try:
+                self.proc.stdin.write(line.encode('utf-8'))
+                self.proc.stdin.flush()
+            except (IOError, OSError):
+                return None, ""
+            deadline = None if timeout is None else time.time() + timeout
+            while True:
+                match = done.search(self.buf)
+                if match:
+                    output = PROMPT_RE.sub("", self.buf[:match.start()])
+                    self.buf = self.buf[match.end():]
+                    return int(match.group(1)), output
+                wait = None if deadline is None else deadline - time.time()
+                if wait is not None and wait <= 0:
+                    return None, PROMPT_RE.sub("", self.buf)
+                if not select.select([fd], [], [], wait)[0]:
+                    continue
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    return None, PROMPT_RE.sub("", self.buf)
+                self.buf += chunk.decode('utf-8', 'replace')
+        finally:
+            if path is not None:
+                os.unlink(wrapper)
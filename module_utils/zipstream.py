@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Extracts a zip archive while it is being read, e.g. straight from a download.
+
+zipfile needs to seek to the central directory at the end of the archive, so
+an archive that is downloaded has to be written to disk in full before it can
+be extracted. Here the entries are read through their local headers in the
+order they come instead, and only the wanted ones are written out. The
+central directory is read last, for the permissions of the files, which the
+local headers don't hold. Every byte read passes through an optional hash,
+so the checksum of the archive is known once it has been extracted.
+"""
+
+import os
+import stat
+import struct
+import zlib
+
+LOCAL = b"PK\x03\x04"
+CENTRAL = b"PK\x01\x02"
+END = b"PK\x05\x06"
+ZIP64_END = b"PK\x06\x06"
+DESCRIPTOR = b"PK\x07\x08"
+CHUNK = 1024 * 1024
+
+
+class ZipStreamError(Exception):
+    pass
+
+
+class _Reader(object):
+    """
+    Reads exact amounts from a stream, feeding everything read to digest
+    """
+
+    def __init__(self, stream, digest=None):
+        self.stream = stream
+        self.digest = digest
+        self.pushed = b""
+
+    def read(self, size):
+        data = self.pushed[:size]
+        self.pushed = self.pushed[size:]
+        while len(data) < size:
+            chunk = self.stream.read(min(CHUNK, size - len(data)))
+            if not chunk:
+                break
+            if self.digest is not None:
+                self.digest.update(chunk)
+            data += chunk
+        return data
+
+    def exact(self, size):
+        data = self.read(size)
+        if len(data) != size:
+            raise ZipStreamError("Archive ends unexpectedly")
+        return data
+
+    def push(self, data):
+        self.pushed = data + self.pushed
+
+    def drain(self):
+        while self.read(CHUNK):
+            pass
+
+
+def _target(dest, name):
+    """
+    :return: path of entry name below dest, refusing names that would end up outside of it
+    """
+    path = os.path.normpath(os.path.join(dest, name))
+    if os.path.isabs(name) or not (path + os.sep).startswith(os.path.normpath(dest) + os.sep):
+        raise ZipStreamError("Refusing to extract {0} outside of {1}".format(name, dest))
+    return path
+
+
+def _zip64(extra, usize, csize):
+    """
+    Takes the real sizes from the zip64 extra field where the header has 0xFFFFFFFF
+    """
+    while len(extra) >= 4:
+        tag, length = struct.unpack("<HH", extra[:4])
+        if tag == 1:
+            data = extra[4:4 + length]
+            if usize == 0xFFFFFFFF and len(data) >= 8:
+                usize = struct.unpack("<Q", data[:8])[0]
+                data = data[8:]
+            if csize == 0xFFFFFFFF and len(data) >= 8:
+                csize = struct.unpack("<Q", data[:8])[0]
+            return usize, csize, True
+        extra = extra[4 + length:]
+    return usize, csize, False
+
+
+def _copy(reader, out, method, csize, flags):
+    """
+    Copies the data of one entry from reader to out, a file or None to skip it
+    :return: tuple of crc32 and number of bytes written
+    """
+    crc = 0
+    written = 0
+    if method == 0:
+        if flags & 0x08:
+            raise ZipStreamError("Stored entries without sizes can't be read as a stream")
+        remaining = csize
+        while remaining:
+            data = reader.exact(min(CHUNK, remaining))
+            remaining -= len(data)
+            crc = zlib.crc32(data, crc)
+            written += len(data)
+            if out is not None:
+                out.write(data)
+    elif method == 8:
+        inflater = zlib.decompressobj(-15)
+        remaining = None if flags & 0x08 else csize
+        while not inflater.eof:
+            size = CHUNK if remaining is None else min(CHUNK, remaining)
+            data = reader.read(size) if size else b""
+            if not data and remaining is not None and remaining == 0:
+                break
+            if not data:
+                raise ZipStreamError("Archive ends unexpectedly")
+            if remaining is not None:
+                remaining -= len(data)
+            plain = inflater.decompress(data)
+            crc = zlib.crc32(plain, crc)
+            written += len(plain)
+            if out is not None:
+                out.write(plain)
+        # The deflate stream ended within what was read, hand the rest back
+        reader.push(inflater.unused_data)
+    else:
+        raise ZipStreamError("Compression method {0} is not supported".format(method))
+    return crc & 0xFFFFFFFF, written
+
+
+def extract(stream, dest, wanted=None, digest=None):
+    """
+    Extracts the entries of the zip archive read from stream into dest
+    :param stream: file object with a read() method, such as an HTTP response
+    :param wanted: function taking an entry name and returning False for entries to skip
+    :param digest: hashlib object updated with every byte of the archive
+    :return: list of the names extracted
+    """
+    reader = _Reader(stream, digest)
+    extracted = []
+    while True:
+        signature = reader.read(4)
+        if signature != LOCAL:
+            break
+        (version, flags, method, mtime, mdate, crc, csize, usize,
+         name_length, extra_length) = struct.unpack("<HHHHHIIIHH", reader.exact(26))
+        name = reader.exact(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+        usize, csize, is_zip64 = _zip64(reader.exact(extra_length), usize, csize)
+        if flags & 0x01:
+            raise ZipStreamError("{0} is encrypted".format(name))
+
+        path = None
+        if not name.endswith("/") and (wanted is None or wanted(name)):
+            path = _target(dest, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+        elif name.endswith("/") and (wanted is None or wanted(name)):
+            if not os.path.isdir(_target(dest, name)):
+                os.makedirs(_target(dest, name))
+
+        out = open(path, 'wb') if path else None
+        try:
+            actual_crc, written = _copy(reader, out, method, csize, flags)
+        finally:
+            if out is not None:
+                out.close()
+
+        if flags & 0x08:
+            descriptor = reader.exact(4)
+            if descriptor != DESCRIPTOR:
+                reader.push(descriptor)
+            crc = struct.unpack("<I", reader.exact(4))[0]
+            reader.exact(16 if is_zip64 else 8)
+        if path and actual_crc != crc:
+            raise ZipStreamError("CRC of {0} does not match, the archive is damaged".format(name))
+        if path:
+            extracted.append(name)
+
+    # Permissions and symbolic links are only in the central directory
+    while signature == CENTRAL:
+        (made_by, version, flags, method, mtime, mdate, crc, csize, usize, name_length,
+         extra_length, comment_length, disk, internal, external, offset) = struct.unpack("<HHHHHHIIIHHHHHII", reader.exact(42))
+        name = reader.exact(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+        reader.exact(extra_length + comment_length)
+        mode = external >> 16
+        if made_by >> 8 == 3 and mode and name in extracted:
+            path = _target(dest, name)
+            if stat.S_ISLNK(mode):
+                f = open(path, 'rb')
+                try:
+                    link = f.read().decode('utf-8')
+                finally:
+                    f.close()
+                os.unlink(path)
+                os.symlink(link, path)
+            else:
+                os.chmod(path, stat.S_IMODE(mode))
+        signature = reader.read(4)
+
+    if signature not in (END, ZIP64_END, b""):
+        raise ZipStreamError("Unexpected data in the archive")
+    # Read to the end, so that digest covers the whole archive
+    reader.drain()
+    return extracted
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Makes the files in module_utils importable as ansible.module_utils.*, the way
+Ansible ships them to the host along with the modules.
+"""
+
+import os
+import sys
+import types
+
+MODULE_UTILS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "module_utils")
+
+try:
+    import ansible.module_utils
+except ImportError:
+    sys.modules['ansible'] = types.ModuleType('ansible')
+    sys.modules['ansible'].__path__ = []
+    sys.modules['ansible.module_utils'] = types.ModuleType('ansible.module_utils')
+    sys.modules['ansible'].module_utils = sys.modules['ansible.module_utils']
+    sys.modules['ansible.module_utils'].__path__ = []
+
+if MODULE_UTILS not in sys.modules['ansible.module_utils'].__path__:
+    sys.modules['ansible.module_utils'].__path__.insert(0, MODULE_UTILS)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Takes the host-wide lock in temporary directories.
+"""
+
+import os
+import stat
+
+import pytest
+
+from ansible.module_utils import ibmim_lock
+from ansible.module_utils.ibmim_lock import HostLock, LockError, LockTimeout, defaultLockFile
+
+
+def test_defaultLockFile(monkeypatch, tmp_path):
+    monkeypatch.setattr(os, "getuid", lambda: 0)
+    assert defaultLockFile() == "/var/ibm/InstallationManager/ansible_ibmim.lock"
+
+    monkeypatch.setattr(os, "getuid", lambda: 1000)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    assert defaultLockFile() == str(tmp_path / ".ansible" / "ibmim_lock" / "ansible_ibmim.lock")
+
+
+def test_directory_is_private(monkeypatch, tmp_path):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(ibmim_lock, "ADMIN_DATA_LOCATION", str(tmp_path / "var"))
+    path = defaultLockFile()
+    lock = HostLock(path, timeout=1)
+    lock.acquire()
+    lock.release()
+    assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+
+
+def test_shared_and_exclusive(tmp_path):
+    path = str(tmp_path / "x.lock")
+    first = HostLock(path, timeout=0.5, poll=0.05)
+    second = HostLock(path, timeout=0.5, poll=0.05)
+    first.acquire(shared=True)
+    second.acquire(shared=True)
+    second.release()
+    with pytest.raises(LockTimeout, match="pids {0}".format(os.getpid())):
+        second.acquire(shared=False)
+    first.release()
+    second.acquire(shared=False)
+    second.release()
+
+
+def test_unopenable_lock_file(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    lock = HostLock(str(blocker / "x.lock"), timeout=1)
+    with pytest.raises(LockError, match="Could not open the lock file {0}".format(blocker / "x.lock.queue")):
+        lock.acquire()
+    assert lock.fd is None and lock.ticket is None
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Mirrors repositories from a local HTTP server and from file URLs.
+"""
+
+import os
+import re
+import threading
+
+import pytest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from ansible.module_utils.ibmim_mirror import Mirror, MirrorError, relativePath
+
+BIG = 300 * 1024
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Serves server.files, a dict of path to (content, etag), with ranges the
+    way Apache does: a Range is honoured unless If-Range names another ETag.
+    Directories get a listing of what is in them.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def _file(self):
+        path = self.path.lstrip("/")
+        if path == "" or path.endswith("/"):
+            children = set([rel[len(path):].split("/")[0] + ("/" if "/" in rel[len(path):] else "")
+                            for rel in self.server.files if rel.startswith(path)])
+            links = "".join(['<a href="{0}">{0}</a>'.format(child) for child in sorted(children)])
+            return ('<html><body><a href="../">Parent</a>{0}</body></html>'.format(links).encode('ascii'), '"dir"')
+        if path not in self.server.files:
+            self.send_error(404)
+            return None
+        return self.server.files[path]
+
+    def do_HEAD(self):
+        found = self._file()
+        if found:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(found[0])))
+            self.send_header("ETag", found[1])
+            self.end_headers()
+
+    def do_GET(self):
+        found = self._file()
+        if not found:
+            return
+        content, etag = found
+        self.server.requests.append((self.path, self.headers.get('Range'), self.headers.get('If-Range')))
+        match = re.match(r"bytes=(\d+)-$", self.headers.get('Range') or "")
+        offset = 0
+        if match and self.headers.get('If-Range') in (None, etag):
+            offset = int(match.group(1))
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(offset, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(content) - offset))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if self.server.cut:
+            # Hang up halfway through the body
+            self.wfile.write(content[offset:offset + self.server.cut])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(content[offset:])
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def repository():
+    server = Server(("127.0.0.1", 0), Handler)
+    server.files = {
+        "repository.config": (b"LayoutPolicy=Composite\n", '"c1"'),
+        "native/big.bin": (os.urandom(BIG), '"v1"'),
+    }
+    server.requests = []
+    server.cut = None
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    server.url = "http://127.0.0.1:{0}/".format(server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def read(path):
+    f = open(path, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def bigRequests(server):
+    return [r for r in server.requests if r[0] == "/native/big.bin"]
+
+
+def interrupt(repository, cache_dir):
+    """
+    Syncs with the download of big.bin cut off after 100 KB
+    """
+    repository.cut = 100 * 1024
+    mirror = Mirror(repository.url, cache_dir)
+    with pytest.raises(MirrorError, match="interrupted"):
+        mirror.sync()
+    repository.cut = None
+    del repository.requests[:]
+
+
+def test_interrupted_download_is_resumed(repository, tmp_path):
+    interrupt(repository, str(tmp_path))
+
+    mirror = Mirror(repository.url, str(tmp_path))
+    config = mirror.sync()
+
+    assert bigRequests(repository) == [("/native/big.bin", "bytes={0}-".format(100 * 1024), '"v1"')]
+    assert mirror.stats['resumed'] == 1
+    assert read(os.path.join(os.path.dirname(config), "native", "big.bin")) == repository.files["native/big.bin"][0]
+
+
+def test_changed_file_is_downloaded_again(repository, tmp_path):
+    interrupt(repository, str(tmp_path))
+
+    # The file changes before the next run, so the partial one is useless
+    repository.files["native/big.bin"] = (os.urandom(BIG), '"v2"')
+    mirror = Mirror(repository.url, str(tmp_path))
+    config = mirror.sync()
+
+    # If-Range names the version the partial file was started on, so the server sends all of the new one
+    assert bigRequests(repository) == [("/native/big.bin", "bytes={0}-".format(100 * 1024), '"v1"')]
+    assert mirror.stats['resumed'] == 0
+    assert read(os.path.join(os.path.dirname(config), "native", "big.bin")) == repository.files["native/big.bin"][0]
+
+
+def test_unchanged_files_are_reused(repository, tmp_path):
+    first = Mirror(repository.url, str(tmp_path))
+    first.sync()
+    del repository.requests[:]
+
+    second = Mirror(repository.url, str(tmp_path))
+    second.sync()
+    # Only the directory listings are read again
+    assert [r for r in repository.requests if not r[0].endswith("/")] == []
+    assert second.stats['reused'] == 2
+
+
+@pytest.mark.parametrize("path, rel", [
+    ("repository.config", "repository.config"),
+    ("./repository.config", "repository.config"),
+    ("./.index.json", ".index.json"),
+    (".hidden/file", ".hidden/file"),
+    ("native/./big.bin", "native/big.bin"),
+    ("native/x/../big.bin", "native/big.bin"),
+])
+def test_relativePath(path, rel):
+    assert relativePath(path) == rel
+
+
+@pytest.mark.parametrize("path", ["../x", "a/../../x", "/etc/passwd", "..", ".", "./"])
+def test_relativePath_outside(path):
+    with pytest.raises(MirrorError):
+        relativePath(path)
+
+
+def manifestMirror(tmp_path, lines):
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    (remote / "files.sha256").write_text("\n".join(lines) + "\n")
+    return Mirror("file://" + str(remote), str(tmp_path / "cache"), manifest="files.sha256")
+
+
+def test_manifest_paths(tmp_path):
+    mirror = manifestMirror(tmp_path, [
+        "AA  ./repository.config",
+        "bb *./native/big.bin",
+        "cc  .index.json",
+    ])
+    assert mirror.listFiles() == {"repository.config": "aa", "native/big.bin": "bb", ".index.json": "cc"}
+
+
+@pytest.mark.parametrize("path", ["../x", "a/../../x", "/etc/passwd"])
+def test_manifest_paths_outside(tmp_path, path):
+    mirror = manifestMirror(tmp_path, ["aa  repository.config", "bb  " + path])
+    with pytest.raises(MirrorError, match="not a path within the repository"):
+        mirror.listFiles()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Reads the installed packages of a package installed in two directories.
+"""
+
+from ansible.module_utils.ibmim_registry import findPackage, findUpdates, parseListInstalled, readInstallRegistry
+
+REGISTRY = """<?xml version="1.0" encoding="UTF-8"?>
+<installRegistry>
+<profile id="IBM WebSphere Application Server V8.5" kind="product">
+<offering id="com.ibm.websphere.ND.v85" version="8.5.5000.20130514_1044"/>
+<property name="installLocation" value="{0}/was1"/>
+</profile>
+<profile id="IBM WebSphere Application Server V8.5_1" kind="product">
+<property name="installLocation" value="{0}/was2"/>
+<offering id="com.ibm.websphere.ND.v85" version="8.5.5009.20160225_0435"/>
+</profile>
+</installRegistry>
+"""
+
+
+def test_package_in_two_directories(tmp_path):
+    path = tmp_path / "installRegistry.xml"
+    path.write_text(REGISTRY.format(tmp_path))
+    packages = readInstallRegistry(str(path))
+    assert len(packages) == 2
+
+    first = findPackage(packages, "com.ibm.websphere.ND.v85", str(tmp_path / "was1"))
+    assert first['version'] == "8.5.5000.20130514_1044"
+    assert first['name'] == "IBM WebSphere Application Server V8.5"
+    second = findPackage(packages, "com.ibm.websphere.ND.v85", str(tmp_path / "was2") + "/")
+    assert second['version'] == "8.5.5009.20160225_0435"
+    assert findPackage(packages, "com.ibm.websphere.ND.v85", str(tmp_path / "was3")) is None
+    assert findPackage(packages, "com.ibm.websphere.ND.v85_8.5.5009.20160225_0435")['path'] == str(tmp_path / "was2")
+    assert findPackage(packages, "com.ibm.websphere.ND.v85")['path'] == str(tmp_path / "was1")
+
+    updates = findUpdates(packages, {"com.ibm.websphere.ND.v85": ["8.5.5009.20160225_0435"]})
+    assert [u['path'] for u in updates] == [str(tmp_path / "was1")]
+
+
+def test_listInstalledPackages_in_two_directories():
+    packages = parseListInstalled(
+        "/opt/was1 : com.ibm.websphere.ND.v85_8.5.5000.20130514_1044 : IBM WebSphere Application Server Network Deployment : 8.5.5.0\n"
+        "/opt/was2 : com.ibm.websphere.ND.v85_8.5.5009.20160225_0435 : IBM WebSphere Application Server Network Deployment : 8.5.5.9\n"
+    )
+    assert sorted([p['path'] for p in packages.values()]) == ["/opt/was1", "/opt/was2"]
+    assert findPackage(packages, "com.ibm.websphere.ND.v85", "/opt/was2")['version'] == "8.5.5009.20160225_0435"
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Indexes a repository directory and caches the index.
+"""
+
+import os
+
+from ansible.module_utils.ibmim_repository import cachePath, repositoryIndex
+
+
+def repository(tmp_path):
+    path = tmp_path / "repo"
+    (path / "Offerings").mkdir(parents=True)
+    (path / "repository.config").write_text("LayoutPolicy=Composite\n")
+    (path / "Offerings" / "com.ibm.websphere.ND.v85_8.5.5000.20130514_1044.jar").write_text("")
+    return path
+
+
+def test_index_is_cached_outside_the_repository(tmp_path):
+    repo = repository(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    before = sorted(os.listdir(str(repo)))
+
+    index, cached = repositoryIndex(str(repo), cache_dir)
+    assert index['offerings'] == {"com.ibm.websphere.ND.v85": ["8.5.5000.20130514_1044"]}
+    assert not cached
+    assert sorted(os.listdir(str(repo))) == before
+    assert os.path.dirname(cachePath(str(repo), cache_dir)) == cache_dir
+    assert os.path.exists(cachePath(str(repo), cache_dir))
+
+    index, cached = repositoryIndex(str(repo), cache_dir)
+    assert cached
+
+
+def test_index_is_built_again_when_the_repository_changes(tmp_path):
+    repo = repository(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    repositoryIndex(str(repo), cache_dir)
+
+    (repo / "Offerings" / "com.ibm.websphere.ND.v85_8.5.5009.20160225_0435.jar").write_text("")
+    os.utime(str(repo / "Offerings"), (1, 1))
+    index, cached = repositoryIndex(str(repo), cache_dir)
+    assert not cached
+    assert sorted(index['offerings']["com.ibm.websphere.ND.v85"]) == ["8.5.5000.20130514_1044", "8.5.5009.20160225_0435"]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Indexes a configuration repository with two cells that use the same node
+and cluster names.
+"""
+
+import os
+
+from ansible.module_utils.was_config import buildIndex
+
+SERVERINDEX = """<serverindex:ServerIndex xmlns:serverindex="x" hostName="{0}">
+<serverEntries serverName="server1" serverType="APPLICATION_SERVER">
+<specialEndpoints endPointName="WC_defaulthost"><endPoint host="*" port="{1}"/></specialEndpoints>
+</serverEntries>
+</serverindex:ServerIndex>
+"""
+
+CLUSTER = """<topology.cluster:ServerCluster xmlns:topology.cluster="x" name="cluster1">
+<members memberName="server1" nodeName="node01" weight="{0}"/>
+</topology.cluster:ServerCluster>
+"""
+
+
+def write(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    f = open(path, 'w')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
+def test_same_node_name_in_two_cells(tmp_path):
+    profile = str(tmp_path / "dmgr")
+    for cell, host, port, weight in (("cellA", "hostA", 9080, 2), ("cellB", "hostB", 9081, 3)):
+        cell_dir = os.path.join(profile, "config", "cells", cell)
+        write(os.path.join(cell_dir, "nodes", "node01", "serverindex.xml"), SERVERINDEX.format(host, port))
+        write(os.path.join(cell_dir, "clusters", "cluster1", "cluster.xml"), CLUSTER.format(weight))
+
+    index, parsed = buildIndex(profile)
+    assert parsed == 4
+    assert sorted(index['cells']) == ["cellA", "cellB"]
+    assert index['cells']['cellA']['nodes']['node01']['host'] == "hostA"
+    assert index['cells']['cellB']['nodes']['node01']['host'] == "hostB"
+    assert index['cells']['cellB']['nodes']['node01']['servers']['server1']['endpoints']['WC_defaulthost']['port'] == 9081
+    assert index['cells']['cellA']['clusters']['cluster1']['members'][0]['weight'] == 2
+    assert index['cells']['cellB']['clusters']['cluster1']['members'][0]['weight'] == 3
+    assert [(e['cell'], e['host'], e['port']) for e in index['endpoints']] == [("cellA", "hostA", 9080), ("cellB", "hostB", 9081)]
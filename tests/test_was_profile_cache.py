@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Archives a profile laid out like one from manageprofiles.sh and clones it.
+"""
+
+import os
+import tarfile
+import threading
+
+import pytest
+
+from ansible.module_utils.was_profile_cache import ProfileCacheError, clone, createFromCache, keysAction, lookup, store
+from ansible.module_utils.was_profiles import profilePorts
+
+SERVERINDEX = """<serverindex:ServerIndex xmlns:serverindex="x" hostName="{0}">
+<serverEntries serverName="nodeagent" serverType="NODE_AGENT">
+<specialEndpoints endPointName="SOAP_CONNECTOR_ADDRESS"><endPoint host="{0}" port="8878"/></specialEndpoints>
+</serverEntries>
+</serverindex:ServerIndex>
+"""
+
+
+def write(path, data):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    f = open(path, 'wb')
+    try:
+        f.write(data.encode('utf-8'))
+    finally:
+        f.close()
+
+
+def read(path):
+    f = open(path, 'rb')
+    try:
+        return f.read().decode('utf-8')
+    finally:
+        f.close()
+
+
+@pytest.fixture
+def profile(tmp_path):
+    path = str(tmp_path / "profiles" / "p1")
+    node = os.path.join(path, "config", "cells", "cell01", "nodes", "node01")
+    write(os.path.join(path, "bin", "setupCmdLine.sh"), "WAS_CELL=cell01\nWAS_NODE=node01\nUSER_INSTALL_ROOT={0}\n".format(path))
+    write(os.path.join(node, "serverindex.xml"), SERVERINDEX.format("host01"))
+    write(os.path.join(node, "key.p12"), "private key of node01")
+    write(os.path.join(node, "trust.p12"), "trusted certificates")
+    write(os.path.join(path, "config", "cells", "cell01", "ltpa.jceks"), "ltpa keys")
+    write(os.path.join(path, "etc", "DummyServerKeyFile.jks"), "dummy key")
+    write(os.path.join(path, "logs", "notes.txt"), "node01 on host01")
+    return path
+
+
+@pytest.fixture
+def action(tmp_path):
+    path = str(tmp_path / "was" / "profileTemplates" / "managed" / "actions" / "generateKeysForSingleProfile.ant")
+    write(path, "<project/>")
+    return path
+
+
+def test_keysAction(tmp_path, action):
+    wasdir = str(tmp_path / "was")
+    assert keysAction(wasdir, "managed") == action
+    assert keysAction(wasdir, "management") is None
+
+
+def test_keystores_are_not_archived(tmp_path, profile, action):
+    cache_dir = str(tmp_path / "cache")
+    archive = store(cache_dir, "k", "p1", profile, action)
+
+    tar = tarfile.open(archive)
+    try:
+        names = tar.getnames()
+    finally:
+        tar.close()
+    assert "config/cells/cell01/nodes/node01/serverindex.xml" in names
+    assert "config/cells/cell01/nodes/node01/key.p12" not in names
+    assert "config/cells/cell01/nodes/node01/trust.p12" not in names
+    assert "config/cells/cell01/ltpa.jceks" not in names
+    # Shipped with every profile, not generated for it
+    assert "etc/DummyServerKeyFile.jks" in names
+    assert lookup(cache_dir, "k")['keys_action'] == action
+
+
+def test_not_cached_without_key_action(tmp_path, profile):
+    with pytest.raises(ProfileCacheError, match="no action generating keystores"):
+        store(str(tmp_path / "cache"), "k", "p1", profile, None)
+    assert lookup(str(tmp_path / "cache"), "k") is None
+
+
+def test_only_configuration_files_are_rewritten(tmp_path, profile, action):
+    cache_dir = str(tmp_path / "cache")
+    write(os.path.join(profile, "properties", "notes.txt"), "node01 on host01")
+    write(os.path.join(profile, "properties", "wsadmin.properties"), "host=host01\n")
+    store(cache_dir, "k", "p1", profile, action)
+    meta = lookup(cache_dir, "k")
+
+    path = str(tmp_path / "profiles" / "p2")
+    clone(cache_dir, "k", meta, "p2", path, dict(cell="cell02", node="node02", host="host02"), set())
+
+    node = os.path.join(path, "config", "cells", "cell02", "nodes", "node02")
+    assert read(os.path.join(path, "bin", "setupCmdLine.sh")) == "WAS_CELL=cell02\nWAS_NODE=node02\nUSER_INSTALL_ROOT={0}\n".format(path)
+    assert 'hostName="host02"' in read(os.path.join(node, "serverindex.xml"))
+    assert read(os.path.join(path, "properties", "wsadmin.properties")) == "host=host02\n"
+    assert read(os.path.join(path, "properties", "notes.txt")) == "node01 on host01"
+    assert not os.path.exists(os.path.join(node, "key.p12"))
+
+
+class FakeModule(object):
+    """
+    Runs no commands, so the clones are never registered and only the ports
+    reserved for them keep them apart
+    """
+
+    def runCommand(self, args, label=None, **kwargs):
+        return 0, "", ""
+
+
+def test_concurrent_clones_get_their_own_ports(tmp_path, profile, action):
+    cache_dir = str(tmp_path / "cache")
+    wasdir = str(tmp_path / "was")
+    store(cache_dir, "k", "p1", profile, action)
+    meta = lookup(cache_dir, "k")
+    os.makedirs(os.path.join(wasdir, "properties"))
+
+    results = {}
+    start = threading.Event()
+
+    def create(name):
+        start.wait()
+        results[name] = createFromCache(FakeModule(), cache_dir, "k", meta, wasdir, name, os.path.join(wasdir, "profiles", name),
+                                        dict(cell="cell01", node=name, host="host01"))
+
+    threads = [threading.Thread(target=create, args=(name,)) for name in ("p2", "p3", "p4")]
+    for t in threads:
+        t.start()
+    start.set()
+    for t in threads:
+        t.join()
+
+    assert [results[name][0] for name in ("p2", "p3", "p4")] == [0, 0, 0]
+    ports = [profilePorts(os.path.join(wasdir, "profiles", name)) for name in ("p2", "p3", "p4")]
+    assert all(ports)
+    assert len(set.union(*ports)) == sum([len(p) for p in ports])
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Waits for servers of the local profile and of other nodes to become ready.
+"""
+
+import importlib.util
+import os
+import time
+
+import pytest
+
+pytest.importorskip("ansible.module_utils.basic")
+
+spec = importlib.util.spec_from_file_location("was_server", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "library", "was_server.py"))
+was_server = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(was_server)
+
+
+class FakeModule(object):
+
+    def __init__(self, **params):
+        self.params = dict(wsadmin=True, wasdir=None, profile_path=None, ready_message='WSVR0001I',
+                           ready_error='WSVR0009E', ready_timeout=5)
+        self.params.update(params)
+
+
+@pytest.fixture
+def module(tmp_path):
+    profile = tmp_path / "profile"
+    (profile / "bin").mkdir(parents=True)
+    (profile / "bin" / "setupCmdLine.sh").write_text("WAS_CELL=cell01\nWAS_NODE=node01\n")
+    (profile / "logs" / "server1").mkdir(parents=True)
+    return FakeModule(profile_path=str(profile))
+
+
+def test_local_server_is_followed(module):
+    tail = was_server.followLog(module, "server1", "node01")
+    assert tail is not None
+    log = open(os.path.join(module.params['profile_path'], "logs", "server1", "SystemOut.log"), 'a')
+    try:
+        log.write("[1/1/17] WSVR0001I: Server server1 open for e-business\n")
+    finally:
+        log.close()
+    ready = was_server.serverReady(module, "server1", tail, 'STARTED')
+    assert ready['ready']
+    assert "WSVR0001I" in ready['ready_line']
+
+
+def test_remote_server_is_judged_by_its_state(module):
+    # server1 of node02 writes its log on another host, it never shows up here
+    tail = was_server.followLog(module, "server1", "node02")
+    assert tail is None
+
+    start = time.time()
+    ready = was_server.serverReady(module, "server1", tail, 'STARTED')
+    assert ready['ready']
+    assert "another node" in ready['ready_line']
+    assert time.time() - start < module.params['ready_timeout']
+
+    assert not was_server.serverReady(module, "server1", tail, 'STOPPED')['ready']
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Drives AdminClient against a local HTTP server standing in for the SOAP
+connector of a deployment manager.
+"""
+
+import base64
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import pytest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from ansible.module_utils.was_soap import POOL, SOAP_ENV, AdminClient, SoapError, serializeArray, serializedStrings
+
+SERVER = "WebSphere:name=server1,process=server1,platform=proxy,node=node01,type=Server,cell=cell01"
+AGENT = "WebSphere:name=NodeAgent,process=nodeagent,node=node01,type=NodeAgent,cell=cell01"
+
+RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="{0}" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<SOAP-ENV:Body>{1}</SOAP-ENV:Body>
+</SOAP-ENV:Envelope>"""
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        root = ET.fromstring(body)
+        request = root.find("{{{0}}}Body".format(SOAP_ENV))[0]
+        operation = request.tag.split('}')[-1]
+        args = dict((child.tag, child.text) for child in request)
+        self.server.requests.append((operation, args, self.headers.get('Authorization')))
+
+        if operation == 'queryNames' and args['objectname'].startswith("WebSphere:type=NodeAgent"):
+            # Sets come back as serialized Java objects
+            result = '<return xsi:type="ns1:java.util.Set">{0}</return>'.format(serializeArray([AGENT]))
+        elif operation == 'queryNames' and args['objectname'] == "WebSphere:type=Nothing,*":
+            result = '<return/>'
+        elif operation == 'queryNames':
+            result = '<return><item>{0}</item><item>not an object name</item></return>'.format(SERVER)
+        elif operation == 'invoke' and self.server.hangup:
+            # Acted on, but the connection is lost before the response
+            self.close_connection = True
+            return
+        elif operation == 'getAttribute' and args['attribute'] == 'state':
+            state = self.server.states.pop(0) if self.server.states else 'STARTED'
+            result = '<return xsi:type="xsd:string">{0}</return>'.format(state)
+        elif operation == 'invoke' and args['operationname'] == 'launchProcess' and not self.server.launch:
+            result = '<return xsi:type="xsd:boolean">false</return>'
+        elif operation == 'getAttribute':
+            result = '<SOAP-ENV:Fault><faultcode>SOAP-ENV:Server</faultcode><faultstring>AttributeNotFoundException: {0}</faultstring></SOAP-ENV:Fault>'.format(args['attribute'])
+        elif operation == 'invoke':
+            # Echo the arguments, to show they were serialized properly
+            params = serializedStrings(base64.b64decode(args['params']))
+            signature = serializedStrings(base64.b64decode(args['signature']))
+            result = '<return xsi:type="xsd:string">{0}({1})</return>'.format(args['operationname'], ",".join(params + signature))
+        else:
+            result = '<return xsi:nil="true"/>'
+
+        data = RESPONSE.format(SOAP_ENV, result).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        if self.server.close:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(data)
+        if self.server.drop:
+            # Hang up without telling, like a connector closing idle connections
+            self.close_connection = True
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def connector():
+    server = Server(("127.0.0.1", 0), Handler)
+    server.connections = 0
+    server.requests = []
+    server.close = False
+    server.drop = False
+    server.hangup = False
+    server.launch = True
+    server.states = []
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    POOL.close()
+    yield server
+    POOL.close()
+    server.shutdown()
+    server.server_close()
+
+
+def client(server, **kwargs):
+    return AdminClient("127.0.0.1", server.server_address[1], secure=False, **kwargs)
+
+
+def test_queryNames(connector):
+    c = client(connector)
+    assert c.queryNames("WebSphere:type=Server,*") == [SERVER]
+    assert c.queryNames("WebSphere:type=NodeAgent,*") == [AGENT]
+    assert c.queryNames("WebSphere:type=Nothing,*") == []
+    assert c.completeObjectName("WebSphere:type=Nothing,*") == ""
+    operation, args, auth = connector.requests[0]
+    assert operation == 'queryNames'
+    assert args['objectname'] == "WebSphere:type=Server,*"
+    assert auth is None
+
+
+def test_getAttribute(connector):
+    c = client(connector, username="wasadmin", password="secret")
+    assert c.getAttribute(SERVER, "state") == "STARTED"
+    assert connector.requests[0][1]['objectname'] == SERVER
+    assert connector.requests[0][2] == "Basic " + base64.b64encode(b"wasadmin:secret").decode('ascii')
+    with pytest.raises(SoapError, match="AttributeNotFoundException: pid"):
+        c.getAttribute(SERVER, "pid")
+
+
+def test_invoke(connector):
+    c = client(connector)
+    assert c.invoke(AGENT, "launchProcess", ["server1"], ["java.lang.String"]) == "launchProcess(server1,java.lang.String)"
+    assert c.invoke(SERVER, "stop") == "stop()"
+
+
+def test_serverState(connector):
+    c = client(connector)
+    assert c.serverState("server1", "node01") == "STARTED"
+    assert connector.requests[0][1]['objectname'] == "WebSphere:type=Server,node=node01,process=server1,*"
+
+
+def test_connections_are_reused(connector):
+    c = client(connector)
+    for i in range(5):
+        c.queryNames("WebSphere:type=Server,*")
+    # Another client of the same connector takes the connection from the pool
+    client(connector).getAttribute(SERVER, "state")
+    assert len(connector.requests) == 6
+    assert connector.connections == 1
+
+
+def test_connections_closed_by_the_connector_are_not_reused(connector):
+    connector.close = True
+    c = client(connector)
+    for i in range(3):
+        c.queryNames("WebSphere:type=Server,*")
+    assert connector.connections == 3
+
+
+def test_dropped_connection_is_retried(connector):
+    connector.drop = True
+    c = client(connector)
+    for i in range(3):
+        assert c.getAttribute(SERVER, "state") == "STARTED"
+        # The connector hangs up while the connection is idle
+        time.sleep(0.2)
+    # Every request after the first finds its pooled connection dead and takes a new one
+    assert len(connector.requests) == 3
+    assert connector.connections == 3
+
+
+def test_request_is_not_sent_twice(connector):
+    connector.hangup = True
+    c = client(connector)
+    with pytest.raises(SoapError, match="Failed talking to"):
+        c.invoke(AGENT, "launchProcess", ["server1"], ["java.lang.String"])
+    assert [r[0] for r in connector.requests] == ['invoke']
+
+
+def test_startServer(connector):
+    connector.states = ['STARTING', 'STARTED']
+    c = client(connector)
+    c.poll = 0.01
+    assert c.startServer("server1", "node01", timeout=5) == 'STARTED'
+
+
+def test_startServer_stops_waiting_when_the_server_stops(connector):
+    connector.states = ['STARTING', 'STOPPED'] + ['STARTING'] * 1000
+    c = client(connector)
+    c.poll = 0.01
+    start = time.time()
+    with pytest.raises(SoapError, match="failed to start, it is STOPPED"):
+        c.startServer("server1", "node01", timeout=60)
+    assert time.time() - start < 5
+
+
+def test_startServer_launch_failed(connector):
+    connector.launch = False
+    c = client(connector)
+    with pytest.raises(SoapError, match="could not launch server server1"):
+        c.startServer("server1", "node01", timeout=60)
+    assert connector.requests[-1][0] == 'invoke'
+
+
+def test_connector_down():
+    POOL.close()
+    c = AdminClient("127.0.0.1", 1, secure=False, timeout=5)
+    with pytest.raises(SoapError, match="Failed talking to 127.0.0.1:1"):
+        c.queryNames("WebSphere:type=Server,*")
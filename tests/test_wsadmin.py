@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Hashes the inputs of a wsadmin run for the result cache.
+"""
+
+import importlib.util
+import os
+
+import pytest
+
+pytest.importorskip("ansible.module_utils.basic")
+
+spec = importlib.util.spec_from_file_location("wsadmin", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "library", "wsadmin.py"))
+wsadmin = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(wsadmin)
+
+
+class FakeModule(object):
+
+    def __init__(self, **params):
+        self.params = dict(wasdir='/opt/IBM/WebSphere/AppServer', host='localhost', port='8879', save='end',
+                           scripts=None, username=None, guard=None)
+        self.params.update(params)
+
+
+STEPS = [dict(script=None, command="print AdminConfig.list('Server')", params='')]
+
+
+def test_cacheKey_covers_the_user_and_the_guard():
+    keys = set([
+        wsadmin.cacheKey(FakeModule(), STEPS),
+        wsadmin.cacheKey(FakeModule(username='wasadmin'), STEPS),
+        wsadmin.cacheKey(FakeModule(username='operator'), STEPS),
+        wsadmin.cacheKey(FakeModule(guard="print AdminConfig.list('ServerCluster')"), STEPS),
+        wsadmin.cacheKey(FakeModule(guard="print AdminConfig.list('Node')"), STEPS),
+    ])
+    assert len(keys) == 5
+    assert wsadmin.cacheKey(FakeModule(username='wasadmin'), STEPS) == wsadmin.cacheKey(FakeModule(username='wasadmin'), STEPS)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Runs persistent wsadmin sessions against a fake wsadmin.sh, a script that
+talks on stdin and stdout the way interactive wsadmin does.
+"""
+
+import errno
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+from ansible.module_utils.wsadmin_session import WsadminSession, WsadminSessionError, _recv, wsadmin_command
+
+# Understands what the session sends: print '...' to check that wsadmin is
+# up, execfile() of the wrapper, and exit. The scripts run in the wrapper
+# may print '...', print their pid, sys.exit(n) and crash.
+FAKE_WSADMIN = r'''#!%(python)s
+import os
+import re
+import sys
+
+def out(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+out("WASX7209I: Connected to process \"dmgr\" on node fakeNode\n")
+out("wsadmin>")
+for line in iter(sys.stdin.readline, ""):
+    line = line.strip()
+    if line == "exit":
+        break
+    match = re.match(r"^print '(.*)'$", line)
+    if match:
+        out(match.group(1) + "\n")
+    match = re.match(r"^execfile\('(.*)'\)$", line)
+    if match:
+        wrapper = open(match.group(1)).read()
+        script = re.search(r"execfile\('([^']*)', __ansible_g\)", wrapper).group(1)
+        marker = re.search(r"print '(\S+ \S+) %%d'", wrapper).group(1)
+        rc = 0
+        for statement in open(script).read().splitlines():
+            printed = re.match(r"^print '(.*)'$", statement)
+            exited = re.match(r"^sys.exit\((\d+)\)$", statement)
+            if printed:
+                out(printed.group(1) + "\n")
+            elif statement == "print pid":
+                out("%%d\n" %% os.getpid())
+            elif statement == "crash":
+                os._exit(1)
+            elif exited:
+                rc = int(exited.group(1))
+                break
+        out("%%s %%d\n" %% (marker, rc))
+    out("wsadmin>")
+'''
+
+
+@pytest.fixture
+def wasdir(tmp_path):
+    bindir = tmp_path / "was" / "bin"
+    bindir.mkdir(parents=True)
+    script = bindir / "wsadmin.sh"
+    script.write_text(FAKE_WSADMIN % dict(python=sys.executable))
+    script.chmod(0o755)
+    return str(tmp_path / "was")
+
+
+@pytest.fixture
+def session(wasdir, tmp_path):
+    sessions = []
+
+    def make(idle_timeout=60):
+        s = WsadminSession(wsadmin_command(wasdir, conntype=None), session_dir=str(tmp_path / "s"), idle_timeout=idle_timeout, start_timeout=30)
+        sessions.append(s)
+        return s
+
+    yield make
+    for s in sessions:
+        s.stop()
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def wait_for(condition, timeout=15):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+
+def test_output_is_framed_by_the_marker(session):
+    s = session()
+    rc, stdout_value = s.run(code="print 'hello'\nprint 'world'\n")
+    assert (rc, stdout_value) == (0, "hello\nworld\n")
+
+    # Prompts and the startup banner stay out of the output, the exit status is the script's
+    rc, stdout_value = s.run(code="print 'partial'\nsys.exit(3)\nprint 'never'\n")
+    assert (rc, stdout_value) == (3, "partial\n")
+
+
+def test_session_is_reused(session):
+    s = session()
+    rc, first = s.run(code="print pid\n")
+    rc, second = s.run(code="print pid\n")
+    assert first == second
+    assert not s.restarted
+
+    # A new client with the same command line finds the same daemon
+    rc, third = session().run(code="print pid\n")
+    assert third == first
+
+
+def test_daemon_exits_when_idle(session):
+    s = session(idle_timeout=1)
+    rc, stdout_value = s.run(code="print pid\n")
+    pid = int(stdout_value)
+    assert os.path.exists(s.socket_path)
+
+    assert wait_for(lambda: not os.path.exists(s.socket_path))
+    assert wait_for(lambda: not alive(pid))
+
+    # The next request starts a new daemon and wsadmin
+    rc, stdout_value = s.run(code="print pid\n")
+    assert int(stdout_value) != pid
+
+
+def test_crashed_wsadmin_is_restarted(session):
+    s = session()
+    rc, stdout_value = s.run(code="print pid\n")
+    with pytest.raises(WsadminSessionError):
+        s.run(code="crash\n")
+    rc, again = s.run(code="print pid\n")
+    assert again != stdout_value
+    assert s.restarted
+
+
+def test_dropped_connection_is_retried_once(session):
+    s = session()
+    os.makedirs(s.session_dir, 0o700)
+
+    # A daemon that goes away without answering, like one reaching its
+    # idle timeout just as the client connects
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(s.socket_path)
+    listener.listen(1)
+    requests = []
+
+    def drop():
+        conn = listener.accept()[0]
+        requests.append(_recv(conn))
+        os.unlink(s.socket_path)
+        listener.close()
+        conn.close()
+
+    t = threading.Thread(target=drop)
+    t.start()
+    rc, stdout_value = s.run(code="print 'after retry'\n")
+    t.join()
+
+    assert len(requests) == 1
+    assert (rc, stdout_value) == (0, "after retry\n")
+    assert s.restarted
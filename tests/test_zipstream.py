@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2015 Amir Mofasser <amir.mofasser@gmail.com> (@amimof)
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Extracts archives written by zipfile while reading them front to back.
+"""
+
+import hashlib
+import io
+import os
+import stat
+import struct
+import zipfile
+
+import pytest
+
+from ansible.module_utils.zipstream import LOCAL, ZipStreamError, extract
+
+
+class Unseekable(object):
+    """
+    Write side of a pipe: zipfile can't go back to fill in the sizes and
+    writes them to a data descriptor after each entry instead
+    """
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+    def flush(self):
+        pass
+
+
+class Stream(object):
+    """
+    Read side, handing out a few bytes at a time like a download does
+    """
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self.data.read(min(size, 1000) if size >= 0 else 1000)
+
+
+def entry(name, mode=None, compress=zipfile.ZIP_DEFLATED):
+    info = zipfile.ZipInfo(name)
+    info.compress_type = compress
+    info.create_system = 3
+    if mode is not None:
+        info.external_attr = mode << 16
+    return info
+
+
+def archive(entries, stream=False):
+    out = Unseekable() if stream else io.BytesIO()
+    z = zipfile.ZipFile(out, 'w')
+    try:
+        for info, data in entries:
+            z.writestr(info, data)
+    finally:
+        z.close()
+    return (out.buffer if stream else out).getvalue()
+
+
+def test_entries_and_checksum(tmp_path):
+    data = archive([
+        (entry("tools/"), b""),
+        (entry("tools/imcl", compress=zipfile.ZIP_STORED), b"#!/bin/sh\n"),
+        (entry("install.xml"), b"<agent-input/>" * 1000),
+    ])
+    digest = hashlib.sha256()
+    assert extract(Stream(data), str(tmp_path), digest=digest) == ["tools/imcl", "install.xml"]
+    assert digest.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert (tmp_path / "install.xml").read_bytes() == b"<agent-input/>" * 1000
+
+
+def test_entry_outside_of_dest(tmp_path):
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    data = archive([(entry("../evil.sh"), b"rm -rf /")])
+    with pytest.raises(ZipStreamError, match="Refusing to extract ../evil.sh"):
+        extract(Stream(data), str(dest))
+    assert not (tmp_path / "evil.sh").exists()
+
+
+def test_symlink(tmp_path):
+    data = archive([
+        (entry("eclipse/IBMIM", 0o100755), b"\x7fELF"),
+        (entry("IBMIM", stat.S_IFLNK | 0o777), b"eclipse/IBMIM"),
+    ])
+    extract(Stream(data), str(tmp_path))
+    assert os.path.islink(str(tmp_path / "IBMIM"))
+    assert os.readlink(str(tmp_path / "IBMIM")) == "eclipse/IBMIM"
+    assert (tmp_path / "IBMIM").read_bytes() == b"\x7fELF"
+
+
+def test_data_descriptor(tmp_path):
+    data = archive([
+        (entry("a.txt"), b"first entry " * 100),
+        (entry("b.txt"), b"second entry " * 100),
+    ], stream=True)
+    flags = struct.unpack("<H", data[len(LOCAL) + 2:len(LOCAL) + 4])[0]
+    assert flags & 0x08
+    assert extract(Stream(data), str(tmp_path)) == ["a.txt", "b.txt"]
+    assert (tmp_path / "a.txt").read_bytes() == b"first entry " * 100
+    assert (tmp_path / "b.txt").read_bytes() == b"second entry " * 100
+
+
+def test_modes_from_the_central_directory(tmp_path):
+    data = archive([
+        (entry("installc", 0o100755), b"#!/bin/sh\n"),
+        (entry("private.properties", 0o100600), b"password=\n"),
+    ])
+    extract(Stream(data), str(tmp_path))
+    assert stat.S_IMODE(os.stat(str(tmp_path / "installc")).st_mode) == 0o755
+    assert stat.S_IMODE(os.stat(str(tmp_path / "private.properties")).st_mode) == 0o600
+
+
+def test_wanted(tmp_path):
+    data = archive([(entry("keep.txt"), b"keep"), (entry("skip.txt"), b"skip")])
+    assert extract(Stream(data), str(tmp_path), wanted=lambda name: name != "skip.txt") == ["keep.txt"]
+    assert not (tmp_path / "skip.txt").exists()